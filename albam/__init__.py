@@ -7,8 +7,8 @@ except ImportError:
 # TODO: remove and use something like app.init()
 if bpy:
     from albam.registry import register, unregister
+    # Engines are imported by the registry when first used, see albam.engines
     import albam.ui.blender
-    from albam.engines.mtframework import blender_import,  blender_export
 
 
 bl_info = {
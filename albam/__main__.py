@@ -0,0 +1,6 @@
+import sys
+
+from albam.cli import main
+
+
+sys.exit(main())
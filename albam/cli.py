@@ -0,0 +1,256 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import sys
+import traceback
+
+from albam.engines.mtframework import Arc, Mod156, Tex112
+from albam.engines.mtframework.arc import unpack_file, verify_file
+from albam.engines.mtframework.index import ArcIndex, DEFAULT_INDEX_PATH
+from albam.engines.mtframework.tex import tex_file_to_dds, dds_file_to_tex, get_mipmap_bias, read_tex_header
+from albam.lib.misc import find_files
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='albam', description='Albam command line tools, no Blender needed')
+    subparsers = parser.add_subparsers()
+
+    unpack = _add_command(subparsers, 'unpack', 'Extract arc files', _command_unpack)
+    unpack.add_argument('-o', '--output-dir', required=True)
+
+    pack = _add_command(subparsers, 'pack', 'Create an arc file from each directory given', _command_pack,
+                        paths_help='directories to pack')
+    pack.add_argument('-o', '--output-dir', required=True)
+
+    tex2dds = _add_command(subparsers, 'tex2dds', 'Convert tex files to dds', _command_tex2dds)
+    tex2dds.add_argument('-o', '--output-dir', help='default: next to each tex file')
+    tex2dds.add_argument('--max-size', type=int, default=0,
+                         help='Skip mipmaps bigger than this size (default: keep all)')
+
+    dds2tex = _add_command(subparsers, 'dds2tex', 'Convert dds files to tex', _command_dds2tex)
+    dds2tex.add_argument('-o', '--output-dir', help='default: next to each dds file')
+
+    _add_command(subparsers, 'info', 'Show a summary of arc, mod and tex files', _command_info)
+
+    verify = _add_command(subparsers, 'verify', 'Check the integrity of arc files without extracting them',
+                          _command_verify)
+    verify.add_argument('--crc', action='store_true', help='Show the CRC32 of each entry')
+
+    index = subparsers.add_parser('index', help='Index the entries of all the arc files in directories')
+    index.add_argument('paths', nargs='+', help='directories with arc files')
+    index.add_argument('--db', default=DEFAULT_INDEX_PATH, help='default: %(default)s')
+    index.add_argument('--hash', action='store_true', help='Store a hash of the contents of each entry (slow)')
+    index.set_defaults(func=_command_index)
+
+    find = subparsers.add_parser('find', help='Find which arc files contain a file, using the index')
+    find.add_argument('paths', nargs='+', help="file names ('pl0200.mod') or paths inside the arc")
+    find.add_argument('--db', default=DEFAULT_INDEX_PATH, help='default: %(default)s')
+    find.set_defaults(func=_command_find)
+
+    return parser
+
+
+def _add_command(subparsers, name, help_text, func, paths_help='files or directories to process recursively'):
+    command = subparsers.add_parser(name, help=help_text)
+    command.add_argument('paths', nargs='+', help=paths_help)
+    command.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                         help='Number of processes (default: number of cpus)')
+    command.set_defaults(func=func)
+    return command
+
+
+def _command_unpack(args):
+    tasks = [(unpack_arc, src, os.path.splitext(dst)[0])
+             for src, dst in _get_sources_and_destinations(args.paths, '.arc', args.output_dir)]
+    return _run(tasks, args.jobs)
+
+
+def _command_pack(args):
+    tasks = []
+    failed = 0
+    for source_dir in args.paths:
+        if not os.path.isdir(source_dir):
+            # Reported like the errors of the other directories, which are still packed
+            print('Error processing {}:\nnot a directory'.format(source_dir), file=sys.stderr)
+            failed += 1
+            continue
+        name = os.path.basename(os.path.normpath(source_dir)) + '.arc'
+        tasks.append((pack_arc, source_dir, os.path.join(args.output_dir, name)))
+    result = _run(tasks, args.jobs)
+    return 1 if failed else result
+
+
+def _command_tex2dds(args):
+    tasks = [(convert_tex_to_dds, src, os.path.splitext(dst)[0] + '.dds', args.max_size)
+             for src, dst in _get_sources_and_destinations(args.paths, '.tex', args.output_dir)]
+    return _run(tasks, args.jobs)
+
+
+def _command_dds2tex(args):
+    tasks = [(convert_dds_to_tex, src, os.path.splitext(dst)[0] + '.tex')
+             for src, dst in _get_sources_and_destinations(args.paths, '.dds', args.output_dir)]
+    return _run(tasks, args.jobs)
+
+
+def _command_info(args):
+    tasks = [(get_info, src) for src, _ in
+             _get_sources_and_destinations(args.paths, ('.arc', '.mod', '.tex'), None)]
+    return _run(tasks, args.jobs, print_results=True)
+
+
+def _command_verify(args):
+    tasks = [(verify_arc, src, args.crc) for src, _ in _get_sources_and_destinations(args.paths, '.arc', None)]
+    return _run(tasks, args.jobs, print_results=True)
+
+
+def _command_index(args):
+    failed = 0
+    with ArcIndex(args.db) as index:
+        for root_dir in args.paths:
+            update = index.update(root_dir, hash_contents=args.hash)
+            failed += len(update.failed)
+            print('{}: {} added, {} updated, {} removed, {} unchanged, {} failed'.format(
+                  root_dir, len(update.added), len(update.updated), len(update.removed),
+                  len(update.unchanged), len(update.failed)))
+    return 1 if failed else 0
+
+
+def _command_find(args):
+    found = False
+    with ArcIndex(args.db) as index:
+        for path in args.paths:
+            for entry in index.find(path):
+                found = True
+                print('{}: {}.{} size: {} zsize: {} offset: {}'.format(
+                      entry.archive_path, entry.path, entry.extension, entry.size, entry.zsize, entry.offset))
+    return 0 if found else 1
+
+
+def unpack_arc(file_path, output_dir):
+    file_entries = unpack_file(file_path, output_dir)
+    return '{} -> {} ({} files)'.format(file_path, output_dir, len(file_entries))
+
+
+def pack_arc(source_dir, file_path):
+    arc = Arc.from_dir(source_dir)
+    _ensure_dir(file_path)
+    with open(file_path, 'wb') as w:
+        w.write(arc)
+    return '{} -> {} ({} files)'.format(source_dir, file_path, arc.files_count)
+
+
+def convert_tex_to_dds(tex_path, dds_path, max_size=0):
+    _ensure_dir(dds_path)
+    with open(tex_path, 'rb') as f:
+        header, _ = read_tex_header(f)
+        f.seek(0)
+        with open(dds_path, 'wb') as w:
+            tex_file_to_dds(f, w, get_mipmap_bias(header.width, header.height, max_size))
+    return '{} -> {}'.format(tex_path, dds_path)
+
+
+def convert_dds_to_tex(dds_path, tex_path):
+    _ensure_dir(tex_path)
+    with open(dds_path, 'rb') as f, open(tex_path, 'wb') as w:
+        dds_file_to_tex(f, w)
+    return '{} -> {}'.format(dds_path, tex_path)
+
+
+def get_info(file_path):
+    if file_path.endswith('.arc'):
+        arc = Arc(file_path=file_path)
+        lines = ['{}: arc version {}, {} files'.format(file_path, arc.version, arc.files_count)]
+        lines.extend('    {} id: {} size: {} zsize: {} offset: {}'.format(
+                     fe.file_path.decode('ascii'), hex(fe.file_id), fe.size, fe.zsize, fe.offset)
+                     for fe in arc.file_entries)
+        return '\n'.join(lines)
+    elif file_path.endswith('.mod'):
+        mod = Mod156(file_path=file_path)
+        return ('{}: mod version {}, {} meshes, {} vertices, {} faces, {} bones, {} materials, {} textures'
+                .format(file_path, mod.version, mod.mesh_count, mod.vertex_count, mod.face_count,
+                        mod.bone_count, mod.material_count, mod.texture_count))
+    tex = Tex112(file_path)
+    return ('{}: tex version {}, {}x{}, {}, {} mipmaps'
+            .format(file_path, tex.version, tex.width, tex.height,
+                    tex.compression_format.decode('ascii'), tex.mipmap_count))
+
+
+def verify_arc(file_path, crc=False):
+    report = verify_file(file_path, crc=crc)
+    if not report.ok:
+        raise RuntimeError('\n'.join(report.get_errors()))
+    lines = ['{}: OK, {} files'.format(file_path, report.files_count)]
+    if crc:
+        lines.extend('    {} crc32: {:08x}'.format(e.path, e.crc32) for e in report.entries)
+    return '\n'.join(lines)
+
+
+def _get_sources_and_destinations(paths, extension, output_dir):
+    """
+    Return a list of tuples (source_file, destination_file) for all the files with
+    <extension> in <paths>, which can be files or directories. The destination keeps
+    the structure of the directories given, or is next to the source if there's no <output_dir>
+    """
+    pairs = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources = sorted(find_files(path, extension))
+            root = path
+        else:
+            sources = [path]
+            root = os.path.dirname(path)
+        for source in sources:
+            if output_dir:
+                destination = os.path.join(output_dir, os.path.relpath(source, root))
+            else:
+                destination = source
+            pairs.append((source, destination))
+    return pairs
+
+
+def _ensure_dir(file_path):
+    directory = os.path.dirname(file_path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+
+def _call(func, *args):
+    # Errors are returned instead of raised so one bad file doesn't stop the rest
+    try:
+        return True, func(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def _run(tasks, jobs, print_results=False):
+    if not jobs or jobs < 2 or len(tasks) < 2:
+        results = ((task, _call(*task)) for task in tasks)
+        return _report(results, print_results)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_call, *task): task for task in tasks}
+        results = ((futures[future], future.result()) for future in as_completed(futures))
+        return _report(results, print_results)
+
+
+def _report(results, print_results):
+    failed = 0
+    for task, (ok, message) in results:
+        if ok:
+            if print_results:
+                print(message)
+        else:
+            failed += 1
+            print('Error processing {}:\n{}'.format(task[1], message), file=sys.stderr)
+    if failed:
+        print('{} file(s) failed'.format(failed), file=sys.stderr)
+    return 1 if failed else 0
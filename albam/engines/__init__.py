@@ -0,0 +1,16 @@
+"""
+Engines register their functions for each file type with decorators in their modules,
+see `albam.registry.AlbamRegistry.register_function`. Those modules are big, so the
+registry only imports them the first time a file of their type is imported or exported,
+and needs to know in advance which module registers each function.
+
+Each entry is (function type, identifier, module).
+"""
+LAZY_REGISTRATIONS = (
+    ('import', b'ARC\x00', 'albam.engines.mtframework.blender_import'),
+    ('import', b'MOD\x00', 'albam.engines.mtframework.blender_import'),
+    ('import_steps', b'MOD\x00', 'albam.engines.mtframework.blender_import'),
+    ('prefetch', b'ARC\x00', 'albam.engines.mtframework.blender_import'),
+    ('prefetch', b'MOD\x00', 'albam.engines.mtframework.blender_import'),
+    ('export', b'ARC\x00', 'albam.engines.mtframework.blender_export'),
+)
@@ -13,17 +13,11 @@ __all__ = (
 )
 
 
-CORRUPTED_ARCS = {
-    'uOmf303.arc',
-    's101.arc',  # Not an arc
-    'uOmf303.arc'
-    'uOmS103ScrAdj.arc',
+# Probably due to bad indices, needs investigation. Corrupted arcs are detected
+# by verifying them before importing, see `albam.engines.mtframework.arc.verify_file`
+KNOWN_ARC_BLENDER_CRASH = {
     'uOm001f.arc',  # Contains only one model that has one vertex
     'uOmS109_Truck_Rail.arc',   # Same, one model one vertex
-}
-
-# Probably due to bad indices, needs investigation
-KNOWN_ARC_BLENDER_CRASH = {
     'ev108_10.arc',
     'ev612_00.arc',
     'ev204_00.arc',
@@ -1,10 +1,17 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from ctypes import Structure, sizeof, c_int, c_uint, c_char, c_short, c_ubyte
 import ntpath
 import os
 import zlib
 
 from albam.engines.mtframework.mappers import FILE_ID_TO_EXTENSION, EXTENSION_TO_FILE_ID
-from albam.lib.structure import DynamicStructure
+from albam.lib.profiling import count
+from albam.lib.structure import DynamicStructure, get_source_size
+
+
+ARC_ALIGNMENT = 32768
+DECOMPRESS_CHUNK_SIZE = 256 * 1024
 
 
 class FileEntry(Structure):
@@ -20,24 +27,248 @@ class FileEntry(Structure):
 
 
 def get_padding(tmp_struct):
-    padding = 32768 - sizeof(tmp_struct)
-    if padding < 0:
-        padding += 32768
-    return padding
+    # The data starts at the next multiple of 32768 after the header
+    return -sizeof(tmp_struct) % ARC_ALIGNMENT
+
+
+def get_data_offset(files_count):
+    header_size = 8 + sizeof(FileEntry) * files_count
+    return header_size + (-header_size % ARC_ALIGNMENT)
 
 
 def get_data_length(tmp_struct, file_path=None):
     if file_path:
-        try:
-            length = os.path.getsize(file_path) - sizeof(tmp_struct)
-        except TypeError:
-            # XXX: inefficient?
-            length = len(file_path.getbuffer()) - sizeof(tmp_struct)
+        length = get_source_size(file_path) - sizeof(tmp_struct)
     else:
         length = len(tmp_struct.data)
     return length
 
 
+class ArcHeader(Structure):
+    _fields_ = (('id_magic', c_char * 4),
+                ('version', c_short),
+                ('files_count', c_short),
+                )
+
+
+def read_file_entries(f):
+    """
+    Return a tuple (ArcHeader, array of FileEntry) reading only the beginning of
+    the binary file object <f>, without loading the compressed data
+    """
+    header = ArcHeader()
+    if f.readinto(header) != sizeof(header) or header.id_magic != Arc.ID_MAGIC:
+        raise TypeError('Not an arc file. Id magic: {}'.format(header.id_magic))
+    file_entries = (FileEntry * header.files_count)()
+    if f.readinto(file_entries) != sizeof(file_entries):
+        raise TypeError('Arc file truncated, expected {} file entries'.format(header.files_count))
+    return header, file_entries
+
+
+def read_entry(f, file_entry):
+    """Return the decompressed contents of <file_entry> from the arc binary file object <f>"""
+    f.seek(file_entry.offset)
+    data = zlib.decompress(f.read(file_entry.zsize))
+    _check_entry_size(file_entry, len(data))
+    return data
+
+
+def _check_entry_size(file_entry, size):
+    # Imports only check the file entries by default, so reads catch what a full verify would
+    if size != file_entry.size:
+        raise ValueError('decompressed size is {}, expected {}'.format(size, file_entry.size))
+
+
+def iter_file_chunks(f, offset, size, chunk_size=DECOMPRESS_CHUNK_SIZE):
+    """Yield the <size> bytes at <offset> of the binary file object <f> in chunks"""
+    f.seek(offset)
+    remaining = size
+    while remaining:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            raise EOFError('Arc file truncated, {} bytes missing at offset {}'.format(remaining, f.tell()))
+        remaining -= len(chunk)
+        yield chunk
+
+
+def iter_buffer_chunks(buffer, offset, size, chunk_size=DECOMPRESS_CHUNK_SIZE):
+    buffer = memoryview(buffer)
+    if offset + size > len(buffer):
+        raise EOFError('Arc data truncated, {} bytes missing at offset {}'.format(
+                       offset + size - len(buffer), len(buffer)))
+    for start in range(offset, offset + size, chunk_size):
+        yield buffer[start: min(start + chunk_size, offset + size)]
+
+
+def iter_decompressed(compressed_chunks, chunk_size=DECOMPRESS_CHUNK_SIZE):
+    """
+    Decompress the zlib stream in <compressed_chunks>, yielding chunks of at most
+    <chunk_size> bytes, so memory use doesn't depend on the size of the entry
+    """
+    decompressor = zlib.decompressobj()
+    for chunk in compressed_chunks:
+        data = decompressor.decompress(chunk, chunk_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+    data = decompressor.flush()
+    if data:
+        yield data
+    if not decompressor.eof:
+        raise zlib.error('Incomplete or truncated compressed stream')
+
+
+def copy_entry(f, file_entry, dst, chunk_size=DECOMPRESS_CHUNK_SIZE):
+    """
+    Decompress <file_entry> from the arc binary file object <f> to the file object
+    <dst> in chunks. Return the number of bytes written.
+    """
+    written = 0
+    for data in iter_decompressed(iter_file_chunks(f, file_entry.offset, file_entry.zsize, chunk_size),
+                                  chunk_size):
+        dst.write(data)
+        written += len(data)
+    count('bytes_decompressed', written)
+    _check_entry_size(file_entry, written)
+    return written
+
+
+def unpack_file(file_path, output_dir='.', chunk_size=DECOMPRESS_CHUNK_SIZE):
+    """
+    Like `Arc.unpack`, but reading the arc from <file_path> as it goes instead of
+    loading it whole, with memory use bounded by <chunk_size>.
+    Return the array of FileEntry extracted.
+    """
+    output_dir = os.path.abspath(output_dir)
+    with open(file_path, 'rb') as f:
+        _, file_entries = read_file_entries(f)
+        for fe in file_entries:
+            out_path = Arc._get_path(fe.file_path, fe.file_id, output_dir)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'wb') as w:
+                copy_entry(f, fe, w, chunk_size)
+    return file_entries
+
+
+EntryCheck = namedtuple('EntryCheck', ('index', 'path', 'offset', 'zsize', 'size', 'crc32', 'errors'))
+
+
+class VerifyReport:
+    """Result of verifying an arc. <errors> are problems of the archive itself, not of an entry"""
+
+    def __init__(self, files_count, entries, errors=None):
+        self.files_count = files_count
+        self.entries = entries
+        self.errors = errors or []
+
+    @property
+    def ok(self):
+        return not self.errors and not any(e.errors for e in self.entries)
+
+    def get_errors(self):
+        """Return a list of strings with all the errors found"""
+        errors = list(self.errors)
+        errors.extend('{}: {}'.format(e.path, error) for e in self.entries for error in e.errors)
+        return errors
+
+    def to_dict(self):
+        return {'ok': self.ok,
+                'files_count': self.files_count,
+                'errors': self.errors,
+                'entries': [e._asdict() for e in self.entries],
+                }
+
+
+def verify_file(file_path, crc=False, jobs=None, decompress=True):
+    """
+    Like `Arc.verify`, but reading only the parts of the file needed, so the whole
+    archive is never in memory. Files that are not arcs get a report with an error.
+    If <decompress> is False, only the header and the file entries are checked, without
+    reading the data, e.g. before importing, since reading the entries checks their sizes.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            _, file_entries = read_file_entries(f)
+    except (TypeError, ValueError) as err:
+        return VerifyReport(0, [], [str(err)])
+
+    def read_chunks(fe):
+        with open(file_path, 'rb') as f:
+            yield from iter_file_chunks(f, fe.offset, fe.zsize)
+
+    data_start = get_data_offset(len(file_entries))
+    return _verify_entries(file_entries, data_start, os.path.getsize(file_path), read_chunks, crc, jobs,
+                           decompress)
+
+
+def _verify_entries(file_entries, data_start, total_size, read_chunks, crc, jobs, decompress=True):
+    errors = []
+    if total_size < data_start:
+        errors.append('archive truncated: data should start at {}, but the size is {}'.format(
+                      data_start, total_size))
+    in_range = [data_start <= fe.offset and fe.offset + fe.zsize <= total_size for fe in file_entries]
+
+    # Overlaps are only reported once, for the entry that starts later
+    overlapping = {}
+    by_offset = sorted((i for i in range(len(file_entries)) if in_range[i]),
+                       key=lambda i: file_entries[i].offset)
+    end, previous = 0, None
+    for i in by_offset:
+        fe = file_entries[i]
+        if fe.offset < end:
+            overlapping[i] = previous
+        if fe.offset + fe.zsize > end:
+            end, previous = fe.offset + fe.zsize, i
+
+    def check(i):
+        fe = file_entries[i]
+        path = '.'.join((fe.file_path.decode('ascii', 'replace'), get_entry_extension(fe.file_id)))
+        entry_errors = []
+        crc32 = None
+        if not in_range[i]:
+            entry_errors.append('data out of range: offset {}, zsize {}, archive size {}'.format(
+                                fe.offset, fe.zsize, total_size))
+        elif i in overlapping:
+            entry_errors.append('data overlaps with entry {}'.format(overlapping[i]))
+        if in_range[i] and decompress:
+            size, crc32 = 0, 0 if crc else None
+            try:
+                for data in iter_decompressed(read_chunks(fe)):
+                    size += len(data)
+                    if crc:
+                        crc32 = zlib.crc32(data, crc32)
+            except (zlib.error, EOFError) as err:
+                entry_errors.append('decompression failed: {}'.format(err))
+            else:
+                if size != fe.size:
+                    entry_errors.append('decompressed size is {}, expected {}'.format(size, fe.size))
+        return EntryCheck(i, path, fe.offset, fe.zsize, fe.size, crc32, entry_errors)
+
+    # zlib releases the GIL, so threads decompress in parallel
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        entries = list(executor.map(check, range(len(file_entries))))
+    return VerifyReport(len(file_entries), entries, errors)
+
+
+def get_entry_extension(file_id):
+    return FILE_ID_TO_EXTENSION.get(file_id) or str(file_id)
+
+
+def get_entry_path(file_entry):
+    """Return the path of <file_entry> inside the arc with its extension, e.g. 'pawn\\pl\\pl0000.mod'"""
+    return '.'.join((file_entry.file_path.decode('ascii'), get_entry_extension(file_entry.file_id)))
+
+
+def _compress_entry(entry_path, data):
+    """Return a tuple (file_path, file_id, flags, size, compressed data) for a new arc entry"""
+    file_path, ext = ntpath.splitext(entry_path)
+    chunk = zlib.compress(data)
+    count('bytes_compressed', len(chunk))
+    return (file_path.encode('ascii'), EXTENSION_TO_FILE_ID.get(ext.replace('.', '')) or 0,
+            64,  # always compressing
+            len(data), chunk)
+
+
 class Arc(DynamicStructure):
     ID_MAGIC = b'ARC'
 
@@ -50,7 +281,6 @@ class Arc(DynamicStructure):
                 )
 
     def unpack(self, output_dir='.'):
-        data = memoryview(self.data)
         offset = 0
         output_dir = os.path.abspath(output_dir)
         for i in range(self.files_count):
@@ -60,27 +290,70 @@ class Arc(DynamicStructure):
             if not os.path.exists(file_dir):
                 os.makedirs(file_dir)
             with open(file_path, 'wb') as w:
-                w.write(zlib.decompress(data[offset: offset + fe.zsize]))
+                for chunk in iter_decompressed(iter_buffer_chunks(self.data, offset, fe.zsize)):
+                    w.write(chunk)
             offset += fe.zsize
+            count('bytes_decompressed', fe.size)
+
+    def verify(self, crc=False, jobs=None):
+        """
+        Decompress all entries in parallel without writing anything, checking their sizes
+        and that their data is inside the archive without overlapping.
+        If <crc> is True, the CRC32 of the contents of each entry is calculated.
+        Return a VerifyReport.
+        """
+        data_start = sizeof(self) - len(self.data)
+        return _verify_entries(self.file_entries, data_start, sizeof(self),
+                               lambda fe: iter_buffer_chunks(self.data, fe.offset - data_start, fe.zsize),
+                               crc, jobs)
+
+    def repack(self, replacements):
+        """
+        Return a new Arc with the entries of this one, where <replacements>, a dict of
+        entry path (as returned by `get_entry_path`): bytes, replace the contents of
+        existing entries or are added as new ones. Only the replaced entries are compressed,
+        the rest keep their compressed data, so the time taken depends on what changed.
+        """
+        replacements = dict(replacements)
+        data = memoryview(self.data).cast('B')
+        data_start = sizeof(self) - len(self.data)
+        entries = []
+        for i in range(self.files_count):
+            fe = self.file_entries[i]
+            entry_path = get_entry_path(fe)
+            if entry_path in replacements:
+                entries.append(_compress_entry(entry_path, replacements.pop(entry_path)))
+                continue
+            start = fe.offset - data_start
+            entries.append((fe.file_path, fe.file_id, fe.flags, fe.size, data[start: start + fe.zsize]))
+            count('bytes_reused', fe.zsize)
+        for entry_path in sorted(replacements):
+            entries.append(_compress_entry(entry_path, replacements[entry_path]))
+        return Arc._from_entries(entries)
 
     @classmethod
     def from_dir(cls, source_path):
         file_paths = {os.path.join(root, f) for root, _, files in os.walk(source_path)
                       for f in files}
-        files_count = len(file_paths)
+        entries = []
+        for file_path in sorted(file_paths):
+            entry_path = cls._set_path(source_path, file_path).decode('ascii')
+            ext = os.path.splitext(file_path)[1]
+            with open(file_path, 'rb') as f:
+                entries.append(_compress_entry(entry_path + ext, f.read()))
+        return cls._from_entries(entries)
+
+    @classmethod
+    def _from_entries(cls, entries):
+        """<entries> is a list of tuples (file_path, file_id, flags, size, compressed data)"""
+        files_count = len(entries)
         file_entries = (FileEntry * files_count)()
-        current_offset = 32768
+        current_offset = get_data_offset(files_count)
         data = bytearray()
-        for i, file_path in enumerate(sorted(file_paths)):
-            with open(file_path, 'rb') as f:
-                chunk = zlib.compress(f.read())
+        for i, (file_path, file_id, flags, size, chunk) in enumerate(entries):
             data.extend(chunk)
-            ext = os.path.splitext(file_path)[1].replace('.', '')
-            file_entries[i] = FileEntry(file_path=cls._set_path(source_path, file_path),
-                                        file_id=EXTENSION_TO_FILE_ID.get(ext) or 0,
-                                        flags=64,  # always compressing
-                                        size=os.path.getsize(file_path),
-                                        zsize=len(chunk), offset=current_offset)
+            file_entries[i] = FileEntry(file_path=file_path, file_id=file_id, flags=flags,
+                                        size=size, zsize=len(chunk), offset=current_offset)
             current_offset += len(chunk)
 
         data = (c_ubyte * len(data)).from_buffer(data)
@@ -89,7 +362,7 @@ class Arc(DynamicStructure):
 
     @staticmethod
     def _get_path(file_path, file_type_id, output_path):
-        file_extension = FILE_ID_TO_EXTENSION.get(file_type_id) or str(file_type_id)
+        file_extension = get_entry_extension(file_type_id)
         file_path = file_path.decode('ascii')
         file_path = '.'.join((file_path, file_extension))
         parts = file_path.split(ntpath.sep)
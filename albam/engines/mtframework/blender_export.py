@@ -1,18 +1,23 @@
 from collections import OrderedDict, namedtuple
 import ctypes
-from io import BytesIO
+import io
 from itertools import chain
 import ntpath
 import os
-import tempfile
 import re
 try:
     import bpy
 except ImportError:
     pass
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from albam.registry import albam_registry
 from albam.engines.mtframework.mod_156 import (
+    Mod156Header,
+    write_mod156,
     Mesh156,
     MeshBox,
     MaterialData,
@@ -21,6 +26,8 @@ from albam.engines.mtframework.mod_156 import (
     VERTEX_FORMATS_TO_CLASSES,
     )
 from albam.engines.mtframework import Arc, Mod156, Tex112
+from albam.engines.mtframework.arc import get_entry_path
+from albam.engines.mtframework.tex import dds_file_to_tex
 from albam.engines.mtframework.utils import (
     vertices_export_locations,
     blender_texture_to_texture_code,
@@ -28,18 +35,19 @@ from albam.engines.mtframework.utils import (
     get_default_texture_dir,
     get_vertices_array,
     )
+from albam.lib import profiling
+from albam.lib.cache import FileCache, DEFAULT_CACHE_DIR, get_file_stamp, hash_bytes
 from albam.lib.half_float import pack_half_float
-from albam.lib.structure import get_offset
 from albam.lib.geometry import z_up_to_y_up
-from albam.lib.misc import ntpath_to_os_path
+from albam.lib.sources import load_source, store_source, get_sources_cache
 from albam.lib.blender import (
     triangles_list_to_triangles_strip,
     get_textures_from_blender_objects,
     get_materials_from_blender_objects,
-    get_vertex_count_from_blender_objects,
     get_bone_indices_and_weights_per_vertex,
     get_uvs_per_vertex,
     get_bounding_box,
+    get_mesh_objects_fingerprint,
     )
 
 ExportedMeshes = namedtuple('ExportedMeshes', ('meshes_array', 'vertex_buffer', 'index_buffer',
@@ -47,135 +55,330 @@ ExportedMeshes = namedtuple('ExportedMeshes', ('meshes_array', 'vertex_buffer',
 ExportedMaterials = namedtuple('ExportedMaterials', ('textures_array', 'materials_data_array',
                                                      'materials_mapping', 'blender_textures',
                                                      'texture_dirs'))
-ExportedMod = namedtuple('ExportedMod', ('mod', 'exported_materials'))
+ExportedMod = namedtuple('ExportedMod', ('header', 'sections', 'exported_materials'))
+ParsedMod = namedtuple('ParsedMod', ('mod', 'per_bone_meshes_boxes', 'texture_dirs', 'default_texture_dir'))
+# A mesh object, or part of it with the vertices at <vertex_indices> (None: all of them)
+# and <polygons> using indices to those, as exported in a Mesh156. <bone_indices> are the
+# bones that influence it, from <weights_per_vertex> of the whole object (see `_process_weights`).
+# <vertex_attributes> are also of the whole object, see `_get_vertex_attributes`
+MeshPart = namedtuple('MeshPart', ('blender_mesh_object', 'mesh_index', 'vertex_indices', 'polygons',
+                                   'bone_indices', 'weights_per_vertex', 'vertex_attributes'),
+                      defaults=(None,))
+VertexAttributes = namedtuple('VertexAttributes', ('uvs', 'normals', 'tangents'))
+Polygon = namedtuple('Polygon', ('index', 'vertices', 'edge_keys'))
+
+# Vertex counts and indices are unsigned shorts, indices relative to the vertex_offset of each mesh
+MAX_MESH_VERTICES = 65535
+MAX_BONE_PALETTE_SIZE = 32
+
+# The same models are usually exported many times in a session
+PARSED_MODS_CACHE_SIZE = 16
+_parsed_mods = OrderedDict()  # content hash: ParsedMod
+
+EXPORTED_TEXTURES_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'exported_tex')
+_exported_textures_cache = None
 
 
 @albam_registry.register_function('export', b'ARC\x00')
+@profiling.profiled('export_arc')
 def export_arc(blender_object, file_path):
-    saved_arc = Arc(file_path=BytesIO(blender_object.albam_imported_item.data))
-    mods = {}
-    texture_dirs = {}
-    textures_to_export = []
-
-    for child in blender_object.children:
-        exportable = hasattr(child, 'albam_imported_item')
-        if not exportable:
+    """
+    Only what changed since the import or the last export is exported again: mods whose
+    meshes have the same fingerprint reuse the original or previously exported bytes,
+    textures still using the file they were imported from keep the original tex, and
+    the entries not replaced keep their compressed data in the new arc.
+    """
+    source_bytes = get_source_bytes(blender_object)
+    saved_arc = Arc(file_path=source_bytes)
+    entry_paths = {get_entry_path(fe) for fe in saved_arc.file_entries}
+    mod_paths = {ntpath.basename(p): p for p in entry_paths if p.endswith('.mod')}
+    children = {child.name: child for child in blender_object.children
+                if hasattr(child, 'albam_imported_item')}
+    for mod_name in mod_paths:
+        if mod_name not in children:
+            # TODO: mods with the same name in different folders
+            raise RuntimeError("Can't export to arc, a mod file is missing: {}. "
+                               "Was it deleted before exporting?. "
+                               "Objects: {}".format(mod_name, sorted(children)))
+
+    replacements = {}  # entry path: bytes
+    exported = []  # (child, fingerprint, mod bytes or None if unchanged since import)
+    for mod_name, mod_path in sorted(mod_paths.items()):
+        child = children[mod_name]
+        fingerprint, data = _get_changed_mod(child)
+        if data is not None:
+            replacements[mod_path] = data
+        exported.append((child, fingerprint, data))
+        replacements.update(_get_changed_textures(child, entry_paths))
+
+    profiling.count('entries_replaced', len(replacements))
+    # Once the textures and the mods have been replaced, repack.
+    with profiling.span('pack_arc'):
+        new_arc = saved_arc.repack(replacements)
+
+    arc_item = blender_object.albam_imported_item
+    if not arc_item.content_hash and _is_same_file(file_path, arc_item.source_path):
+        # Imported from disk and only referenced, keep a copy of the original before
+        # overwriting it, see albam.lib.sources
+        arc_item.content_hash = hash_bytes(source_bytes)
+        store_source(arc_item.content_hash, source_bytes, get_sources_cache())
+    with open(file_path, 'wb') as w:
+        w.write(new_arc)
+    # Exporting again still works if it overwrote the arc imported and the cache was cleared
+    arc_item.exported_hash = hash_bytes(new_arc)
+
+    for child, fingerprint, data in exported:
+        item = child.albam_imported_item
+        if data is not None:
+            item.exported_hash = hash_bytes(data)
+            store_source(item.exported_hash, data, get_sources_cache())
+        item.export_fingerprint = fingerprint
+
+
+def _get_changed_mod(blender_object):
+    """
+    Return a tuple (fingerprint, data) with the current fingerprint of the meshes of
+    <blender_object> and the bytes of its mod, None if it's unchanged since the import.
+    The mod is only exported if the fingerprint changed since the import or last export.
+    """
+    item = blender_object.albam_imported_item
+    fingerprint = get_mesh_objects_fingerprint(_get_blender_meshes(blender_object), blender_object)
+    if fingerprint == item.export_fingerprint:
+        if not item.exported_hash:
+            profiling.count('mods_unchanged')
+            return fingerprint, None
+        cached_path = get_sources_cache().get(item.exported_hash)
+        if cached_path:
+            profiling.count('mods_unchanged')
+            with open(cached_path, 'rb') as f:
+                return fingerprint, f.read()
+
+    exported_mod = export_mod156(blender_object)
+    w = io.BytesIO()
+    write_mod156(w, exported_mod.header, exported_mod.sections)
+    return fingerprint, w.getvalue()
+
+
+def _get_changed_textures(blender_object, entry_paths):
+    """
+    Return a dict of entry path: tex bytes of the textures of <blender_object> that
+    have to be written in the arc, which has the entries <entry_paths>
+    """
+    textures = get_textures_from_blender_objects(_get_blender_meshes(blender_object))
+    changed = {}
+    texture_dirs = None
+    for texture in textures:
+        image = texture.image
+        tex_file_path = os.path.normpath(bpy.path.abspath(image.filepath))
+        # The dds imported, unless it was replaced or modified in place since
+        unchanged = (not image.is_dirty and tex_file_path == image.get('albam_source_dds') and
+                     get_file_stamp(tex_file_path) == image.get('albam_source_dds_stamp'))
+        mipmap_bias = image.get('albam_mipmap_bias')
+        if unchanged and mipmap_bias:
+            # Imported at a lower resolution, keep the original tex
+            profiling.count('textures_unchanged')
             continue
+        if texture_dirs is None:
+            texture_dirs = _get_texture_dirs(textures, get_parsed_source_mod(blender_object))
+        tex_filename_no_ext = os.path.splitext(os.path.basename(tex_file_path))[0]
+        entry_path = ntpath.join(texture_dirs[texture.name], tex_filename_no_ext + '.tex')
+        if unchanged and entry_path in entry_paths:
+            profiling.count('textures_unchanged')
+            continue
+        source_archive = image.get('albam_source_archive')
+        if source_archive and entry_path not in entry_paths:
+            if unchanged:
+                # Found in another arc when importing, where the game still finds it
+                profiling.count('textures_foreign')
+                continue
+            # TODO: logging
+            print('Texture {} comes from {}, writing the modified texture '
+                  'as a new entry'.format(entry_path, source_archive))
+        if mipmap_bias and tex_file_path == image.get('albam_source_dds'):
+            # TODO: logging
+            print('Texture {} was imported at 1/{} of its resolution, writing the modified '
+                  'texture at that resolution'.format(entry_path, 2 ** mipmap_bias))
+        changed[entry_path] = _export_texture(image, tex_file_path)
+    profiling.count('textures_exported', len(changed))
+    return changed
+
+
+def get_exported_textures_cache():
+    global _exported_textures_cache
+    if _exported_textures_cache is None:
+        _exported_textures_cache = FileCache(EXPORTED_TEXTURES_CACHE_DIR, extension='.tex')
+    return _exported_textures_cache
+
+
+def _export_texture(blender_image, tex_file_path):
+    """
+    Return the tex bytes of <blender_image>, from <tex_file_path> if it's a dds.
+    Conversions are cached by the path, size and modification time of the file, so
+    exporting again doesn't convert images that didn't change.
+    """
+    key = None
+    file_stamp = None if blender_image.is_dirty else get_file_stamp(tex_file_path)
+    if file_stamp:
+        stamp = '{}:{}'.format(tex_file_path, file_stamp)
+        name = os.path.splitext(os.path.basename(tex_file_path))[0]
+        key = '/'.join((hash_bytes(stamp.encode('utf-8')), name))
+        cached_path = get_exported_textures_cache().get(key)
+        if cached_path:
+            profiling.count('textures_cache_hits')
+            with open(cached_path, 'rb') as f:
+                return f.read()
+
+    if tex_file_path.lower().endswith('.dds'):
+        w = io.BytesIO()
+        with open(tex_file_path, 'rb') as f:
+            dds_file_to_tex(f, w)
+        data = w.getvalue()
+    else:
+        data = bytes(_tex_from_blender_image(blender_image))
+    if key:
+        get_exported_textures_cache().put(key, data)
+    return data
 
-        exported_mod = export_mod156(child)
-        mods[child.name] = exported_mod
-        texture_dirs.update(exported_mod.exported_materials.texture_dirs)
-        textures_to_export.extend(exported_mod.exported_materials.blender_textures)
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        saved_arc.unpack(tmpdir)
-
-        mod_files = [os.path.join(root, f) for root, _, files in os.walk(tmpdir)
-                     for f in files if f.endswith('.mod')]
-
-        # overwriting the original mod files with the exported ones
-        for modf in mod_files:
-            filename = os.path.basename(modf)
-            try:
-                # TODO: mods with the same name in different folders
-                exported_mod = mods[filename]
-            except KeyError:
-                raise RuntimeError("Can't export to arc, a mod file is missing: {}. "
-                                  "Was it deleted before exporting?. "
-                                  "mods.items(): {}".format(filename, mods.items()))
-
-            with open(modf, 'wb') as w:
-                w.write(exported_mod.mod)
-
-        for blender_texture in textures_to_export:
-            texture_name = blender_texture.name
-            resolved_path = ntpath_to_os_path(texture_dirs[texture_name])
-            tex_file_path = bpy.path.abspath(blender_texture.image.filepath)
-            tex_filename_no_ext = os.path.splitext(os.path.basename(tex_file_path))[0]
-            destination_path = os.path.join(tmpdir, resolved_path, tex_filename_no_ext + '.tex')
-            tex = Tex112.from_dds(file_path=bpy.path.abspath(blender_texture.image.filepath))
-
-            with open(destination_path, 'wb') as w:
-                w.write(tex)
-
-        # Once the textures and the mods have been replaced, repack.
-        new_arc = Arc.from_dir(tmpdir)
 
-    with open(file_path, 'wb') as w:
-        w.write(new_arc)
+def get_source_bytes(blender_object):
+    """Return the bytes of the file <blender_object> was imported from"""
+    item = blender_object.albam_imported_item
+    return load_source(item.source_path, item.content_hash, item.archive_path, item.data, get_sources_cache(),
+                       exported_hash=item.exported_hash, source_stamp=item.source_stamp)
+
+
+def _is_same_file(path, other_path):
+    try:
+        return os.path.samefile(path, other_path)
+    except OSError:
+        return False
 
 
+def get_parsed_source_mod(blender_object):
+    """
+    Return a ParsedMod with the original Mod156 <blender_object> was imported from and
+    the data derived from it that exports need. It's parsed once per content hash and the
+    most recently used ones are kept in memory, so exporting again doesn't read it again.
+    The mod and its data must not be modified.
+    """
+    item = blender_object.albam_imported_item
+    content_hash = item.content_hash
+    data = None
+    if not content_hash:
+        # Imported with an older version, only the embedded data is available
+        data = get_source_bytes(blender_object)
+        content_hash = hash_bytes(data)
+    parsed = _parsed_mods.get(content_hash)
+    if parsed:
+        _parsed_mods.move_to_end(content_hash)
+        profiling.count('parsed_mods_cache_hits')
+        return parsed
+
+    with profiling.span('parse_original_mod'):
+        mod = Mod156(file_path=data or get_source_bytes(blender_object))
+        parsed = ParsedMod(mod, _get_per_bone_meshes_boxes(mod), get_texture_dirs(mod),
+                           get_default_texture_dir(mod))
+    _parsed_mods[content_hash] = parsed
+    while len(_parsed_mods) > PARSED_MODS_CACHE_SIZE:
+        _parsed_mods.popitem(last=False)
+    return parsed
+
+
+def _tex_from_blender_image(blender_image):
+    """
+    Compress the pixels of an image that is not a dds (e.g. a png painted in Blender)
+    and generate its mipmaps. DXT1 is used for opaque images, DXT5 otherwise.
+    """
+    if np is None:
+        raise RuntimeError('Image {} is not a dds, and numpy is required to convert it'
+                           .format(blender_image.filepath))
+    width, height = blender_image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    blender_image.pixels.foreach_get(pixels)
+    # Blender stores rows bottom to top
+    rgba = pixels.reshape(height, width, 4)[::-1]
+    rgba = np.clip(np.rint(rgba * 255), 0, 255).astype(np.uint8)
+    fmt = b'DXT1' if (rgba[:, :, 3] == 255).all() else b'DXT5'
+    return Tex112.from_rgba(rgba, fmt)
+
+
+@profiling.profiled('export_mod156')
 def export_mod156(parent_blender_object):
-    saved_mod = Mod156(file_path=BytesIO(parent_blender_object.albam_imported_item.data))
+    parsed_mod = get_parsed_source_mod(parent_blender_object)
+    saved_mod = parsed_mod.mod
     blender_meshes = _get_blender_meshes(parent_blender_object)
     bounding_box = get_bounding_box(parent_blender_object)
-    bones_array_offset, bone_palettes, bone_palette_array = _get_bone_data(blender_meshes, saved_mod)
-    exported_materials = _export_textures_and_materials(blender_meshes, saved_mod)
-    exported_meshes = _export_meshes(blender_meshes, bounding_box, bone_palettes, exported_materials)
-    meshes_array_2 = _get_meshes_array_2(saved_mod, exported_meshes)
-
-    mod = Mod156(id_magic=b'MOD',
-                 version=156,
-                 version_rev=1,
-                 bone_count=saved_mod.bone_count,
-                 mesh_count=len(blender_meshes),
-                 material_count=len(exported_materials.materials_data_array),
-                 vertex_count=get_vertex_count_from_blender_objects(blender_meshes),
-                 face_count=(ctypes.sizeof(exported_meshes.index_buffer) // 2) + 1,
-                 edge_count=0,  # TODO: add edge_count
-                 vertex_buffer_size=ctypes.sizeof(exported_meshes.vertex_buffer),
-                 vertex_buffer_2_size=len(saved_mod.vertex_buffer_2),
-                 texture_count=len(exported_materials.textures_array),
-                 group_count=saved_mod.group_count,
-                 group_data_array=saved_mod.group_data_array,
-                 bone_palette_count=len(bone_palette_array),
-                 bones_array_offset=bones_array_offset,
-                 sphere_x=saved_mod.sphere_x,
-                 sphere_y=saved_mod.sphere_y,
-                 sphere_z=saved_mod.sphere_z,
-                 sphere_w=saved_mod.sphere_w,
-                 box_min_x=bounding_box.min_x * 100,
-                 box_min_y=bounding_box.min_z * 100,
-                 box_min_z=bounding_box.max_y * -100,  # z up to y up
-                 box_min_w=bounding_box.min_w * 100,
-                 box_max_x=bounding_box.max_x * 100,
-                 box_max_y=bounding_box.max_z * 100,
-                 box_max_z=bounding_box.min_y * -100,  # z up to y up
-                 box_max_w=bounding_box.max_w * 100,
-                 unk_01=saved_mod.unk_01,
-                 unk_02=saved_mod.unk_02,
-                 unk_03=saved_mod.unk_03,
-                 unk_04=saved_mod.unk_04,
-                 unk_05=saved_mod.unk_05,
-                 unk_06=saved_mod.unk_06,
-                 unk_07=saved_mod.unk_07,
-                 unk_08=saved_mod.unk_08,
-                 unk_09=saved_mod.unk_09,
-                 unk_10=saved_mod.unk_10,
-                 unk_11=saved_mod.unk_11,
-                 unk_12=saved_mod.unk_12,
-                 bones_array=saved_mod.bones_array,
-                 bones_unk_matrix_array=saved_mod.bones_unk_matrix_array,
-                 bones_world_transform_matrix_array=saved_mod.bones_world_transform_matrix_array,
-                 bones_animation_mapping=saved_mod.bones_animation_mapping,
-                 bone_palette_array=bone_palette_array,
-                 textures_array=exported_materials.textures_array,
-                 materials_data_array=exported_materials.materials_data_array,
-                 meshes_array=exported_meshes.meshes_array,
-                 meshes_array_2_size=len(meshes_array_2),
-                 meshes_array_2=meshes_array_2,
-                 vertex_buffer=exported_meshes.vertex_buffer,
-                 vertex_buffer_2=saved_mod.vertex_buffer_2,
-                 index_buffer=exported_meshes.index_buffer
-                 )
-    mod.group_offset = get_offset(mod, 'group_data_array')
-    mod.textures_array_offset = get_offset(mod, 'textures_array')
-    mod.meshes_array_offset = get_offset(mod, 'meshes_array')
-    mod.vertex_buffer_offset = get_offset(mod, 'vertex_buffer')
-    mod.vertex_buffer_2_offset = get_offset(mod, 'vertex_buffer_2')
-    mod.index_buffer_offset = get_offset(mod, 'index_buffer')
-
-    return ExportedMod(mod, exported_materials)
+    with profiling.span('split_meshes'):
+        mesh_parts = _get_mesh_parts(blender_meshes)
+    with profiling.span('bones'):
+        bones_array_offset, bone_palettes, bone_palette_array = _get_bone_data(mesh_parts, saved_mod)
+    with profiling.span('textures_and_materials'):
+        exported_materials = _export_textures_and_materials(blender_meshes, parsed_mod)
+    with profiling.span('meshes'):
+        exported_meshes = _export_meshes(mesh_parts, bounding_box, bone_palettes, exported_materials)
+    with profiling.span('meshes_array_2'):
+        meshes_array_2 = _get_meshes_array_2(parsed_mod.per_bone_meshes_boxes, exported_meshes)
+    profiling.count('meshes', len(blender_meshes))
+    profiling.count('vertices', sum(m.vertex_count for m in exported_meshes.meshes_array))
+    profiling.count('index_buffer_bytes', ctypes.sizeof(exported_meshes.index_buffer))
+
+    header = Mod156Header(id_magic=b'MOD',
+                          version=156,
+                          version_rev=1,
+                          bone_count=saved_mod.bone_count,
+                          mesh_count=len(exported_meshes.meshes_array),
+                          material_count=len(exported_materials.materials_data_array),
+                          vertex_count=sum(m.vertex_count for m in exported_meshes.meshes_array),
+                          face_count=(ctypes.sizeof(exported_meshes.index_buffer) // 2) + 1,
+                          edge_count=0,  # TODO: add edge_count
+                          vertex_buffer_size=ctypes.sizeof(exported_meshes.vertex_buffer),
+                          vertex_buffer_2_size=len(saved_mod.vertex_buffer_2),
+                          texture_count=len(exported_materials.textures_array),
+                          group_count=saved_mod.group_count,
+                          bone_palette_count=len(bone_palette_array),
+                          bones_array_offset=bones_array_offset,
+                          sphere_x=saved_mod.sphere_x,
+                          sphere_y=saved_mod.sphere_y,
+                          sphere_z=saved_mod.sphere_z,
+                          sphere_w=saved_mod.sphere_w,
+                          box_min_x=bounding_box.min_x * 100,
+                          box_min_y=bounding_box.min_z * 100,
+                          box_min_z=bounding_box.max_y * -100,  # z up to y up
+                          box_min_w=bounding_box.min_w * 100,
+                          box_max_x=bounding_box.max_x * 100,
+                          box_max_y=bounding_box.max_z * 100,
+                          box_max_z=bounding_box.min_y * -100,  # z up to y up
+                          box_max_w=bounding_box.max_w * 100,
+                          unk_01=saved_mod.unk_01,
+                          unk_02=saved_mod.unk_02,
+                          unk_03=saved_mod.unk_03,
+                          unk_04=saved_mod.unk_04,
+                          unk_05=saved_mod.unk_05,
+                          unk_06=saved_mod.unk_06,
+                          unk_07=saved_mod.unk_07,
+                          unk_08=saved_mod.unk_08,
+                          unk_09=saved_mod.unk_09,
+                          unk_10=saved_mod.unk_10,
+                          unk_11=saved_mod.unk_11,
+                          )
+    # Buffers are written as they are by `write_mod156`, without copying them into a Mod156
+    sections = {'unk_12': saved_mod.unk_12,
+                'bones_array': saved_mod.bones_array,
+                'bones_unk_matrix_array': saved_mod.bones_unk_matrix_array,
+                'bones_world_transform_matrix_array': saved_mod.bones_world_transform_matrix_array,
+                'bones_animation_mapping': saved_mod.bones_animation_mapping,
+                'bone_palette_array': bone_palette_array,
+                'group_data_array': saved_mod.group_data_array,
+                'textures_array': exported_materials.textures_array,
+                'materials_data_array': exported_materials.materials_data_array,
+                'meshes_array': exported_meshes.meshes_array,
+                'meshes_array_2': meshes_array_2,
+                'vertex_buffer': exported_meshes.vertex_buffer,
+                'vertex_buffer_2': saved_mod.vertex_buffer_2,
+                'index_buffer': exported_meshes.index_buffer,
+                }
+
+    return ExportedMod(header, sections, exported_materials)
 
 
 def _get_blender_meshes(blender_object_root):
@@ -206,18 +409,17 @@ def _get_blender_meshes(blender_object_root):
     return blender_meshes
 
 
-def _get_meshes_array_2(saved_mod, exported_meshes):
+def _get_meshes_array_2(per_bone_meshes_boxes, exported_meshes):
     """
     Construct the struct 'meshes_array_2', which has unknown values.
     It was observed that this changes affect the model visibility related to the camera
     see https://github.com/Brachi/albam/issues/18
     It'a assumed that these values represent some sort of per bone bounding boxes.
     Here a heuristic is't used to assign values to every mesh based on the bones they use.
-    :param saved_mod: Mod156 instance, the original imported
+    :param per_bone_meshes_boxes: dict returned by `_get_per_bone_meshes_boxes` for the original mod
     :param exported_meshes: ExportedMeshes instance
     """
     DEFAULT_BOX = _create_default_box()
-    per_bone_meshes_boxes = _get_per_bone_meshes_boxes(saved_mod)
     mesh_boxes = []
 
     for mesh_index, mesh in enumerate(exported_meshes.meshes_array):
@@ -285,7 +487,7 @@ def _get_per_bone_meshes_boxes(mod):
     return boxes
 
 
-def _get_bone_data(blender_meshes, saved_mod):
+def _get_bone_data(mesh_parts, saved_mod):
     # TODO: add docstrings
     bones_array_offset = 0
     bone_palettes = {}
@@ -293,7 +495,7 @@ def _get_bone_data(blender_meshes, saved_mod):
     if not saved_mod.bone_count:
         return bones_array_offset, bone_palettes, bone_palette_array
 
-    bone_palettes = _create_bone_palettes(blender_meshes)
+    bone_palettes = _create_bone_palettes(mesh_parts)
     bone_palette_array = (BonePalette * len(bone_palettes))()
 
     if saved_mod.unk_08:
@@ -374,15 +576,35 @@ def _get_tangents_per_vertex(blender_mesh):
     return tangents
 
 
-def _export_vertices(blender_mesh_object, bbox, mesh_index, bone_palette):
+def _get_vertex_attributes(blender_mesh_object):
+    """
+    Return the VertexAttributes of <blender_mesh_object>, per vertex index: uvs packed as
+    half floats, normals and tangents. Calculated once for all the parts it's split in.
+    """
     blender_mesh = blender_mesh_object.data
-    vertex_count = len(blender_mesh.vertices)
-    uvs_per_vertex = get_uvs_per_vertex(blender_mesh_object)
-    weights_per_vertex = get_bone_indices_and_weights_per_vertex(blender_mesh_object)
-    weights_per_vertex = _process_weights(weights_per_vertex)
-    max_bones_per_vertex = max({len(data) for data in weights_per_vertex.values()}, default=0)
-    normals = _get_normals_per_vertex(blender_mesh)
-    tangents = _get_tangents_per_vertex(blender_mesh)
+    uvs = {}
+    for vertex_index, (uv_x, uv_y) in get_uvs_per_vertex(blender_mesh_object).items():
+        # flipping for dds textures
+        uvs[vertex_index] = (pack_half_float(uv_x), pack_half_float(uv_y * -1))
+    return VertexAttributes(uvs, _get_normals_per_vertex(blender_mesh), _get_tangents_per_vertex(blender_mesh))
+
+
+def _export_vertices(blender_mesh_object, bbox, mesh_index, bone_palette, vertex_indices=None,
+                     weights_per_vertex=None, vertex_attributes=None):
+    """
+    Return a tuple (vertices array, bone indices used) with the vertices of <blender_mesh_object>
+    at <vertex_indices>, in that order, or all of them if not given.
+    <weights_per_vertex> and <vertex_attributes> are calculated if not given, see
+    `_process_weights` and `_get_vertex_attributes`
+    """
+    blender_mesh = blender_mesh_object.data
+    if vertex_indices is None:
+        vertex_indices = range(len(blender_mesh.vertices))
+    vertex_count = len(vertex_indices)
+    if weights_per_vertex is None:
+        weights_per_vertex = _process_weights(get_bone_indices_and_weights_per_vertex(blender_mesh_object))
+    max_bones_per_vertex = max({len(weights_per_vertex.get(vi, ())) for vi in vertex_indices}, default=0)
+    uvs_per_vertex, normals, tangents = vertex_attributes or _get_vertex_attributes(blender_mesh_object)
 
     box_width = bbox.width * 100
     box_height = bbox.length * 100   # z up to y up
@@ -390,19 +612,14 @@ def _export_vertices(blender_mesh_object, bbox, mesh_index, bone_palette):
 
     VF = VERTEX_FORMATS_TO_CLASSES[max_bones_per_vertex]
 
-    for vertex_index, (uv_x, uv_y) in uvs_per_vertex.items():
-        # flipping for dds textures
-        uv_y *= -1
-        uv_x = pack_half_float(uv_x)
-        uv_y = pack_half_float(uv_y)
-        uvs_per_vertex[vertex_index] = (uv_x, uv_y)
-
     vertices_array = (VF * vertex_count)()
     has_bones = hasattr(VF, 'bone_indices')
     total_bones = set()
 
-    for vertex_index, vertex in enumerate(blender_mesh.vertices):
-        vertex_struct = vertices_array[vertex_index]
+    vertices = blender_mesh.vertices
+    for i, vertex_index in enumerate(vertex_indices):
+        vertex = vertices[vertex_index]
+        vertex_struct = vertices_array[i]
 
         xyz = (vertex.co[0] * 100, vertex.co[1] * 100, vertex.co[2] * 100)
         xyz = z_up_to_y_up(xyz)
@@ -438,32 +655,103 @@ def _export_vertices(blender_mesh_object, bbox, mesh_index, bone_palette):
     return vertices_array, total_bones
 
 
-def _create_bone_palettes(blender_mesh_objects):
-    bone_palette_dicts = []
-    MAX_BONE_PALETTE_SIZE = 32
-
-    bone_palette = {'mesh_indices': set(), 'bone_indices': set()}
-    for i, mesh in enumerate(blender_mesh_objects):
-        # XXX case where bone names are not integers
-        vertex_group_mapping = {vg.index: int(vg.name) for vg in mesh.vertex_groups}
-        bone_indices = {vertex_group_mapping[vgroup.group] for vertex in mesh.data.vertices for vgroup in vertex.groups}
+def _get_mesh_parts(blender_mesh_objects):
+    """Return a list of MeshParts of <blender_mesh_objects>, split as needed by `_split_mesh`"""
+    parts = []
+    for mesh_index, blender_mesh_ob in enumerate(blender_mesh_objects):
+        weights_per_vertex = _process_weights(get_bone_indices_and_weights_per_vertex(blender_mesh_ob))
+        vertex_attributes = _get_vertex_attributes(blender_mesh_ob)
+        parts.extend(_split_mesh(blender_mesh_ob, mesh_index, weights_per_vertex,
+                                 MAX_MESH_VERTICES, MAX_BONE_PALETTE_SIZE, vertex_attributes))
+    profiling.count('meshes_split', len(parts) - len(blender_mesh_objects))
+    return parts
 
-        msg = "Mesh {} is influenced by more than 32 bones, which is not supported".format(mesh.name)
-        assert len(bone_indices) <= MAX_BONE_PALETTE_SIZE, msg
 
-        current = bone_palette['bone_indices']
-        potential = current.union(bone_indices)
-        if len(potential) > MAX_BONE_PALETTE_SIZE:
-            bone_palette_dicts.append(bone_palette)
-            bone_palette = {'mesh_indices': {i}, 'bone_indices': set(bone_indices)}
-        else:
-            bone_palette['mesh_indices'].add(i)
-            bone_palette['bone_indices'].update(bone_indices)
-
-    bone_palette_dicts.append(bone_palette)
-
-    final = OrderedDict([(frozenset(bp['mesh_indices']), sorted(bp['bone_indices']))
-                        for bp in bone_palette_dicts])
+def _split_mesh(blender_mesh_object, mesh_index, weights_per_vertex,
+                max_vertices=MAX_MESH_VERTICES, max_bones=MAX_BONE_PALETTE_SIZE, vertex_attributes=None):
+    """
+    Return a list of MeshParts of <blender_mesh_object> with at most <max_vertices> each,
+    so their indices fit in the index buffer, and influenced by at most <max_bones>, so they
+    fit in a bone palette. Meshes that fit are not split.
+    Triangles are assigned to parts in order, grouped by the bone with the most influence
+    on them if there are too many bones, so parts follow the boundaries of the bones'
+    influence. Vertices shared by triangles in different parts are duplicated. Vertices
+    not used by any triangle are not exported. All the parts share <weights_per_vertex>
+    and <vertex_attributes>, which are of the whole object.
+    """
+    blender_mesh = blender_mesh_object.data
+    bone_indices = {bi for weights in weights_per_vertex.values() for bi, _ in weights}
+    if len(blender_mesh.vertices) <= max_vertices and len(bone_indices) <= max_bones:
+        return [MeshPart(blender_mesh_object, mesh_index, None, blender_mesh.polygons, bone_indices,
+                         weights_per_vertex, vertex_attributes)]
+
+    polygons_to_split = list(blender_mesh.polygons)
+    if len(bone_indices) > max_bones:
+        polygons_to_split.sort(key=lambda p: _get_dominant_bone(p.vertices, weights_per_vertex))
+    parts = []
+    part_indices = {}  # vertex index in the mesh: vertex index in the part
+    part_bones = set()
+    polygons = []
+    for polygon in polygons_to_split:
+        new_vertex_count = len({v for v in polygon.vertices if v not in part_indices})
+        polygon_bones = {bi for v in polygon.vertices for bi, _ in weights_per_vertex.get(v, ())}
+        if polygons and (len(part_indices) + new_vertex_count > max_vertices or
+                         len(part_bones | polygon_bones) > max_bones):
+            parts.append(MeshPart(blender_mesh_object, mesh_index, list(part_indices), polygons,
+                                  part_bones, weights_per_vertex, vertex_attributes))
+            part_indices, part_bones, polygons = {}, set(), []
+        for v in polygon.vertices:
+            part_indices.setdefault(v, len(part_indices))
+        part_bones |= polygon_bones
+        vertices = tuple(part_indices[v] for v in polygon.vertices)
+        edge_keys = tuple(tuple(sorted(edge)) for edge in zip(vertices, vertices[1:] + vertices[:1]))
+        polygons.append(Polygon(len(polygons), vertices, edge_keys))
+    if polygons:
+        parts.append(MeshPart(blender_mesh_object, mesh_index, list(part_indices), polygons,
+                              part_bones, weights_per_vertex, vertex_attributes))
+    return parts
+
+
+def _get_dominant_bone(vertex_indices, weights_per_vertex):
+    """Return the bone with the most weight on <vertex_indices>, or -1 if none"""
+    totals = {}
+    for vertex_index in vertex_indices:
+        for bone_index, weight in weights_per_vertex.get(vertex_index, ()):
+            totals[bone_index] = totals.get(bone_index, 0) + weight
+    return max(sorted(totals), key=totals.get, default=-1)
+
+
+def _create_bone_palettes(mesh_parts, max_size=MAX_BONE_PALETTE_SIZE):
+    """
+    Pack the bones influencing <mesh_parts> in as few bone palettes of <max_size> bones as
+    possible, since the game switches palettes between meshes that use different ones.
+    Best fit decreasing: parts with more bones go first, each to the palette that needs the
+    fewest new bones for it, the fullest one if there's a tie, or to a new palette if
+    none has room. Return an OrderedDict of frozenset(part indices): sorted bone indices
+    """
+    palettes = []  # (part indices, bone indices)
+    by_size = sorted(range(len(mesh_parts)), key=lambda i: len(mesh_parts[i].bone_indices), reverse=True)
+    for part_index in by_size:
+        bone_indices = mesh_parts[part_index].bone_indices
+        if len(bone_indices) > max_size:
+            raise RuntimeError('Mesh {} is influenced by more than {} bones'.format(
+                mesh_parts[part_index].blender_mesh_object.name, max_size))
+        best, best_score = None, None
+        for palette in palettes:
+            union_size = len(palette[1] | bone_indices)
+            if union_size > max_size:
+                continue
+            score = (union_size - len(palette[1]), max_size - union_size)
+            if best_score is None or score < best_score:
+                best, best_score = palette, score
+        if best is None:
+            best = (set(), set())
+            palettes.append(best)
+        best[0].add(part_index)
+        best[1].update(bone_indices)
+
+    final = OrderedDict([(frozenset(part_indices), sorted(bone_indices))
+                         for part_indices, bone_indices in palettes])
 
     return final
 
@@ -476,7 +764,7 @@ def _infer_level_of_detail(name):
     return 1
 
 
-def _export_meshes(blender_meshes, bounding_box, bone_palettes, exported_materials):
+def _export_meshes(mesh_parts, bounding_box, bone_palettes, exported_materials):
     """
     No weird optimization or sharing of offsets in the vertex buffer.
     All the same offsets, different positions like pl0200.mod from
@@ -484,40 +772,50 @@ def _export_meshes(blender_meshes, bounding_box, bone_palettes, exported_materia
     No time to investigate why and how those are decided. I suspect it might have to
     do with location of the meshes
     """
-    meshes_156 = (Mesh156 * len(blender_meshes))()
+    meshes_156 = (Mesh156 * len(mesh_parts))()
     vertex_buffer = bytearray()
     index_buffer = bytearray()
     materials_mapping = exported_materials.materials_mapping
 
+    segment_offset = 0
     vertex_position = 0
     face_position = 0
     per_mesh_bone_indices = []
-    for mesh_index, blender_mesh_ob in enumerate(blender_meshes):
+    for part_index, part in enumerate(mesh_parts):
+        blender_mesh_ob = part.blender_mesh_object
+        mesh_index = part.mesh_index
         level_of_detail = _infer_level_of_detail(blender_mesh_ob.name)
         bone_palette_index = 0
         bone_palette = []
-        for bpi, (meshes_indices, bp) in enumerate(bone_palettes.items()):
-            if mesh_index in meshes_indices:
+        for bpi, (part_indices, bp) in enumerate(bone_palettes.items()):
+            if part_index in part_indices:
                 bone_palette_index = bpi
                 bone_palette = bp
                 break
 
         blender_mesh = blender_mesh_ob.data
-        vertices_array, total_bones = _export_vertices(blender_mesh_ob, bounding_box, mesh_index, bone_palette)
+        vertices_array, total_bones = _export_vertices(blender_mesh_ob, bounding_box, mesh_index, bone_palette,
+                                                       part.vertex_indices, part.weights_per_vertex,
+                                                       part.vertex_attributes)
+        vertex_count = len(vertices_array)
+        if vertex_position + vertex_count > MAX_MESH_VERTICES:
+            # The indices wouldn't fit in an unsigned short, start a new segment of the
+            # vertex buffer, which the indices of the next meshes are relative to
+            segment_offset = len(vertex_buffer)
+            vertex_position = 0
         per_mesh_bone_indices.append(total_bones)
         vertex_buffer.extend(vertices_array)
 
         # TODO: is all this format conversion necessary?
-        triangle_strips_python = triangles_list_to_triangles_strip(blender_mesh)
-        # mod156 use global indices for verts, in case one only mesh is needed, probably
+        triangle_strips_python = triangles_list_to_triangles_strip(part)
+        # mod156 use indices relative to the segment of the vertex buffer, not to the mesh
         triangle_strips_python = [e + vertex_position for e in triangle_strips_python]
         triangle_strips_ctypes = (ctypes.c_ushort * len(triangle_strips_python))(*triangle_strips_python)
         index_buffer.extend(triangle_strips_ctypes)
 
-        vertex_count = len(blender_mesh.vertices)
         index_count = len(triangle_strips_python)
 
-        m156 = meshes_156[mesh_index]
+        m156 = meshes_156[part_index]
         try:
             blender_material = blender_mesh.materials[0]
             m156.material_index = materials_mapping[blender_material.name]
@@ -531,7 +829,7 @@ def _export_meshes(blender_meshes, bounding_box, bone_palettes, exported_materia
         m156.vertex_count = vertex_count
         m156.vertex_index_end = vertex_position + vertex_count - 1
         m156.vertex_index_start_1 = vertex_position
-        m156.vertex_offset = 0
+        m156.vertex_offset = segment_offset
         m156.face_position = face_position
         m156.face_count = index_count
         m156.face_offset = 0
@@ -549,22 +847,30 @@ def _export_meshes(blender_meshes, bounding_box, bone_palettes, exported_materia
     return ExportedMeshes(meshes_156, vertex_buffer, index_buffer, per_mesh_bone_indices)
 
 
-def _export_textures_and_materials(blender_objects, saved_mod):
+def _get_texture_dirs(textures, parsed_mod):
+    """
+    Return a dict of texture name: directory of the texture in the arc, the original
+    one or the default directory of the mod for new textures
+    """
+    texture_dirs = dict(parsed_mod.texture_dirs)
+    for texture in textures:
+        if not texture_dirs.get(texture.name):
+            # TODO: no default texture_dir means the original mod had no textures
+            texture_dirs[texture.name] = parsed_mod.default_texture_dir
+    return texture_dirs
+
+
+def _export_textures_and_materials(blender_objects, parsed_mod):
     textures = get_textures_from_blender_objects(blender_objects)
     blender_materials = get_materials_from_blender_objects(blender_objects)
 
     textures_array = ((ctypes.c_char * 64) * len(textures))()
     materials_data_array = (MaterialData * len(blender_materials))()
     materials_mapping = {}  # blender_material.name: material_id
-    texture_dirs = get_texture_dirs(saved_mod)
-    default_texture_dir = get_default_texture_dir(saved_mod)
+    texture_dirs = _get_texture_dirs(textures, parsed_mod)
 
     for i, texture in enumerate(textures):
-        texture_dir = texture_dirs.get(texture.name)
-        if not texture_dir:
-            texture_dir = default_texture_dir
-            texture_dirs[texture.name] = texture_dir
-        # TODO: no default texture_dir means the original mod had no textures
+        texture_dir = texture_dirs[texture.name]
         file_name = os.path.basename(bpy.path.abspath(texture.image.filepath))
         file_path = ntpath.join(texture_dir, file_name)
         try:
@@ -1,4 +1,7 @@
-from itertools import chain
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import groupby
 import ntpath
 import os
 
@@ -8,58 +11,226 @@ try:
 except ImportError:
     pass
 
-from albam.engines.mtframework import Arc, Mod156, Tex112, KNOWN_ARC_BLENDER_CRASH, CORRUPTED_ARCS
+from albam.engines.mtframework import Arc, Mod156, KNOWN_ARC_BLENDER_CRASH
+from albam.engines.mtframework.arc import verify_file, unpack_file
+from albam.engines.mtframework.decoding import decode_mesh_arrays, decode_mod, DecodedMod
+from albam.engines.mtframework.index import ArcIndex, EntryResolver
+from albam.engines.mtframework.vfs import ArcFileSystem
+from albam.engines.mtframework.tex import (
+    tex_file_to_dds,
+    read_tex_header,
+    get_mipmap_bias,
+    clamp_mipmap_bias,
+    )
 from albam.engines.mtframework.utils import (
-    get_vertices_array,
-    get_indices_array,
     get_non_deform_bone_indices,
     get_bone_parents_from_mod,
-    transform_vertices_from_bbox,
     texture_code_to_blender_texture,
 
     )
 from albam.engines.mtframework.mappers import BONE_INDEX_TO_GROUP
+from albam.lib.cache import FileCache, DEFAULT_CACHE_DIR, get_file_stamp, hash_file, hash_bytes
 from albam.lib.misc import chunks
-from albam.lib.half_float import unpack_half_float
-from albam.lib.blender import strip_triangles_to_triangles_list, create_mesh_name
+from albam.lib.profiling import profiled, span, count
+from albam.lib.blender import create_mesh_name, get_mesh_objects_fingerprint
 from albam.lib.geometry import vertices_from_bbox
 from albam.registry import albam_registry
 
+DDS_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'dds')
+_dds_cache = None
+
+
+def get_dds_cache():
+    """Return the shared cache of dds files converted from tex, created on first use"""
+    global _dds_cache
+    if _dds_cache is None:
+        _dds_cache = FileCache(DDS_CACHE_DIR, extension='.dds')
+    return _dds_cache
+
+
+ConvertedTexture = namedtuple('ConvertedTexture', ('dds_path', 'mipmap_bias', 'name', 'source_archive'))
+
+
+class ArcPrefetch(namedtuple('ArcPrefetch', ('report', 'unpacked', 'files'))):
+    __slots__ = ()
+
+    def track(self):
+        for descriptor in self.files.values():
+            descriptor.track()
+
+    def release(self):
+        for descriptor in self.files.values():
+            descriptor.release()
+
 
 @albam_registry.register_function('import', identifier=b'ARC\x00')
+@profiled('import_arc')
 def import_arc(blender_object, file_path, **kwargs):
-    """Imports an arc file (Resident Evil 5 for only for now) into blender,
-    extracting all files to a tmp dir and saving unknown/unused data
-    to the armature (if any) for using in exporting
+    """Imports an arc file (Resident Evil 5 for only for now) into blender.
+    The mods inside are read directly from the arc, unless <unpack_dir> is given,
+    in which case all files are extracted there first.
+    Only the file entries are checked first, unless <verify_arc> is True, in which case
+    all the entries are decompressed to verify them.
     """
 
     unpack_dir = kwargs.get('unpack_dir')
+    prefetched = kwargs.get('prefetched')
 
-    if file_path.endswith(tuple(KNOWN_ARC_BLENDER_CRASH) + tuple(CORRUPTED_ARCS)):
+    if file_path.endswith(tuple(KNOWN_ARC_BLENDER_CRASH)):
         raise ValueError('The arc file provided is not supported yet, it might crash Blender')
-
-    base_dir = os.path.basename(file_path).replace('.arc', '_arc_extracted')
-    out = unpack_dir or os.path.join(os.path.expanduser('~'), '.albam', 're5', base_dir)
-    if not os.path.isdir(out):
-        os.makedirs(out)
-    if not out.endswith(os.path.sep):
-        out = out + os.path.sep
-
-    arc = Arc(file_path=file_path)
-    arc.unpack(out)
-
-    mod_files = [os.path.join(root, f) for root, _, files in os.walk(out)
-                 for f in files if f.endswith('.mod')]
+    with span('verify_arc'):
+        report = prefetched.report if prefetched else verify_file(file_path, decompress=kwargs.get('verify_arc', False))
+    if not report.ok:
+        raise ValueError('The arc file provided is corrupted:\n{}'.format('\n'.join(report.get_errors()[:10])))
+    prefetched_files = prefetched.files if prefetched else {}
+
+    if not unpack_dir:
+        with span('mount_arc'):
+            vfs = ArcFileSystem([file_path])
+        mod_files = vfs.find('.mod')
+        mod_folders = [ntpath.dirname(mod_file) for mod_file in mod_files]
+        # One resolver for all the mods, closed by the importer once they are imported
+        resolver = _open_entry_resolver(kwargs.get('arc_index_path'), file_path)
+        return {'files': mod_files,
+                'kwargs': {'parent': blender_object,
+                           'mod_folder': mod_folders[0],  # XXX will break if mods are in different folders
+                           'vfs': vfs,
+                           'arc_path': file_path,
+                           'resolver': resolver,
+                           'prefetched_files': prefetched_files,
+                           },
+                'resources': [resolver.arc_index] if resolver else [],
+                }
+
+    out = _prepare_unpack_dir(unpack_dir)
+    if not (prefetched and prefetched.unpacked):
+        with span('parse_arc'):
+            arc = Arc(file_path=file_path)
+        with span('unpack_arc'):
+            arc.unpack(out)
+
+    mod_files = _find_unpacked_mods(out)
     mod_folders = [os.path.dirname(mod_file.split(out)[-1]) for mod_file in mod_files]
+    resolver = _open_entry_resolver(kwargs.get('arc_index_path'), file_path)
 
     return {'files': mod_files,
             'kwargs': {'parent': blender_object,
                        'mod_folder': mod_folders[0],  # XXX will break if mods are in different folders
                        'base_dir': out,
+                       'arc_path': file_path,
+                       'resolver': resolver,
+                       'prefetched_files': prefetched_files,
                        },
+            'resources': [resolver.arc_index] if resolver else [],
             }
 
 
+def _open_entry_resolver(arc_index_path, arc_path=None):
+    """
+    Return an EntryResolver over the index in <arc_index_path> that prefers <arc_path>,
+    or None if there's no index. The caller closes its `arc_index`.
+    """
+    if not arc_index_path or not os.path.isfile(arc_index_path):
+        return None
+    return EntryResolver(ArcIndex(arc_index_path), preferred_archives=[arc_path] if arc_path else [])
+
+
+@contextmanager
+def _entry_resolver(kwargs):
+    """
+    Yield the resolver shared by the files of an import (`resolver` in <kwargs>), or
+    one for this file only if the import didn't create it
+    """
+    if 'resolver' in kwargs:
+        yield kwargs['resolver']
+        return
+    resolver = _open_entry_resolver(kwargs.get('arc_index_path'), kwargs.get('arc_path'))
+    try:
+        yield resolver
+    finally:
+        if resolver:
+            resolver.arc_index.close()
+
+
+def _prepare_unpack_dir(unpack_dir):
+    if not os.path.isdir(unpack_dir):
+        os.makedirs(unpack_dir, exist_ok=True)
+    if not unpack_dir.endswith(os.path.sep):
+        unpack_dir = unpack_dir + os.path.sep
+    return unpack_dir
+
+
+def _find_unpacked_mods(unpack_dir):
+    return [os.path.join(root, f) for root, _, files in os.walk(unpack_dir)
+            for f in files if f.endswith('.mod')]
+
+
+@albam_registry.register_function('prefetch', identifier=b'ARC\x00')
+def prefetch_arc(file_path, **kwargs):
+    """
+    Run in a worker process before `import_arc`: verify the arc, unpack it if <unpack_dir>
+    is given, and prefetch all the mods inside. Return an ArcPrefetch, with a dict of
+    {mod path: ModDescriptor} as `files`. Mods that fail are left for the importer.
+    """
+    unpack_dir = kwargs.get('unpack_dir')
+    report = verify_file(file_path, decompress=kwargs.get('verify_arc', False))
+    if not report.ok or file_path.endswith(tuple(KNOWN_ARC_BLENDER_CRASH)):
+        return ArcPrefetch(report, False, {})
+
+    if unpack_dir:
+        out = _prepare_unpack_dir(unpack_dir)
+        unpack_file(file_path, out)
+        vfs = None
+        mod_files = _find_unpacked_mods(out)
+        kwargs['base_dir'] = out
+    else:
+        vfs = ArcFileSystem([file_path])
+        mod_files = vfs.find('.mod')
+    kwargs['arc_path'] = file_path
+
+    files = {}
+    with _entry_resolver(kwargs) as resolver:
+        kwargs['resolver'] = resolver
+        for mod_file in mod_files:
+            try:
+                files[mod_file] = _prefetch_mod(mod_file, vfs, **kwargs)
+            except Exception as err:
+                # TODO: logging
+                print('Error prefetching {} from {}: {}'.format(mod_file, file_path, err))
+    return ArcPrefetch(report, bool(unpack_dir), files)
+
+
+@albam_registry.register_function('prefetch', identifier=b'MOD\x00')
+def prefetch_mod(file_path, **kwargs):
+    """
+    Run in a worker process before `import_mod`: decode its meshes to shared memory
+    (see albam.engines.mtframework.decoding) and convert its textures to the dds cache
+    """
+    return _prefetch_mod(file_path, None, **kwargs)
+
+
+def _prefetch_mod(file_path, vfs=None, **kwargs):
+    mod = Mod156(file_path=vfs.read(file_path) if vfs else file_path)
+    with _entry_resolver(kwargs) as resolver:
+        textures = _convert_textures_from_mod(mod, kwargs.get('base_dir'), kwargs.get('texture_max_size', 0),
+                                              resolver, vfs)
+    return decode_mod(file_path, mod, textures)
+
+
+def _convert_textures_from_mod(mod, base_dir, texture_max_size=0, resolver=None, vfs=None):
+    """
+    Convert the textures of <mod> to dds files in the cache, so importing only loads them.
+    Return a dict of texture path: ConvertedTexture, None if the texture was not found.
+    """
+    dds_cache = get_dds_cache()
+    converted = {}
+    for texture_path in mod.textures_array:
+        texture_path = _get_texture_path(texture_path)
+        converted[texture_path] = _convert_texture(texture_path, base_dir, dds_cache, texture_max_size,
+                                                   resolver, vfs)
+    return converted
+
+
 def _set_bounding_box(mod, blender_object):
     vertices, faces = vertices_from_bbox(mod.box_min_x / 100, mod.box_min_z / -100, mod.box_min_y / 100,
                                          mod.box_max_x / 100, mod.box_max_z / -100, mod.box_max_y / 100)
@@ -69,155 +240,202 @@ def _set_bounding_box(mod, blender_object):
 
 @albam_registry.register_function('import', identifier=b'MOD\x00')
 def import_mod(blender_object, file_path, **kwargs):
-    base_dir = kwargs.get('base_dir')
+    """
+    <file_path> is a path inside <vfs> (an ArcFileSystem) if given, otherwise a path
+    on disk, with its textures in <base_dir>.
+    If <prefetched> is given (a ModDescriptor from `prefetch_mod`), meshes are built from
+    its arrays and its textures are already converted, so the mod is not parsed here.
+    """
+    for _ in iter_import_mod(blender_object, file_path, **kwargs):
+        pass
 
-    mod = Mod156(file_path=file_path)
-    textures = _create_blender_textures_from_mod(mod, base_dir)
-    materials = _create_blender_materials_from_mod(mod, blender_object.name, textures)
 
-    _set_bounding_box(mod, blender_object)
+@albam_registry.register_function('import_steps', identifier=b'MOD\x00')
+def iter_import_mod(blender_object, file_path, **kwargs):
+    """
+    Same as `import_mod`, in steps: yield a tuple (meshes_done, meshes_total) once the
+    textures and materials are created, and after each mesh. If the generator is closed
+    before finishing, the data blocks already created are left for the caller to remove.
+    """
+    base_dir = kwargs.get('base_dir')
+    vfs = kwargs.get('vfs')
+    texture_max_size = kwargs.get('texture_max_size', 0)
+    prefetched = kwargs.get('prefetched')
+
+    with span('import_mod'):
+        if prefetched:
+            mod, converted = prefetched.mod_info, prefetched.textures
+            mod_meshes = prefetched.meshes
+        else:
+            with span('parse_mod'):
+                mod = Mod156(file_path=vfs.read(file_path) if vfs else file_path)
+            converted, mod_meshes = None, mod.meshes_array
+        with span('textures'), _entry_resolver(kwargs) as resolver:
+            textures = _create_blender_textures_from_mod(mod, base_dir, texture_max_size, resolver, vfs,
+                                                         converted)
+        with span('materials'):
+            materials = _create_blender_materials_from_mod(mod, blender_object.name, textures)
+
+        _set_bounding_box(mod, blender_object)
 
-    meshes = []
-    for i, mesh in enumerate(mod.meshes_array):
-        name = create_mesh_name(mesh, i, file_path)
         # XXX temporary for debug
-        if mesh.level_of_detail not in (1, 255):
-            continue
+        to_build = [(i, mesh) for i, mesh in enumerate(mod_meshes) if mesh.level_of_detail in (1, 255)]
+        yield 0, len(to_build)
+
+        meshes = []
+        decoded = DecodedMod(prefetched) if prefetched else None
         try:
-            m = _build_blender_mesh_from_mod(mod, mesh, i, name, materials)
-            meshes.append(m)
-        except Exception as err:
-            # TODO: logging
-            print('Error building mesh {0} for mod {1}'.format(i, file_path))
-            print('Details:', err)
-
-    if mod.bone_count:
-        armature_name = 'skel_{}'.format(blender_object.name)
-        root = _create_blender_armature_from_mod(blender_object, mod, armature_name)
-        root.show_in_front = True
-    else:
-        root = blender_object
+            for meshes_done, (i, mesh) in enumerate(to_build, 1):
+                name = create_mesh_name(mesh, i, ntpath.basename(file_path) if vfs else file_path)
+                try:
+                    if decoded:
+                        decoded_mesh = decoded.meshes[i]
+                        if decoded_mesh.error:
+                            raise RuntimeError(decoded_mesh.error)
+                        arrays = decoded_mesh.arrays
+                    else:
+                        with span('decode_mesh'):
+                            arrays = decode_mesh_arrays(mod, mesh)
+                    m = _build_blender_mesh_from_mod(mesh, arrays, name, materials)
+                    meshes.append(m)
+                except Exception as err:
+                    # TODO: logging
+                    print('Error building mesh {0} for mod {1}'.format(i, file_path))
+                    print('Details:', err)
+                    count('mesh_errors')
+                yield meshes_done, len(to_build)
+        finally:
+            if decoded:
+                decoded.close()
 
-    for mesh in meshes:
-        bpy.context.scene.collection.objects.link(mesh)
-        mesh.parent = root
         if mod.bone_count:
-            modifier = mesh.modifiers.new(type="ARMATURE", name=blender_object.name)
-            modifier.object = root
-            modifier.use_vertex_groups = True
+            with span('armature'):
+                armature_name = 'skel_{}'.format(blender_object.name)
+                root = _create_blender_armature_from_mod(
+                    blender_object, mod, armature_name,
+                    prefetched.mod_info.non_deform_bone_indices if prefetched else None)
+                root.show_in_front = True
+        else:
+            root = blender_object
+
+        with span('link_objects'):
+            for mesh in meshes:
+                bpy.context.scene.collection.objects.link(mesh)
+                mesh.parent = root
+                if mod.bone_count:
+                    modifier = mesh.modifiers.new(type="ARMATURE", name=blender_object.name)
+                    modifier.object = root
+                    modifier.use_vertex_groups = True
+
+        # Exporting skips the mod while the meshes keep this fingerprint
+        blender_object.albam_imported_item.export_fingerprint = get_mesh_objects_fingerprint(meshes,
+                                                                                             blender_object)
 
 
-def _build_blender_mesh_from_mod(mod, mesh, mesh_index, name, materials):
+@profiled('build_mesh')
+def _build_blender_mesh_from_mod(mesh, arrays, name, materials):
+    """
+    Create a mesh object from the <arrays> of `albam.engines.mtframework.decoding.decode_mesh_arrays`,
+    with bulk calls that copy them directly to Blender's data, instead of one call per element
+    """
     me_ob = bpy.data.meshes.new(name)
     ob = bpy.data.objects.new(name, me_ob)
 
-    imported_vertices = _import_vertices(mod, mesh)
-    vertex_locations = imported_vertices['locations']
-    vertex_normals = imported_vertices['normals']
-    uvs_per_vertex = imported_vertices['uvs']
-    weights_per_bone = imported_vertices['weights_per_bone']
-    indices = get_indices_array(mod, mesh)
-    indices = strip_triangles_to_triangles_list(indices)
-    faces = chunks(indices, 3)
-    uvs_per_vertex = imported_vertices['uvs']
-    weights_per_bone = imported_vertices['weights_per_bone']
+    locations = arrays['locations']
+    indices = arrays['indices']
+    vertex_count = len(locations) // 3
+    loop_count = len(indices)
+    face_count = loop_count // 3
+    count('vertices', vertex_count)
+    count('faces', face_count)
 
     assert min(indices) >= 0, "Bad face indices"  # Blender crashes if not
-    me_ob.from_pydata(vertex_locations, [], faces)
-
-    me_ob.create_normals_split()
-
-    me_ob.validate(clean_customdata=False)
-    me_ob.update(calc_edges=True)
-    me_ob.polygons.foreach_set("use_smooth", [True] * len(me_ob.polygons))
+    with span('geometry'):
+        me_ob.vertices.add(vertex_count)
+        _foreach_set(me_ob.vertices, 'co', locations)
+        me_ob.loops.add(loop_count)
+        _foreach_set(me_ob.loops, 'vertex_index', indices)
+        me_ob.polygons.add(face_count)
+        _foreach_set(me_ob.polygons, 'loop_start', array('i', range(0, loop_count, 3)))
+        _foreach_set(me_ob.polygons, 'loop_total', array('i', (3,)) * face_count)
+        _foreach_set(me_ob.polygons, 'use_smooth', [True] * face_count)
+
+    # Before validating, since uvs are per loop and validate can remove degenerate faces
+    with span('uvs'):
+        me_ob.uv_layers.new(name=name)
+        _foreach_set(me_ob.uv_layers[-1].data, 'uv', arrays['loop_uvs'])
 
-    loop_normals = []
-    for loop in me_ob.loops:
-        loop_normals.append(vertex_normals[loop.vertex_index])
+    with span('validate'):
+        me_ob.create_normals_split()
+        me_ob.validate(clean_customdata=False)
+        me_ob.update(calc_edges=True)
 
-    me_ob.normals_split_custom_set_from_vertices(vertex_normals)
-    me_ob.use_auto_smooth = True
+    with span('normals'):
+        me_ob.normals_split_custom_set_from_vertices(chunks(arrays['normals'].tolist(), 3))
+        me_ob.use_auto_smooth = True
 
     mesh_material = materials[mesh.material_index]
     me_ob.materials.append(mesh_material)
 
-    for bone_index, data in weights_per_bone.items():
-        vg = ob.vertex_groups.new(name=str(bone_index))
-        for vertex_index, weight_value in data:
-            vg.add((vertex_index,), weight_value, 'ADD')
-
-    if uvs_per_vertex:
-        me_ob.uv_layers.new(name=name)
-        uv_layer = me_ob.uv_layers[-1].data
-        per_loop_list = []
-        for loop in me_ob.loops:
-            offset = loop.vertex_index * 2
-            per_loop_list.extend((uvs_per_vertex[offset], uvs_per_vertex[offset + 1]))
-        uv_layer.foreach_set('uv', per_loop_list)
+    with span('weights'):
+        vertex_indices = arrays['weight_vertex_indices'].tolist()
+        weight_runs = groupby(zip(arrays['weight_bone_indices'].tolist(),
+                                  arrays['weight_values'].tolist(), range(len(vertex_indices))),
+                              key=lambda w: w[:2])
+        vertex_groups = {}
+        for (bone_index, weight_value), run in weight_runs:
+            vg = vertex_groups.get(bone_index)
+            if vg is None:
+                vg = vertex_groups[bone_index] = ob.vertex_groups.new(name=str(bone_index))
+            vg.add([vertex_indices[w[2]] for w in run], weight_value, 'ADD')
+            count('vertex_group_add_calls')
+        count('vertex_groups', len(vertex_groups))
     return ob
 
 
-def _import_vertices(mod, mesh):
-    return _import_vertices_mod156(mod, mesh)
-
-
-def _import_vertices_mod156(mod, mesh):
-    box_width = abs(mod.box_min_x) + abs(mod.box_max_x)
-    box_height = abs(mod.box_min_y) + abs(mod.box_max_y)
-    box_length = abs(mod.box_min_z) + abs(mod.box_max_z)
+def _foreach_set(collection, attribute, values):
+    collection.foreach_set(attribute, values)
+    count('foreach_set_calls')
 
-    vertices_array = get_vertices_array(mod, mesh)
 
-    if mesh.vertex_format != 0:
-        locations = (transform_vertices_from_bbox(vf, box_width, box_height, box_length)
-                     for vf in vertices_array)
-    else:
-        locations = ((vf.position_x, vf.position_y, vf.position_z) for vf in vertices_array)
-
-    locations = map(lambda t: (t[0] / 100, t[2] / -100, t[1] / 100), locations)
-    # from [0, 255] o [-1, 1]
-    normals = map(lambda v: (((v.normal_x / 255) * 2) - 1,
-                             ((v.normal_y / 255) * 2) - 1,
-                             ((v.normal_z / 255) * 2) - 1), vertices_array)
-    # y up to z up
-    normals = map(lambda n: (n[0], n[2] * -1, n[1]), normals)
-
-    list_of_tuples = [(unpack_half_float(v.uv_x), unpack_half_float(v.uv_y) * -1) for v in vertices_array]
-    return {'locations': list(locations),
-            'normals': list(normals),
-            # TODO: investigate why uvs don't appear above the image in the UV editor
-            'uvs': list(chain.from_iterable(list_of_tuples)),
-            'weights_per_bone': _get_weights_per_bone(mod, mesh, vertices_array)
-            }
-
-
-def _create_blender_textures_from_mod(mod, base_dir):
+def _create_blender_textures_from_mod(mod, base_dir, texture_max_size=0, resolver=None, vfs=None,
+                                      converted=None):
+    """
+    If <texture_max_size> is given, bigger textures are loaded starting from the first
+    mipmap that fits in that size, to use less memory.
+    Textures not found in <base_dir> or <vfs> are looked up in other archives with
+    <resolver>, an EntryResolver, if given.
+    Textures in <converted> (see `_convert_textures_from_mod`) are only loaded.
+    """
     textures = [None]  # materials refer to textures in index-1
+    dds_cache = get_dds_cache()
     # TODO: check why in Arc.header.file_entries[n].file_path it returns a bytes, and
     # here the whole array of chars
 
     for i, texture_path in enumerate(mod.textures_array):
-        path = texture_path[:].decode('ascii').partition('\x00')[0]
-        path = os.path.join(base_dir, *path.split(ntpath.sep))
-        path = '.'.join((path, 'tex'))
-        if not os.path.isfile(path):
+        texture_path = _get_texture_path(texture_path)
+        texture = converted.get(texture_path) if converted else None
+        if not (texture and texture.dds_path and os.path.isfile(texture.dds_path)):
+            # Not prefetched, or evicted from the cache since
+            texture = _convert_texture(texture_path, base_dir, dds_cache, texture_max_size, resolver, vfs)
+        if not texture:
             # TODO: log warnings, figure out 'rtex' format
-            print('path {} does not exist'.format(path))
+            print('texture {} not found'.format(texture_path))
             continue
-        tex = Tex112(path)
-        try:
-            dds = tex.to_dds()
-        except Exception as err:
-            # TODO: log this instead of printing it
-            print('Error converting "{}"to dds: {}'.format(path, err))
+        if not texture.dds_path:
             textures.append(None)
             continue
-        dds_path = path.replace('.tex', '.dds')
-        with open(dds_path, 'wb') as w:
-            w.write(dds)
-        image = bpy.data.images.load(dds_path)
-        texture_name_no_extension = os.path.splitext(os.path.basename(path))[0]
-        texture_name_no_extension = str(i).zfill(2) + texture_name_no_extension
+        image = bpy.data.images.load(texture.dds_path)
+        # While the image uses this file, the original tex is kept when exporting
+        image['albam_source_dds'] = os.path.normpath(texture.dds_path)
+        image['albam_source_dds_stamp'] = get_file_stamp(texture.dds_path)
+        if texture.source_archive:
+            # Not in the imported arc, exporting doesn't copy it there unless it's modified
+            image['albam_source_archive'] = texture.source_archive
+        if texture.mipmap_bias:
+            # Exporting a reduced image would lose the original resolution
+            image['albam_mipmap_bias'] = texture.mipmap_bias
+        texture_name_no_extension = str(i).zfill(2) + texture.name
         texture = bpy.data.textures.new(texture_name_no_extension, type='IMAGE')
         texture.image = image
         textures.append(texture)
@@ -225,6 +443,84 @@ def _create_blender_textures_from_mod(mod, base_dir):
     return textures
 
 
+def _convert_texture(texture_path, base_dir, dds_cache, texture_max_size=0, resolver=None, vfs=None):
+    """
+    Return a ConvertedTexture of <texture_path> (as stored in a mod) with a dds file in
+    <dds_cache>, its dds_path None if the conversion failed, or None if it's not found
+    """
+    path, source_vfs = _find_texture_file(texture_path, base_dir, resolver, vfs)
+    if not path:
+        return None
+    dds_path, mipmap_bias = _convert_tex_to_cached_dds(path, dds_cache, texture_max_size, source_vfs)
+    source_archive = resolver.archive_paths.get(path) if resolver else None
+    return ConvertedTexture(dds_path, mipmap_bias, _get_name_no_extension(path, source_vfs), source_archive)
+
+
+def _get_texture_path(texture_path):
+    return texture_path[:].decode('ascii').partition('\x00')[0]
+
+
+def _find_texture_file(texture_path, base_dir, resolver=None, vfs=None):
+    """
+    Return a tuple (path, vfs) of the tex file for <texture_path> (as stored in a mod),
+    found in <vfs> (and then the path is inside it), in <base_dir> or extracted from
+    another archive by <resolver>. Return (None, None) if it's not found.
+    """
+    tex_path = '.'.join((texture_path, 'tex'))
+    if vfs and vfs.isfile(tex_path):
+        return tex_path, vfs
+    if base_dir:
+        path = os.path.join(base_dir, *tex_path.split(ntpath.sep))
+        if os.path.isfile(path):
+            return path, None
+    if resolver:
+        path = resolver.resolve(tex_path)
+        count('textures_resolved' if path else 'textures_missing')
+        return path, None
+    count('textures_missing')
+    return None, None
+
+
+def _get_name_no_extension(path, vfs=None):
+    name = ntpath.basename(path) if vfs else os.path.basename(path)
+    return os.path.splitext(name)[0]
+
+
+def _open_file(path, vfs=None):
+    return vfs.open(path) if vfs else open(path, 'rb')
+
+
+def _convert_tex_to_cached_dds(tex_path, dds_cache, texture_max_size=0, vfs=None):
+    """
+    Return a tuple (dds_path, mipmap_bias) of a dds file converted from <tex_path>,
+    a path inside <vfs> if given.
+    Conversions are stored in <dds_cache> keyed by the hash of the tex file, so identical
+    textures (e.g. shared between archives or imported in previous sessions) are converted once.
+    The dds keeps the name of the tex file, since exporting relies on it.
+    Return (None, 0) if the conversion failed.
+    """
+    texture_name_no_extension = _get_name_no_extension(tex_path, vfs)
+    try:
+        with _open_file(tex_path, vfs) as f:
+            header, _ = read_tex_header(f)
+        mipmap_bias = clamp_mipmap_bias(header, get_mipmap_bias(header.width, header.height,
+                                                                texture_max_size))
+        content_key = hash_bytes(vfs.read(tex_path)) if vfs else hash_file(tex_path)
+        if mipmap_bias:
+            content_key = '{}-{}'.format(content_key, mipmap_bias)
+        key = '/'.join((content_key, texture_name_no_extension))
+        dds_path = dds_cache.get(key)
+        if dds_path:
+            return dds_path, mipmap_bias
+        with _open_file(tex_path, vfs) as f, dds_cache.writer(key) as w:
+            tex_file_to_dds(f, w, mipmap_bias)
+    except Exception as err:
+        # TODO: log this instead of printing it
+        print('Error converting "{}"to dds: {}'.format(tex_path, err))
+        return None, 0
+    return dds_cache.path_for(key), mipmap_bias
+
+
 def _create_blender_materials_from_mod(mod, model_name, textures):
     materials = []
     for i, material in enumerate(mod.materials_data_array):
@@ -257,7 +553,7 @@ def _create_blender_materials_from_mod(mod, model_name, textures):
     return materials
 
 
-def _create_blender_armature_from_mod(blender_object, mod, armature_name):
+def _create_blender_armature_from_mod(blender_object, mod, armature_name, non_deform_bone_indices=None):
     armature = bpy.data.armatures.new(armature_name)
     armature_ob = bpy.data.objects.new(armature_name, armature)
     armature_ob.parent = blender_object
@@ -294,7 +590,8 @@ def _create_blender_armature_from_mod(blender_object, mod, armature_name):
 
     assert len(blender_bones) == len(mod.bones_array)
 
-    non_deform_bone_indices = get_non_deform_bone_indices(mod)
+    if non_deform_bone_indices is None:
+        non_deform_bone_indices = get_non_deform_bone_indices(mod)
     # set tails of bone to their children or make them small if they have none
     for i, bone in enumerate(blender_bones):
         if i in non_deform_bone_indices:
@@ -407,21 +704,3 @@ def _move_bone_to_layers(armature_ob, bone_index, *layer_indices):
     armature_ob.data.bones[bone_index].select = True
     bpy.ops.pose.bone_layers(layers=layers)
     armature_ob.data.bones[bone_index].select = False
-
-
-def _get_weights_per_bone(mod, mesh, vertices_array):
-    weights_per_bone = {}
-    if not mod.bone_count or not hasattr(vertices_array[0], 'bone_indices'):
-        return weights_per_bone
-    bone_palette = mod.bone_palette_array[mesh.bone_palette_index]
-    for vertex_index, vertex in enumerate(vertices_array):
-        for bi, bone_index in enumerate(vertex.bone_indices):
-            if bone_index >= bone_palette.unk_01:
-                real_bone_index = mod.bones_animation_mapping[bone_index]
-            else:
-                real_bone_index = bone_palette.values[bone_index]
-            if bone_index + vertex.weight_values[bi] == 0:
-                continue
-            bone_data = weights_per_bone.setdefault(real_bone_index, [])
-            bone_data.append((vertex_index, vertex.weight_values[bi] / 255))
-    return weights_per_bone
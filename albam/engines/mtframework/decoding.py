@@ -0,0 +1,341 @@
+"""
+Decoding of Mod156 meshes into flat arrays (locations, normals, uvs, triangles, weights)
+that Blender can consume in bulk, in a pool of worker processes.
+
+Workers return the arrays in shared memory instead of pickling them, along with
+a small descriptor of where each array is. The parent only maps them:
+
+    with ModDecoder() as decoder:
+        for decoded in decoder.map(mod_paths):
+            with decoded:
+                locations = decoded.meshes[0].arrays['locations']  # memoryview of floats
+"""
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from ctypes import addressof, c_char, sizeof, string_at
+from itertools import chain
+import os
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+from albam.engines.mtframework.mod_156 import Mod156, Mod156Header, Bone, MaterialData
+from albam.engines.mtframework.utils import (
+    get_non_deform_bone_indices,
+    get_vertices_array,
+    get_indices_array,
+    transform_vertices_from_bbox,
+    )
+from albam.lib.blender import strip_triangles_to_triangles_list
+from albam.lib.half_float import unpack_half_float
+from albam.lib.prefetch import get_mp_context
+
+
+# On Windows shared memory is freed when the process that created it closes it,
+# before the parent can map it, so arrays are sent pickled there
+USE_SHARED_MEMORY = shared_memory is not None and os.name != 'nt'
+ARRAY_ALIGNMENT = 8
+
+ArraySpec = namedtuple('ArraySpec', ('offset', 'typecode', 'length'))
+MeshDescriptor = namedtuple('MeshDescriptor', ('index', 'vertex_count', 'face_count', 'material_index',
+                                               'level_of_detail', 'arrays', 'error'))
+
+
+class ModInfo:
+    """
+    The parts of a Mod156 that importing needs besides the arrays of its meshes: the header
+    fields, bones, texture paths and materials, with the same attribute names as Mod156,
+    so a prefetched mod isn't parsed again. Picklable, the arrays are kept as bytes and
+    each one is built once, the first time it's accessed.
+    """
+
+    def __init__(self, mod):
+        self.header = Mod156Header.from_buffer_copy(string_at(addressof(mod), sizeof(Mod156Header)))
+        self._bones = bytes(mod.bones_array)
+        self._textures = bytes(mod.textures_array)
+        self._materials = bytes(mod.materials_data_array)
+        self.non_deform_bone_indices = get_non_deform_bone_indices(mod) if mod.bone_count else set()
+        self._arrays = {}
+
+    def __getattr__(self, name):
+        if name in ('header', '_arrays'):
+            raise AttributeError(name)
+        return getattr(self.header, name)
+
+    def __getstate__(self):
+        return dict(self.__dict__, _arrays={})
+
+    def _get_array(self, name, array_type, data):
+        arr = self._arrays.get(name)
+        if arr is None:
+            arr = self._arrays[name] = array_type.from_buffer_copy(data)
+        return arr
+
+    @property
+    def bones_array(self):
+        return self._get_array('bones_array', Bone * self.bone_count, self._bones)
+
+    @property
+    def textures_array(self):
+        return self._get_array('textures_array', (c_char * 64) * self.texture_count, self._textures)
+
+    @property
+    def materials_data_array(self):
+        return self._get_array('materials_data_array', MaterialData * self.material_count, self._materials)
+
+
+class ModDescriptor(namedtuple('ModDescriptor', ('file_path', 'shm_name', 'size', 'arrays', 'meshes', 'data',
+                                                 'mod_info', 'textures'))):
+    """
+    Where the decoded arrays of a mod are, with its ModInfo and <textures>, anything the
+    prefetch knows about them (see albam.engines.mtframework.blender_import)
+    """
+    __slots__ = ()
+
+    def track(self):
+        """
+        Register the shared memory with the resource tracker of this process when receiving
+        the descriptor, so it's unlinked if the process exits before releasing it
+        """
+        if self.shm_name:
+            # The tracker uses the name with the leading slash of posix shared memory
+            resource_tracker.register('/' + self.shm_name, 'shared_memory')
+
+    def release(self):
+        """Free the shared memory of a descriptor that might never be attached. Safe to call twice"""
+        if not self.shm_name:
+            return
+        try:
+            shm = shared_memory.SharedMemory(name=self.shm_name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+def decode_vertices(mod, mesh):
+    box_width = abs(mod.box_min_x) + abs(mod.box_max_x)
+    box_height = abs(mod.box_min_y) + abs(mod.box_max_y)
+    box_length = abs(mod.box_min_z) + abs(mod.box_max_z)
+
+    vertices_array = get_vertices_array(mod, mesh)
+
+    if mesh.vertex_format != 0:
+        locations = (transform_vertices_from_bbox(vf, box_width, box_height, box_length)
+                     for vf in vertices_array)
+    else:
+        locations = ((vf.position_x, vf.position_y, vf.position_z) for vf in vertices_array)
+
+    locations = map(lambda t: (t[0] / 100, t[2] / -100, t[1] / 100), locations)
+    # from [0, 255] o [-1, 1]
+    normals = map(lambda v: (((v.normal_x / 255) * 2) - 1,
+                             ((v.normal_y / 255) * 2) - 1,
+                             ((v.normal_z / 255) * 2) - 1), vertices_array)
+    # y up to z up
+    normals = map(lambda n: (n[0], n[2] * -1, n[1]), normals)
+
+    list_of_tuples = [(unpack_half_float(v.uv_x), unpack_half_float(v.uv_y) * -1) for v in vertices_array]
+    return {'locations': list(locations),
+            'normals': list(normals),
+            # TODO: investigate why uvs don't appear above the image in the UV editor
+            'uvs': list(chain.from_iterable(list_of_tuples)),
+            'weights_per_bone': get_weights_per_bone(mod, mesh, vertices_array)
+            }
+
+
+def get_weights_per_bone(mod, mesh, vertices_array):
+    weights_per_bone = {}
+    if not mod.bone_count or not hasattr(vertices_array[0], 'bone_indices'):
+        return weights_per_bone
+    bone_palette = mod.bone_palette_array[mesh.bone_palette_index]
+    for vertex_index, vertex in enumerate(vertices_array):
+        for bi, bone_index in enumerate(vertex.bone_indices):
+            if bone_index >= bone_palette.unk_01:
+                real_bone_index = mod.bones_animation_mapping[bone_index]
+            else:
+                real_bone_index = bone_palette.values[bone_index]
+            if bone_index + vertex.weight_values[bi] == 0:
+                continue
+            bone_data = weights_per_bone.setdefault(real_bone_index, [])
+            bone_data.append((vertex_index, vertex.weight_values[bi] / 255))
+    return weights_per_bone
+
+
+def decode_mesh_arrays(mod, mesh):
+    """
+    Return a dict of flat arrays for <mesh>: 'locations', 'normals' (3 floats per vertex),
+    'indices' (3 per triangle), 'loop_uvs' (2 floats per index) and the weights as three
+    parallel arrays 'weight_vertex_indices', 'weight_bone_indices' and 'weight_values',
+    sorted by value for each bone, so vertices with the same weight can be added at once
+    """
+    vertices = decode_vertices(mod, mesh)
+    indices = strip_triangles_to_triangles_list(get_indices_array(mod, mesh))
+    uvs = vertices['uvs']
+    weights = [(vertex_index, bone_index, weight)
+               for bone_index, data in vertices['weights_per_bone'].items()
+               for vertex_index, weight in sorted(data, key=lambda d: d[1])]
+    return {'locations': array('f', chain.from_iterable(vertices['locations'])),
+            'normals': array('f', chain.from_iterable(vertices['normals'])),
+            'indices': array('i', indices),
+            'loop_uvs': array('f', chain.from_iterable((uvs[i * 2], uvs[i * 2 + 1]) for i in indices)),
+            'weight_vertex_indices': array('i', (w[0] for w in weights)),
+            'weight_bone_indices': array('i', (w[1] for w in weights)),
+            'weight_values': array('f', (w[2] for w in weights)),
+            }
+
+
+def decode_bone_arrays(mod):
+    return {'bone_locations': array('f', chain.from_iterable(
+                (b.location_x, b.location_y, b.location_z) for b in mod.bones_array)),
+            'bone_parents': array('i', (b.parent_index for b in mod.bones_array)),
+            }
+
+
+def decode_mod(file_path, mod=None, textures=None):
+    """
+    Decode all the meshes and bones of the mod in <file_path> (a path or bytes), or of
+    <mod> if it was already parsed. Return a ModDescriptor; run in worker processes.
+    Meshes that fail to decode have an error message and no arrays.
+    """
+    mod = mod or Mod156(file_path=file_path)
+    mod_arrays = decode_bone_arrays(mod)
+    meshes = []
+    mesh_arrays = []
+    for i, mesh in enumerate(mod.meshes_array):
+        try:
+            arrays = decode_mesh_arrays(mod, mesh)
+            error = None
+        except Exception as err:
+            arrays, error = {}, '{}: {}'.format(type(err).__name__, err)
+        mesh_arrays.append(arrays)
+        meshes.append(MeshDescriptor(i, mesh.vertex_count, mesh.face_count, mesh.material_index,
+                                     mesh.level_of_detail, {}, error))
+
+    all_arrays = [mod_arrays] + mesh_arrays
+    specs, size = _layout(all_arrays)
+    meshes = [m._replace(arrays=s) for m, s in zip(meshes, specs[1:])]
+    path = file_path if isinstance(file_path, str) else None
+    mod_info = ModInfo(mod)
+
+    if USE_SHARED_MEMORY:
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            _copy_arrays(all_arrays, specs, shm.buf)
+        finally:
+            shm.close()
+        # The parent process unlinks it when done, and registers it when receiving it
+        resource_tracker.unregister(getattr(shm, '_name', shm.name), 'shared_memory')
+        return ModDescriptor(path, shm.name, size, specs[0], meshes, None, mod_info, textures)
+
+    data = bytearray(size)
+    _copy_arrays(all_arrays, specs, memoryview(data))
+    return ModDescriptor(path, None, size, specs[0], meshes, data, mod_info, textures)
+
+
+def _layout(arrays_list):
+    specs = []
+    offset = 0
+    for arrays in arrays_list:
+        spec = {}
+        for name, arr in arrays.items():
+            offset += -offset % ARRAY_ALIGNMENT
+            spec[name] = ArraySpec(offset, arr.typecode, len(arr))
+            offset += len(arr) * arr.itemsize
+        specs.append(spec)
+    return specs, offset
+
+
+def _copy_arrays(arrays_list, specs, buf):
+    for arrays, spec in zip(arrays_list, specs):
+        for name, arr in arrays.items():
+            nbytes = len(arr) * arr.itemsize
+            buf[spec[name].offset: spec[name].offset + nbytes] = memoryview(arr).cast('B')
+
+
+DecodedMesh = namedtuple('DecodedMesh', ('index', 'vertex_count', 'face_count', 'material_index',
+                                         'level_of_detail', 'arrays', 'error'))
+
+
+class DecodedMod:
+    """
+    The arrays of a ModDescriptor mapped in this process, as memoryviews with the typecode
+    of each array (numpy.frombuffer can wrap them without copies).
+    `close` must be called when done, after dropping any reference to the arrays.
+    """
+
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+        self.file_path = descriptor.file_path
+        if descriptor.shm_name:
+            self._shm = shared_memory.SharedMemory(name=descriptor.shm_name)
+            self._buf = self._shm.buf
+        else:
+            self._shm = None
+            self._buf = memoryview(descriptor.data)
+        self._views = []
+        self.arrays = self._map(descriptor.arrays)
+        self.meshes = [DecodedMesh(m.index, m.vertex_count, m.face_count, m.material_index,
+                                   m.level_of_detail, self._map(m.arrays), m.error)
+                       for m in descriptor.meshes]
+
+    def _map(self, specs):
+        arrays = {}
+        for name, spec in specs.items():
+            nbytes = spec.length * array(spec.typecode).itemsize
+            view = self._buf[spec.offset: spec.offset + nbytes].cast(spec.typecode)
+            self._views.append(view)
+            arrays[name] = view
+        return arrays
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        if self._shm:
+            self._buf = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ModDecoder:
+    """A pool of processes decoding mods. Results are DecodedMod instances"""
+
+    def __init__(self, max_workers=None):
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_mp_context())
+
+    def submit(self, file_path):
+        """Return a Future whose result is a ModDescriptor, to be passed to DecodedMod"""
+        future = self._executor.submit(decode_mod, file_path)
+        future.add_done_callback(_track_result)
+        return future
+
+    def map(self, file_paths):
+        """Yield a DecodedMod for each path in <file_paths>, in order"""
+        for descriptor in self._executor.map(decode_mod, file_paths):
+            descriptor.track()
+            yield DecodedMod(descriptor)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def _track_result(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().track()
@@ -0,0 +1,238 @@
+"""
+An index of the entries of all the arc files of a game, stored in sqlite.
+Only the file entries table at the beginning of each arc is read, so indexing
+a whole game takes seconds, and it's updated incrementally by modification time.
+
+    index = ArcIndex('re5.sqlite')
+    index.update('/path/to/re5/nativePC')
+    index.archives_containing('pl0200.mod')
+"""
+from collections import namedtuple
+import hashlib
+import ntpath
+import os
+import sqlite3
+
+from albam.engines.mtframework.arc import read_file_entries, read_entry, get_entry_extension
+from albam.lib.cache import FileCache, DEFAULT_CACHE_DIR, hash_bytes
+from albam.lib.misc import find_files
+
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.albam', 'arc_index.sqlite')
+ENTRIES_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'entries')
+
+IndexEntry = namedtuple('IndexEntry', ('archive_path', 'path', 'extension', 'file_id',
+                                       'size', 'zsize', 'offset', 'content_hash', 'archive_mtime'))
+IndexUpdate = namedtuple('IndexUpdate', ('added', 'updated', 'removed', 'unchanged', 'failed'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    hashed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entries (
+    archive_id INTEGER NOT NULL REFERENCES archives(id) ON DELETE CASCADE,
+    path TEXT NOT NULL COLLATE NOCASE,
+    name TEXT NOT NULL COLLATE NOCASE,
+    extension TEXT NOT NULL COLLATE NOCASE,
+    file_id INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    zsize INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path, extension);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+CREATE INDEX IF NOT EXISTS entries_archive ON entries (archive_id);
+CREATE INDEX IF NOT EXISTS entries_hash ON entries (content_hash);
+"""
+
+_ENTRY_COLUMNS = ('archives.path, entries.path, entries.extension, entries.file_id, '
+                  'entries.size, entries.zsize, entries.offset, entries.content_hash, archives.mtime')
+
+
+class ArcIndex:
+    """
+    Entries are stored with their path inside the arc as found in the file entries
+    (ntpath, no extension), e.g. 'pawn\\pl\\pl0200\\model\\pl0200' and 'mod'.
+    Lookups are case insensitive, like the game's file system.
+    """
+
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, root_dir, hash_contents=False):
+        """
+        Index all the arc files under <root_dir>, skipping the ones that didn't change
+        since the last update, and forget the ones that were deleted.
+        If <hash_contents> is True, entries are decompressed to store the sha1 of their
+        contents, which is much slower but allows finding duplicates across archives.
+        Return an IndexUpdate with the lists of archive paths in each category.
+        """
+        added, updated, unchanged, failed = [], [], [], []
+        arc_paths = sorted(os.path.abspath(p) for p in find_files(root_dir, '.arc'))
+        known = {path: (archive_id, mtime, size, hashed) for archive_id, path, mtime, size, hashed in
+                 self.connection.execute('SELECT id, path, mtime, size, hashed FROM archives')}
+
+        with self.connection:
+            for arc_path in arc_paths:
+                stat = os.stat(arc_path)
+                previous = known.get(arc_path)
+                if previous and previous[1:3] == (stat.st_mtime, stat.st_size) and \
+                        (previous[3] or not hash_contents):
+                    unchanged.append(arc_path)
+                    continue
+                try:
+                    self._index_archive(arc_path, stat, hash_contents, previous and previous[0])
+                except Exception as err:
+                    # TODO: logging
+                    print('Error indexing {}: {}'.format(arc_path, err))
+                    failed.append(arc_path)
+                    continue
+                (updated if previous else added).append(arc_path)
+
+            root = os.path.join(os.path.abspath(root_dir), '')
+            present = set(arc_paths)
+            removed = [path for path in known if path.startswith(root) and path not in present]
+            self.connection.executemany('DELETE FROM archives WHERE path = ?', ((p,) for p in removed))
+
+        return IndexUpdate(added, updated, removed, unchanged, failed)
+
+    def _index_archive(self, arc_path, stat, hash_contents, archive_id=None):
+        with open(arc_path, 'rb') as f:
+            header, file_entries = read_file_entries(f)
+            rows = []
+            for fe in file_entries:
+                path = fe.file_path.decode('ascii')
+                extension = get_entry_extension(fe.file_id)
+                content_hash = hashlib.sha1(read_entry(f, fe)).hexdigest() if hash_contents else None
+                rows.append((path, ntpath.basename(path) + '.' + extension, extension, fe.file_id,
+                             fe.size, fe.zsize, fe.offset, content_hash))
+
+        if archive_id:
+            self.connection.execute('DELETE FROM archives WHERE id = ?', (archive_id,))
+        cursor = self.connection.execute(
+            'INSERT INTO archives (path, mtime, size, version, hashed) VALUES (?, ?, ?, ?, ?)',
+            (arc_path, stat.st_mtime, stat.st_size, header.version, int(hash_contents)))
+        archive_id = cursor.lastrowid
+        self.connection.executemany(
+            'INSERT INTO entries (archive_id, path, name, extension, file_id, size, zsize, offset, '
+            'content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            ((archive_id,) + row for row in rows))
+
+    def find(self, path):
+        """
+        Return a list of IndexEntry for <path>, which can be a file name with extension
+        ('pl0200.mod') or a full path inside the arc ('pawn\\pl\\pl0200\\model\\pl0200.mod')
+        """
+        if ntpath.sep in path:
+            path_no_ext, _, extension = path.rpartition('.')
+            where, params = 'entries.path = ? AND entries.extension = ?', (path_no_ext, extension)
+        else:
+            where, params = 'entries.name = ?', (path,)
+        return self._query_entries(where, params)
+
+    def find_by_hash(self, content_hash):
+        return self._query_entries('entries.content_hash = ?', (content_hash,))
+
+    def archives_containing(self, path):
+        return sorted({entry.archive_path for entry in self.find(path)})
+
+    def list_archive(self, arc_path):
+        return self._query_entries('archives.path = ?', (os.path.abspath(arc_path),))
+
+    def find_textures(self, mod):
+        """
+        Return a dict {texture path: list of IndexEntry} for all the textures referenced
+        by the Mod156 instance <mod>. Textures not found have an empty list.
+        """
+        textures = {}
+        for texture_path in mod.textures_array:
+            path = texture_path[:].decode('ascii').partition('\x00')[0]
+            textures[path] = self._query_entries('entries.path = ? AND entries.extension = ?',
+                                                 (path, 'tex'))
+        return textures
+
+    def _query_entries(self, where, params):
+        query = ('SELECT {} FROM entries JOIN archives ON archives.id = entries.archive_id '
+                 'WHERE {} ORDER BY archives.path, entries.offset'.format(_ENTRY_COLUMNS, where))
+        return [IndexEntry(*row) for row in self.connection.execute(query, params)]
+
+
+def extract_entry(index_entry):
+    """Return the decompressed contents of <index_entry>, reading only that entry from its arc"""
+    with open(index_entry.archive_path, 'rb') as f:
+        return read_entry(f, index_entry)
+
+
+class EntryResolver:
+    """
+    Find files in any of the archives of an ArcIndex, e.g. textures of a mod that
+    live in a shared archive, and extract only those entries on demand.
+    Extracted files are kept in a FileCache, so later imports don't read the archives again.
+    Archives in <preferred_archives> win when several contain the same path, and
+    `archive_paths` keeps the archive each resolved file was extracted from.
+    """
+
+    def __init__(self, arc_index, cache=None, preferred_archives=()):
+        self.arc_index = arc_index
+        self.cache = cache or FileCache(ENTRIES_CACHE_DIR)
+        self.preferred_archives = [os.path.abspath(p) for p in preferred_archives]
+        self.archive_paths = {}  # local path: arc path
+        self._resolved = {}
+
+    def resolve(self, path):
+        """
+        Return the path of a local file with the contents of <path> (ntpath with extension,
+        as referenced inside the game files), or None if no archive in the index contains it
+        """
+        key = path.lower()
+        if key not in self._resolved:
+            self._resolved[key] = self._resolve(path)
+        return self._resolved[key]
+
+    def _resolve(self, path):
+        entries = self.arc_index.find(path)
+        if not entries:
+            return None
+        entry = min(entries, key=self._preference)
+        # Offsets change if the archive is repacked, and the modification time if it's
+        # rewritten in place with the same layout, so both are part of the key
+        content_key = entry.content_hash or hash_bytes('{}:{}:{}:{}:{!r}'.format(
+            entry.archive_path, entry.offset, entry.zsize, entry.size, entry.archive_mtime).encode('utf-8'))
+        key = '/'.join((content_key, ntpath.basename(path)))
+        cached_path = self.cache.get(key)
+        if not cached_path:
+            try:
+                cached_path = self.cache.put(key, extract_entry(entry))
+            except Exception as err:
+                # TODO: logging
+                print('Error extracting {} from {}: {}'.format(path, entry.archive_path, err))
+                return None
+        self.archive_paths[cached_path] = entry.archive_path
+        return cached_path
+
+    def _preference(self, entry):
+        try:
+            return (self.preferred_archives.index(entry.archive_path), entry.archive_path)
+        except ValueError:
+            return (len(self.preferred_archives), entry.archive_path)
@@ -2,6 +2,7 @@ from ctypes import (
     Structure,
     LittleEndianStructure,
     c_uint, c_uint8, c_uint16, c_float, c_char, c_short, c_ushort, c_byte, c_ubyte,
+    sizeof,
 )
 
 from albam.engines.mtframework.defaults import DEFAULT_MATERIAL
@@ -82,6 +83,28 @@ class Mod156(DynamicStructure):
                 )
 
 
+class Mod156Header(Structure):
+    """Fixed size part of Mod156, to write the header without the buffers, see `write_mod156`"""
+    _pack_ = 1
+    _fields_ = Mod156._fields_[:[f[0] for f in Mod156._fields_].index('unk_12')]
+
+
+# Everything after the header, in order. 'meshes_array_2_size' is written by `write_mod156`
+MOD156_SECTIONS = ('unk_12', 'bones_array', 'bones_unk_matrix_array', 'bones_world_transform_matrix_array',
+                   'bones_animation_mapping', 'bone_palette_array', 'group_data_array', 'textures_array',
+                   'materials_data_array', 'meshes_array', 'meshes_array_2', 'vertex_buffer',
+                   'vertex_buffer_2', 'index_buffer')
+# Header fields set by `write_mod156` from the layout. 'bones_array_offset' is left to the
+# caller, since it's 0 in mods without bones
+MOD156_OFFSETS = (('group_offset', 'group_data_array'),
+                  ('textures_array_offset', 'textures_array'),
+                  ('meshes_array_offset', 'meshes_array'),
+                  ('vertex_buffer_offset', 'vertex_buffer'),
+                  ('vertex_buffer_2_offset', 'vertex_buffer_2'),
+                  ('index_buffer_offset', 'index_buffer'),
+                  )
+
+
 class Bone(Structure):
     _fields_ = (('anim_map_index', c_ubyte),
                 ('parent_index', c_ubyte),  # 255: root
@@ -318,3 +341,68 @@ VERTEX_FORMATS_TO_CLASSES = {0: VertexFormat0,
 
 
 CLASSES_TO_VERTEX_FORMATS = {v: k for k, v in VERTEX_FORMATS_TO_CLASSES.items()}
+
+
+def _get_nbytes(section):
+    try:
+        return sizeof(section)
+    except TypeError:
+        return memoryview(section).nbytes
+
+
+def plan_mod156_layout(sections):
+    """
+    Return a tuple (offsets, size) with a dict of {section name: offset} for the
+    buffers in <sections> (see `write_mod156`), and the size of the whole file
+    """
+    offsets = {}
+    offset = sizeof(Mod156Header)
+    for name in MOD156_SECTIONS:
+        if name == 'meshes_array_2':
+            offset += sizeof(c_uint)  # meshes_array_2_size
+        offsets[name] = offset
+        offset += _get_nbytes(sections[name])
+    return offsets, offset
+
+
+def write_mod156(sink, header, sections):
+    """
+    Write a Mod156 file to the binary file object <sink>, writing each buffer directly
+    instead of copying all of them into a Mod156 instance first.
+    <header> is a Mod156Header with the counts and sizes of <sections> set, and <sections>
+    a dict with a ctypes array or any object with the buffer protocol for each name in
+    MOD156_SECTIONS. The offsets of <header> are set here.
+    Return the number of bytes written.
+    """
+    _check_mod156_sizes(header, sections)
+    offsets, size = plan_mod156_layout(sections)
+    for field_name, section_name in MOD156_OFFSETS:
+        setattr(header, field_name, offsets[section_name])
+
+    sink.write(header)
+    for name in MOD156_SECTIONS:
+        if name == 'meshes_array_2':
+            sink.write(c_uint(_get_nbytes(sections[name]) // sizeof(MeshBox)))
+        sink.write(sections[name])
+    return size
+
+
+def _check_mod156_sizes(header, sections):
+    expected = (('unk_12', header.bones_array_offset - sizeof(Mod156Header) if header.unk_08 else 0),
+                ('bones_array', header.bone_count * sizeof(Bone)),
+                ('bones_unk_matrix_array', header.bone_count * sizeof(c_float) * 16),
+                ('bones_world_transform_matrix_array', header.bone_count * sizeof(c_float) * 16),
+                ('bones_animation_mapping', 256 if header.bone_palette_count else 0),
+                ('bone_palette_array', header.bone_palette_count * sizeof(BonePalette)),
+                ('group_data_array', header.group_count * sizeof(GroupData)),
+                ('textures_array', header.texture_count * 64),
+                ('materials_data_array', header.material_count * sizeof(MaterialData)),
+                ('meshes_array', header.mesh_count * sizeof(Mesh156)),
+                ('vertex_buffer', header.vertex_buffer_size),
+                ('vertex_buffer_2', header.vertex_buffer_2_size),
+                ('index_buffer', (header.face_count - 1) * sizeof(c_ushort)),
+                )
+    for name, nbytes in expected:
+        if _get_nbytes(sections[name]) != nbytes:
+            raise ValueError('Size of {} is {} bytes, the header says {}'.format(
+                name, _get_nbytes(sections[name]), nbytes))
@@ -1,15 +1,15 @@
-from ctypes import c_int, c_uint, c_char, c_short, c_float, c_byte, sizeof
-import os
+from ctypes import Structure, c_int, c_uint, c_char, c_short, c_float, c_byte, sizeof
 
 from albam.image_formats.dds import DDSHeader, DDS
-from albam.lib.structure import DynamicStructure
+from albam.image_formats.dxt import decode_mipmap, encode_mipmaps
+from albam.lib.misc import copy_file_range, get_file_size
+from albam.lib.structure import DynamicStructure, get_source_size
 from albam.engines.mtframework.defaults import DEFAULT_TEXTURE
 
 
-class Tex112(DynamicStructure):
-
-    ID_MAGIC = b'TEX'
-    _defaults_ = DEFAULT_TEXTURE
+class Tex112Header(Structure):
+    """Fixed size part of Tex112, to read or write the header without the data"""
+    _pack_ = 1
     _fields_ = (('id_magic', c_char * 4),
                 ('version', c_short),
                 ('revision', c_short),
@@ -25,53 +25,98 @@ class Tex112(DynamicStructure):
                 ('unk_float_2', c_float),
                 ('unk_float_3', c_float),
                 ('unk_float_4', c_float),
-                ('mipmap_offsets', lambda s: c_uint * s.mipmap_count),
-                ('dds_data', lambda s, f: c_byte * (os.path.getsize(f) - 40 -
-                 sizeof(s.mipmap_offsets)) if f else c_byte * len(s.dds_data)),
                 )
 
+
+class Tex112(DynamicStructure):
+
+    ID_MAGIC = b'TEX'
+    _defaults_ = DEFAULT_TEXTURE
+    _fields_ = Tex112Header._fields_ + (
+        ('mipmap_offsets', lambda s: c_uint * s.mipmap_count),
+        ('dds_data', lambda s, f: c_byte * (get_source_size(f) - 40 -
+         sizeof(s.mipmap_offsets)) if f else c_byte * len(s.dds_data)),
+    )
+
     def to_dds(self):
-        header = DDSHeader(dwHeight=self.height, dwWidth=self.width,
-                           dwMipMapCount=self.mipmap_count,
-                           pixelfmt_dwFourCC=self.compression_format)
+        header = self.get_dds_header()
         dds = DDS(header=header, data=self.dds_data)
-        dds.set_constants()
-        dds.set_variables()
         return dds
 
+    def get_dds_header(self, mipmap_bias=0):
+        return get_dds_header(self, mipmap_bias)
+
+    def write_dds(self, w, mipmap_bias=0):
+        """
+        Write this texture as a dds to the file object <w>, without copying the data
+        like `to_dds` does. If <mipmap_bias> is given, the first mipmaps are skipped.
+        """
+        mipmap_bias = clamp_mipmap_bias(self, mipmap_bias)
+        start = self.mipmap_offsets[mipmap_bias] - self.mipmap_offsets[0] if mipmap_bias else 0
+        w.write(self.get_dds_header(mipmap_bias))
+        w.write(memoryview(self.dds_data)[start:])
+
+    def to_rgba(self, level=0):
+        """Decode the mipmap <level> into an RGBA numpy array with shape (height, width, 4)"""
+        return decode_mipmap(self.dds_data, self.width, self.height, self.compression_format, level)
+
     @classmethod
     def from_dds(cls, file_path):
         dds = DDS(file_path=file_path)
-        mipmap_count = dds.header.dwMipMapCount
-        width = dds.header.dwWidth
-        height = dds.header.dwHeight
-        compression_format = dds.header.pixelfmt_dwFourCC
-        fixed_size_of_header = 40
+        header, mipmap_offsets = cls.header_from_dds_header(dds.header)
+        dds_data = (c_byte * len(dds.data)).from_buffer(dds.data)
+
+        tex = cls(mipmap_offsets=mipmap_offsets,
+                  dds_data=dds_data,
+                  **{name: getattr(header, name) for name, _ in Tex112Header._fields_})
+
+        return tex
+
+    @classmethod
+    def from_rgba(cls, rgba, fmt=b'DXT5', mipmap_count=None):
+        """
+        Create a texture from an RGBA uint8 numpy array with shape (height, width, 4),
+        generating all the mipmaps (or <mipmap_count>) and compressing them with <fmt>
+        """
+        height, width = rgba.shape[:2]
+        mipmap_count, data = encode_mipmaps(rgba, fmt, mipmap_count)
+        dds_header = DDS.create_header(width, height, mipmap_count, fmt)
+        header, mipmap_offsets = cls.header_from_dds_header(dds_header)
+        dds_data = (c_byte * len(data)).from_buffer_copy(data)
+
+        return cls(mipmap_offsets=mipmap_offsets,
+                   dds_data=dds_data,
+                   **{name: getattr(header, name) for name, _ in Tex112Header._fields_})
+
+    @classmethod
+    def header_from_dds_header(cls, dds_header):
+        """Return a tuple (Tex112Header, mipmap_offsets) for the given DDSHeader"""
+        mipmap_count = dds_header.dwMipMapCount
+        width = dds_header.dwWidth
+        height = dds_header.dwHeight
+        compression_format = dds_header.pixelfmt_dwFourCC
+        fixed_size_of_header = sizeof(Tex112Header)
         start_offset = fixed_size_of_header + (mipmap_count * 4)
         mipmap_offsets = cls.calculate_mipmap_offsets(mipmap_count, width, height, compression_format, start_offset)
         assert len(mipmap_offsets) == mipmap_count
         mipmap_offsets = (c_uint * len(mipmap_offsets))(*mipmap_offsets)
-        dds_data = (c_byte * len(dds.data)).from_buffer(dds.data)
 
         # TODO: Don't hardcode uknown floats (seem to be brightness values)
-        tex = cls(id_magic=cls.ID_MAGIC,
-                  version=112,
-                  revision=34,
-                  mipmap_count=mipmap_count,
-                  unk_byte_1=1,
-                  unk_byte_2=0,
-                  unk_byte_3=0,
-                  width=width,
-                  height=height,
-                  compression_format=compression_format,
-                  unk_float_1=0.76,
-                  unk_float_2=0.76,
-                  unk_float_3=0.76,
-                  unk_float_4=0,
-                  mipmap_offsets=mipmap_offsets,
-                  dds_data=dds_data)
-
-        return tex
+        header = Tex112Header(id_magic=cls.ID_MAGIC,
+                              version=112,
+                              revision=34,
+                              mipmap_count=mipmap_count,
+                              unk_byte_1=1,
+                              unk_byte_2=0,
+                              unk_byte_3=0,
+                              width=width,
+                              height=height,
+                              compression_format=compression_format,
+                              unk_float_1=0.76,
+                              unk_float_2=0.76,
+                              unk_float_3=0.76,
+                              unk_float_4=0)
+        return header, mipmap_offsets
 
     @classmethod
     def from_multiple_dds(cls, version=112, *file_paths):
@@ -86,3 +131,81 @@ class Tex112(DynamicStructure):
             current_offset += size
             offsets.append(current_offset)
         return offsets
+
+
+def read_tex_header(f):
+    """
+    Read only the header of a tex from the binary file object <f>.
+    Return a tuple (Tex112Header, mipmap_offsets)
+    """
+    header = Tex112Header()
+    f.readinto(header)
+    if header.id_magic != Tex112.ID_MAGIC:
+        raise TypeError('Not a tex file. Id magic: {}'.format(header.id_magic))
+    mipmap_offsets = (c_uint * header.mipmap_count)()
+    f.readinto(mipmap_offsets)
+    return header, mipmap_offsets
+
+
+def get_mipmap_bias(width, height, max_size):
+    """Return how many mipmaps to skip so the texture is not bigger than <max_size>"""
+    mipmap_bias = 0
+    if not max_size:
+        return mipmap_bias
+    while max(width, height) >> mipmap_bias > max_size:
+        mipmap_bias += 1
+    return mipmap_bias
+
+
+def clamp_mipmap_bias(header, mipmap_bias):
+    """Never skip the last mipmap"""
+    return max(0, min(mipmap_bias, header.mipmap_count - 1))
+
+
+def get_dds_header(header, mipmap_bias=0):
+    """
+    Return the DDSHeader for a Tex112 or Tex112Header, optionally for the
+    texture that starts at the mipmap <mipmap_bias>
+    """
+    mipmap_bias = clamp_mipmap_bias(header, mipmap_bias)
+    return DDS.create_header(max(1, header.width >> mipmap_bias),
+                             max(1, header.height >> mipmap_bias),
+                             header.mipmap_count - mipmap_bias,
+                             header.compression_format)
+
+
+def tex_file_to_dds(src, dst, mipmap_bias=0):
+    """
+    Convert the tex in the binary file object <src> to a dds written to <dst>.
+    Only the header is parsed and converted, the data is copied as is from
+    one file to the other.
+    If <mipmap_bias> is given, the first mipmaps are skipped and only
+    the smaller ones are copied.
+    """
+    header, mipmap_offsets = read_tex_header(src)
+    mipmap_bias = clamp_mipmap_bias(header, mipmap_bias)
+    if mipmap_bias:
+        data_offset = mipmap_offsets[mipmap_bias]
+    else:
+        data_offset = sizeof(header) + sizeof(mipmap_offsets)
+    data_size = get_file_size(src) - data_offset
+    dst.write(get_dds_header(header, mipmap_bias))
+    copy_file_range(src, dst, data_offset, data_size)
+
+
+def dds_file_to_tex(src, dst):
+    """
+    Convert the dds in the binary file object <src> to a tex written to <dst>.
+    Only the header is parsed and converted, the data is copied as is from
+    one file to the other.
+    """
+    dds_header = DDSHeader()
+    src.readinto(dds_header)
+    if dds_header.id_magic != b'DDS ':
+        raise TypeError('Not a dds file. Id magic: {}'.format(dds_header.id_magic))
+    header, mipmap_offsets = Tex112.header_from_dds_header(dds_header)
+    data_offset = sizeof(dds_header)
+    data_size = get_file_size(src) - data_offset
+    dst.write(header)
+    dst.write(mipmap_offsets)
+    copy_file_range(src, dst, data_offset, data_size)
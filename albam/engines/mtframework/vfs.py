@@ -0,0 +1,121 @@
+"""
+A read-only file system over the contents of arc files, so files can be read
+without extracting whole archives to disk first.
+
+    vfs = ArcFileSystem(['uPl01ShebaCos1.arc'])
+    vfs.listdir('pawn\\pl\\pl0100\\model')
+    mod = Mod156(file_path=vfs.open('pawn\\pl\\pl0100\\model\\pl0100.mod'))
+"""
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+import ntpath
+import os
+
+from albam.engines.mtframework.arc import read_file_entries, read_entry, get_entry_path
+from albam.lib.profiling import count
+
+
+DEFAULT_CACHE_SIZE = 128 * 1024 * 1024
+
+MountedEntry = namedtuple('MountedEntry', ('arc_path', 'path', 'offset', 'zsize', 'size'))
+
+
+def normalize_path(path):
+    """Paths inside arcs are case insensitive and use backslashes, but slashes are accepted too"""
+    return path.replace('/', ntpath.sep).strip(ntpath.sep).lower()
+
+
+class ArcFileSystem:
+    """
+    Files from all the mounted arc files, with paths as found inside them, with extension.
+    If several archives have the same path, the last one mounted wins.
+    Entries are decompressed when read, and the most recently used ones are kept in memory
+    up to <cache_size> bytes.
+    """
+
+    def __init__(self, arc_paths=(), cache_size=DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.arc_paths = []
+        self._entries = {}  # normalized path: MountedEntry
+        self._dirs = {'': set()}  # normalized dir path: set of child names
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        for arc_path in arc_paths:
+            self.mount(arc_path)
+
+    def mount(self, arc_path):
+        arc_path = os.path.abspath(arc_path)
+        with open(arc_path, 'rb') as f:
+            _, file_entries = read_file_entries(f)
+        for fe in file_entries:
+            path = get_entry_path(fe)
+            key = normalize_path(path)
+            self._invalidate(key)
+            self._entries[key] = MountedEntry(arc_path, path, fe.offset, fe.zsize, fe.size)
+            self._add_to_dirs(path)
+        self.arc_paths.append(arc_path)
+
+    def _add_to_dirs(self, path):
+        parts = normalize_path(path).split(ntpath.sep)
+        names = path.strip(ntpath.sep).split(ntpath.sep)
+        for i in range(len(parts)):
+            parent = ntpath.sep.join(parts[:i])
+            self._dirs.setdefault(parent, set()).add(names[i])
+            if i < len(parts) - 1:
+                self._dirs.setdefault(ntpath.sep.join(parts[:i + 1]), set())
+
+    def exists(self, path):
+        key = normalize_path(path)
+        return key in self._entries or key in self._dirs
+
+    def isfile(self, path):
+        return normalize_path(path) in self._entries
+
+    def isdir(self, path):
+        return normalize_path(path) in self._dirs
+
+    def listdir(self, path=''):
+        try:
+            return sorted(self._dirs[normalize_path(path)])
+        except KeyError:
+            raise FileNotFoundError('No such directory in the mounted arcs: {}'.format(path))
+
+    def find(self, extension=None):
+        """Return the paths of all files that end with <extension>, like `albam.lib.misc.find_files`"""
+        extension = extension.lower() if extension else None
+        return sorted(entry.path for key, entry in self._entries.items()
+                      if not extension or key.endswith(extension))
+
+    def get_entry(self, path):
+        try:
+            return self._entries[normalize_path(path)]
+        except KeyError:
+            raise FileNotFoundError('No such file in the mounted arcs: {}'.format(path))
+
+    def read(self, path):
+        key = normalize_path(path)
+        data = self._cache.get(key)
+        if data is not None:
+            self._cache.move_to_end(key)
+            return data
+        entry = self.get_entry(path)
+        with open(entry.arc_path, 'rb') as f:
+            data = read_entry(f, entry)
+        count('bytes_decompressed', len(data))
+        if len(data) <= self.cache_size:
+            self._cache[key] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_size:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+        return data
+
+    def open(self, path, mode='rb'):
+        if mode != 'rb':
+            raise ValueError('Files in arcs can only be opened with mode "rb"')
+        return BytesIO(self.read(path))
+
+    def _invalidate(self, key):
+        data = self._cache.pop(key, None)
+        if data is not None:
+            self._cached_bytes -= len(data)
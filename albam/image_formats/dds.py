@@ -1,7 +1,6 @@
 from ctypes import Structure, sizeof, c_int, c_char, c_byte
-import os
 
-from albam.lib.structure import DynamicStructure
+from albam.lib.structure import DynamicStructure, get_source_size
 
 
 class DDSHeader(Structure):
@@ -60,30 +59,57 @@ class DDS(DynamicStructure):
     REQUIRED_FLAGS = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT
 
     _fields_ = (('header', DDSHeader),
-                ('data', lambda s, f: c_byte * (os.path.getsize(f) - sizeof(s.header)) if f else c_byte * len(s.data)),
+                ('data', lambda s, f: c_byte * (get_source_size(f) - sizeof(s.header)) if f else c_byte * len(s.data)),
                 )
 
     # TODO: set this automatically on __init__
     def set_constants(self):
-        self.header.id_magic = b'DDS '
-        self.header.dwSize = 124
-        self.header.dwFlags = self.REQUIRED_FLAGS
+        self.set_header_constants(self.header)
 
-        self.header.pixelfmt_dwSize = 32
+    def set_variables(self):
+        self.set_header_variables(self.header)
 
-        self.header.pixelfmt_dwFlags = (c_byte * 4)(4, 0, 0, 0)
+    @classmethod
+    def create_header(cls, width, height, mipmap_count, fmt):
+        """
+        Return a complete DDSHeader, so the header can be written on its own
+        followed by the data without building a DDS structure
+        """
+        header = DDSHeader(dwHeight=height, dwWidth=width,
+                           dwMipMapCount=mipmap_count,
+                           pixelfmt_dwFourCC=fmt)
+        cls.set_header_constants(header)
+        cls.set_header_variables(header)
+        return header
 
-        self.header.dwCaps = self.DDSCAPS_TEXTURE
+    @classmethod
+    def set_header_constants(cls, header):
+        header.id_magic = b'DDS '
+        header.dwSize = 124
+        header.dwFlags = cls.REQUIRED_FLAGS
 
-    def set_variables(self):
-        self.header.dwPitchOrLinearSize = self.calculate_linear_size(self.header.dwWidth,
-                                                                     self.header.dwHeight,
-                                                                     self.header.pixelfmt_dwFourCC)
-        if self.header.dwMipMapCount:
-            self.header.dwFlags |= self.DDSD_MIPMAPCOUNT
-            self.header.dwCaps |= self.DDSCAPS_MIPMAP
-        if self.header.dwMipMapCount:  # TODO: add 'or cubic or mipmapped_volume'
-            self.header.dwCaps |= self.DDSCAPS_COMPLEX
+        header.pixelfmt_dwSize = 32
+
+        header.pixelfmt_dwFlags = (c_byte * 4)(4, 0, 0, 0)
+
+        header.dwCaps = cls.DDSCAPS_TEXTURE
+
+    @classmethod
+    def set_header_variables(cls, header):
+        header.dwPitchOrLinearSize = cls.calculate_linear_size(header.dwWidth,
+                                                               header.dwHeight,
+                                                               header.pixelfmt_dwFourCC)
+        if header.dwMipMapCount:
+            header.dwFlags |= cls.DDSD_MIPMAPCOUNT
+            header.dwCaps |= cls.DDSCAPS_MIPMAP
+        if header.dwMipMapCount:  # TODO: add 'or cubic or mipmapped_volume'
+            header.dwCaps |= cls.DDSCAPS_COMPLEX
+
+    def to_rgba(self, level=0):
+        """Decode the mipmap <level> into an RGBA numpy array with shape (height, width, 4)"""
+        from albam.image_formats.dxt import decode_mipmap
+        return decode_mipmap(self.data, self.header.dwWidth, self.header.dwHeight,
+                             self.header.pixelfmt_dwFourCC, level)
 
     @property
     def mipmap_sizes(self):
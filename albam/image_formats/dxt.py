@@ -0,0 +1,285 @@
+"""
+Block compression (DXT1, DXT3, DXT5) decoding and encoding with numpy, to work with
+textures without Blender or external tools. All the blocks of a mipmap are processed at once.
+https://docs.microsoft.com/en-us/windows/win32/direct3d10/d3d10-graphics-programming-guide-resources-block-compression
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from albam.image_formats.dds import DDS
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError('numpy is required to decode or encode block compressed textures')
+
+
+def get_mipmap_dimensions(width, height, level):
+    return max(1, width >> level), max(1, height >> level)
+
+
+def get_mipmap_data(data, width, height, fmt, level=0):
+    """
+    Return a memoryview of the mipmap <level> inside <data>, which contains
+    all the mipmaps one after the other starting from the biggest one
+    """
+    offset = sum(DDS.calculate_mipmap_size(width, height, i, fmt) for i in range(level))
+    size = DDS.calculate_mipmap_size(width, height, level, fmt)
+    data = memoryview(data).cast('B')
+    if offset + size > len(data):
+        raise ValueError('Mipmap level {} out of bounds, data length: {}'.format(level, len(data)))
+    return data[offset:offset + size]
+
+
+def decode_mipmap(data, width, height, fmt, level=0):
+    """
+    Decode the mipmap <level> from <data>, which contains all the mipmaps one after
+    the other, and return an RGBA uint8 array with shape (height, width, 4)
+    """
+    mipmap_data = get_mipmap_data(data, width, height, fmt, level)
+    mipmap_width, mipmap_height = get_mipmap_dimensions(width, height, level)
+    return decode_dxt(mipmap_data, mipmap_width, mipmap_height, fmt)
+
+
+def decode_dxt(data, width, height, fmt):
+    """
+    Decode a single block compressed image in <data> and return an RGBA uint8
+    array with shape (height, width, 4)
+    """
+    _require_numpy()
+    if fmt not in (b'DXT1', b'DXT3', b'DXT5'):
+        raise RuntimeError('Unsupported format to decode: {}'.format(fmt))
+    block_size = DDS.get_block_size(fmt)
+    blocks_x = (width + 3) // 4
+    blocks_y = (height + 3) // 4
+    blocks = np.frombuffer(data, dtype=np.uint8, count=blocks_x * blocks_y * block_size)
+    blocks = blocks.reshape(-1, block_size)
+
+    if fmt == b'DXT1':
+        pixels = _decode_color_blocks(blocks, three_color_mode=True)
+    else:
+        pixels = _decode_color_blocks(blocks[:, 8:], three_color_mode=False)
+        if fmt == b'DXT3':
+            pixels[:, :, 3] = _decode_explicit_alpha_blocks(blocks[:, :8])
+        else:
+            pixels[:, :, 3] = _decode_interpolated_alpha_blocks(blocks[:, :8])
+
+    # (blocks_y, blocks_x, 4 rows, 4 columns, rgba) -> (rows, columns, rgba)
+    pixels = pixels.reshape(blocks_y, blocks_x, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    pixels = pixels.reshape(blocks_y * 4, blocks_x * 4, 4)
+    return np.ascontiguousarray(pixels[:height, :width])
+
+
+def rgb565_to_rgb888(colors):
+    colors = colors.astype(np.uint16)
+    r = (colors >> 11) & 0x1f
+    g = (colors >> 5) & 0x3f
+    b = colors & 0x1f
+    return np.stack(((r << 3) | (r >> 2),
+                     (g << 2) | (g >> 4),
+                     (b << 3) | (b >> 2)), axis=-1)
+
+
+def _decode_color_blocks(blocks, three_color_mode):
+    """Return an array (block_count, 16, 4) from 8 bytes color blocks"""
+    block_count = blocks.shape[0]
+    c0 = blocks[:, 0].astype(np.uint16) | (blocks[:, 1].astype(np.uint16) << 8)
+    c1 = blocks[:, 2].astype(np.uint16) | (blocks[:, 3].astype(np.uint16) << 8)
+    rgb0 = rgb565_to_rgb888(c0)
+    rgb1 = rgb565_to_rgb888(c1)
+
+    palette = np.empty((block_count, 4, 4), dtype=np.uint16)
+    palette[:, :, 3] = 255
+    palette[:, 0, :3] = rgb0
+    palette[:, 1, :3] = rgb1
+    palette[:, 2, :3] = (2 * rgb0 + rgb1) // 3
+    palette[:, 3, :3] = (rgb0 + 2 * rgb1) // 3
+    if three_color_mode:
+        three_colors = c0 <= c1
+        palette[three_colors, 2, :3] = (rgb0[three_colors] + rgb1[three_colors]) // 2
+        palette[three_colors, 3] = 0
+
+    indices = blocks[:, 4:8].copy().view('<u4').reshape(block_count, 1)
+    indices = (indices >> (2 * np.arange(16, dtype=np.uint32))) & 0x3
+    pixels = np.take_along_axis(palette, indices[:, :, None].astype(np.intp), axis=1)
+    return pixels.astype(np.uint8)
+
+
+def _decode_explicit_alpha_blocks(blocks):
+    """DXT3: 4 bits per pixel. Return an array (block_count, 16)"""
+    alpha = blocks.copy().view('<u8').reshape(-1, 1)
+    alpha = (alpha >> (4 * np.arange(16, dtype=np.uint64))) & 0xf
+    return (alpha * 17).astype(np.uint8)
+
+
+def _decode_interpolated_alpha_blocks(blocks):
+    """DXT5: 2 reference values and 3 bits indices per pixel. Return an array (block_count, 16)"""
+    block_count = blocks.shape[0]
+    a0 = blocks[:, 0].astype(np.uint16)
+    a1 = blocks[:, 1].astype(np.uint16)
+
+    weights = np.arange(8, dtype=np.uint16)
+    palette = np.empty((block_count, 8), dtype=np.uint16)
+    palette[:, 0] = a0
+    palette[:, 1] = a1
+    # 8 values mode
+    palette[:, 2:8] = ((7 - weights[1:7]) * a0[:, None] + weights[1:7] * a1[:, None]) // 7
+    # 6 values mode, plus 0 and 255
+    six_values = a0 <= a1
+    palette[six_values, 2:6] = (((5 - weights[1:5]) * a0[six_values, None] +
+                                 weights[1:5] * a1[six_values, None]) // 5)
+    palette[six_values, 6] = 0
+    palette[six_values, 7] = 255
+
+    # 48 bits of indices, padded to 64
+    indices_bytes = np.zeros((block_count, 8), dtype=np.uint8)
+    indices_bytes[:, :6] = blocks[:, 2:8]
+    indices = indices_bytes.view('<u8').reshape(block_count, 1)
+    indices = (indices >> (3 * np.arange(16, dtype=np.uint64))) & 0x7
+    return np.take_along_axis(palette, indices.astype(np.intp), axis=1).astype(np.uint8)
+
+
+def generate_mipmaps(rgba, mipmap_count=None):
+    """
+    Return a list of RGBA uint8 arrays, starting with <rgba> and followed by
+    each mipmap down to 1x1 (or <mipmap_count> levels in total), using a box filter
+    """
+    _require_numpy()
+    height, width = rgba.shape[:2]
+    if mipmap_count is None:
+        mipmap_count = DDS.calculate_mipmap_count(width, height)
+    mipmaps = [rgba]
+    current = rgba.astype(np.float32)
+    for _ in range(mipmap_count - 1):
+        current = _downsample(current)
+        mipmaps.append(np.clip(np.rint(current), 0, 255).astype(np.uint8))
+    return mipmaps
+
+
+def _downsample(image):
+    height, width = image.shape[:2]
+    if height > 1:
+        image = image[:height // 2 * 2]
+        image = (image[0::2] + image[1::2]) * 0.5
+    if width > 1:
+        image = image[:, :width // 2 * 2]
+        image = (image[:, 0::2] + image[:, 1::2]) * 0.5
+    return image
+
+
+def encode_mipmaps(rgba, fmt, mipmap_count=None):
+    """
+    Generate the mipmaps of <rgba> and block compress them. Return a tuple
+    (mipmap_count, data) where data contains all the mipmaps one after the other
+    """
+    mipmaps = generate_mipmaps(rgba, mipmap_count)
+    return len(mipmaps), b''.join(encode_dxt(mipmap, fmt) for mipmap in mipmaps)
+
+
+def encode_dxt(rgba, fmt):
+    """
+    Block compress the RGBA uint8 array <rgba> with shape (height, width, 4)
+    and return the bytes. DXT1 is encoded without alpha.
+    """
+    _require_numpy()
+    if fmt not in (b'DXT1', b'DXT3', b'DXT5'):
+        raise RuntimeError('Unsupported format to encode: {}'.format(fmt))
+    blocks = _get_blocks(rgba)
+    color_blocks = _encode_color_blocks(blocks[:, :, :3])
+    if fmt == b'DXT1':
+        encoded = color_blocks
+    elif fmt == b'DXT3':
+        encoded = np.concatenate((_encode_explicit_alpha_blocks(blocks[:, :, 3]), color_blocks), axis=1)
+    else:
+        encoded = np.concatenate((_encode_interpolated_alpha_blocks(blocks[:, :, 3]), color_blocks), axis=1)
+    return encoded.tobytes()
+
+
+def _get_blocks(rgba):
+    """Return an array (block_count, 16, 4), padding the image by repeating the last row/column"""
+    height, width = rgba.shape[:2]
+    blocks_x = (width + 3) // 4
+    blocks_y = (height + 3) // 4
+    padded = np.pad(rgba, ((0, blocks_y * 4 - height), (0, blocks_x * 4 - width), (0, 0)), mode='edge')
+    blocks = padded.reshape(blocks_y, 4, blocks_x, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(-1, 16, 4)
+
+
+def rgb888_to_rgb565(colors):
+    colors = colors.astype(np.uint16)
+    return (((colors[..., 0] * 31 + 127) // 255) << 11 |
+            ((colors[..., 1] * 63 + 127) // 255) << 5 |
+            ((colors[..., 2] * 31 + 127) // 255))
+
+
+def _encode_color_blocks(colors):
+    """
+    Return an array (block_count, 8) from an array of colors (block_count, 16, 3).
+    Endpoints are the extremes of the colors projected on their principal axis.
+    """
+    block_count = colors.shape[0]
+    colors_f = colors.astype(np.float32)
+    mean = colors_f.mean(axis=1, keepdims=True)
+    centered = colors_f - mean
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    axis = np.ones((block_count, 3), dtype=np.float32)
+    for _ in range(8):  # power iteration
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        norm = np.linalg.norm(axis, axis=1, keepdims=True)
+        axis = np.where(norm > 0, axis / np.maximum(norm, 1e-12), 1.0)
+    projection = np.einsum('nki,ni->nk', centered, axis)
+    mean = mean[:, 0]
+    max_colors = mean + projection.max(axis=1)[:, None] * axis
+    min_colors = mean + projection.min(axis=1)[:, None] * axis
+    max_colors = np.clip(np.rint(max_colors), 0, 255)
+    min_colors = np.clip(np.rint(min_colors), 0, 255)
+
+    c0 = rgb888_to_rgb565(max_colors)
+    c1 = rgb888_to_rgb565(min_colors)
+    # c0 > c1 means four colors mode
+    c0, c1 = np.maximum(c0, c1), np.minimum(c0, c1)
+
+    rgb0 = rgb565_to_rgb888(c0).astype(np.int32)
+    rgb1 = rgb565_to_rgb888(c1).astype(np.int32)
+    palette = np.stack((rgb0, rgb1, (2 * rgb0 + rgb1) // 3, (rgb0 + 2 * rgb1) // 3), axis=1)
+    distances = ((colors[:, :, None, :].astype(np.int32) - palette[:, None, :, :]) ** 2).sum(axis=3)
+    indices = distances.argmin(axis=2).astype(np.uint32)
+    indices[c0 == c1] = 0
+    packed_indices = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+
+    encoded = np.empty((block_count, 8), dtype=np.uint8)
+    encoded[:, 0:2] = c0.astype('<u2').view(np.uint8).reshape(block_count, 2)
+    encoded[:, 2:4] = c1.astype('<u2').view(np.uint8).reshape(block_count, 2)
+    encoded[:, 4:8] = packed_indices.astype('<u4').view(np.uint8).reshape(block_count, 4)
+    return encoded
+
+
+def _encode_explicit_alpha_blocks(alpha):
+    """DXT3: Return an array (block_count, 8) from an array of alpha values (block_count, 16)"""
+    values = ((alpha.astype(np.uint64) * 15 + 127) // 255)
+    packed = (values << (4 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    return packed.astype('<u8').view(np.uint8).reshape(-1, 8)
+
+
+def _encode_interpolated_alpha_blocks(alpha):
+    """DXT5: Return an array (block_count, 8) from an array of alpha values (block_count, 16)"""
+    block_count = alpha.shape[0]
+    # a0 > a1 means 8 values mode
+    a0 = alpha.max(axis=1).astype(np.int32)
+    a1 = alpha.min(axis=1).astype(np.int32)
+    weights = np.arange(1, 7, dtype=np.int32)
+    palette = np.empty((block_count, 8), dtype=np.int32)
+    palette[:, 0] = a0
+    palette[:, 1] = a1
+    palette[:, 2:8] = ((7 - weights) * a0[:, None] + weights * a1[:, None]) // 7
+    distances = np.abs(alpha[:, :, None].astype(np.int32) - palette[:, None, :])
+    indices = distances.argmin(axis=2).astype(np.uint64)
+    packed = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+
+    encoded = np.empty((block_count, 8), dtype=np.uint8)
+    encoded[:, 0] = a0
+    encoded[:, 1] = a1
+    encoded[:, 2:8] = packed.astype('<u8').view(np.uint8).reshape(block_count, 8)[:, :6]
+    return encoded
@@ -1,4 +1,6 @@
+from array import array
 from collections import deque, namedtuple
+import hashlib
 import os
 
 
@@ -50,9 +52,10 @@ def strip_triangles_to_triangles_list(strip_indices_array):
     return indices
 
 
-def triangles_list_to_triangles_strip(blender_mesh):
+def triangles_list_to_triangles_strip(mesh):
     """
-    Export triangle strips from a blender mesh.
+    Export triangle strips from <mesh>, anything with `polygons` that have an `index`,
+    `vertices` and `edge_keys`, like a blender mesh or a MeshPart of one.
     It assumes the mesh is all triangulated.
     Based on a paper by Pierre Terdiman: http://www.codercorner.com/Strips.htm
     """
@@ -61,17 +64,17 @@ def triangles_list_to_triangles_strip(blender_mesh):
     current_strip = []
     strips = []
     joined_strips = []
-    faces_indices = deque(p.index for p in blender_mesh.polygons)
+    faces_indices = deque(p.index for p in mesh.polygons)
     done_faces_indices = set()
     current_face_index = faces_indices.popleft()
     process_faces = True
 
-    for polygon in blender_mesh.polygons:
+    for polygon in mesh.polygons:
         for edge in polygon.edge_keys:
             edges_faces.setdefault(edge, set()).add(polygon.index)
 
     while process_faces:
-        current_face = blender_mesh.polygons[current_face_index]
+        current_face = mesh.polygons[current_face_index]
         current_face_verts = current_face.vertices[:]
         strip_indices = [v for v in current_face_verts if v not in current_strip[-2:]]
         if current_strip:
@@ -216,3 +219,64 @@ def get_uvs_per_vertex(blender_mesh_object):
             uvs = uvs_per_loop[i].uv
             vertices[vertex_index] = (uvs[0], uvs[1])
     return vertices
+
+
+def get_mesh_objects_fingerprint(blender_objects, parent=None):
+    """
+    Return a hash of what exporting reads from the mesh objects in <blender_objects>:
+    geometry, uvs, vertex groups, the armature, materials and their textures' file paths,
+    and the bounding box of <parent>, if given, which exports use for the whole model.
+    Arrays are read with bulk `foreach_get` calls. Objects are hashed sorted by name, so
+    the order in which they're given doesn't change the result.
+    """
+    sha1 = hashlib.sha1()
+    if parent is not None:
+        _hash_values(sha1, [tuple(corner) for corner in parent.bound_box])
+    mesh_objects = sorted((ob for ob in blender_objects if ob.type == 'MESH'), key=lambda ob: ob.name)
+    for ob in mesh_objects:
+        mesh = ob.data
+        _hash_values(sha1, ob.name, len(mesh.vertices), len(mesh.loops), len(mesh.polygons))
+        _hash_collection(sha1, mesh.vertices, 'co', 'f', 3)
+        _hash_collection(sha1, mesh.loops, 'vertex_index', 'i')
+        _hash_collection(sha1, mesh.polygons, 'loop_start', 'i')
+        _hash_collection(sha1, mesh.polygons, 'loop_total', 'i')
+        if mesh.has_custom_normals:
+            mesh.calc_normals_split()
+            _hash_collection(sha1, mesh.loops, 'normal', 'f', 3)
+        if mesh.uv_layers:
+            _hash_collection(sha1, mesh.uv_layers[0].data, 'uv', 'f', 2)
+
+        modifiers = {m.type: m for m in ob.modifiers}
+        armature = modifiers['ARMATURE'].object if 'ARMATURE' in modifiers else None
+        _hash_values(sha1, [vg.name for vg in ob.vertex_groups],
+                     [b.name for b in armature.data.bones] if armature else None)
+        groups = array('i')
+        weights = array('f')
+        for vertex in mesh.vertices:
+            for group in vertex.groups:
+                groups.extend((vertex.index, group.group))
+                weights.append(group.weight)
+        sha1.update(groups.tobytes())
+        sha1.update(weights.tobytes())
+
+        material = mesh.materials[0] if mesh.materials else None
+        if material:
+            _hash_values(sha1, material.name, material.use_cast_shadows)
+            for slot in material.texture_slots:
+                if not slot or not slot.texture:
+                    continue
+                image = slot.texture.image
+                _hash_values(sha1, slot.texture.name, image.filepath if image is not None else None,
+                             slot.use_map_color_diffuse, slot.use_map_normal, slot.use_map_specular,
+                             slot.texture_coords, slot.mapping)
+    return sha1.hexdigest()
+
+
+def _hash_values(sha1, *values):
+    sha1.update(repr(values).encode('utf-8'))
+
+
+def _hash_collection(sha1, collection, attribute, typecode, size=1):
+    values = array(typecode, [0]) * (len(collection) * size)
+    collection.foreach_get(attribute, values)
+    sha1.update(values.tobytes())
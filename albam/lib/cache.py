@@ -0,0 +1,159 @@
+from contextlib import contextmanager
+import hashlib
+import os
+import tempfile
+import time
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.albam', 'cache')
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3  # 2 GiB
+HASH_CHUNK_SIZE = 1024 * 1024
+# When the cache goes over its max size, it's trimmed down to this fraction of it, so
+# the next writes don't have to evict (and walk the whole cache) again right away
+EVICTION_LOW_WATER = 0.9
+
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """Return the sha1 hexdigest of the contents of <file_path>, read in chunks"""
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def hash_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_file_stamp(file_path):
+    """
+    Return a string with the size and modification time of <file_path>, which changes
+    when the file is modified, or None if it doesn't exist
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return '{}:{}'.format(st.st_size, st.st_mtime_ns)
+
+
+class FileCache:
+    """
+    A directory of files addressed by a key (usually a content hash), shared
+    between sessions. When the total size goes over <max_size>, the least recently
+    used files are removed until it's back under <low_water> times <max_size>. The
+    total size is computed once and then kept up to date on writes. Usage is tracked by the access time of each file, which
+    is refreshed on every hit. The modification time is left as when the file was
+    written, so it still tells whether someone modified it.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE, extension='', low_water=EVICTION_LOW_WATER):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.low_water = low_water
+        self.extension = extension
+        self._size = None  # computed lazily, then kept up to date on writes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path_for(self, key):
+        """
+        Keys can have the form '<hash>/<name>' to keep a meaningful file name
+        (e.g. the original name of a texture) for the cached file.
+        """
+        # An extra level of directories to avoid huge folders
+        return os.path.join(self.cache_dir, key[:2], *key.split('/')) + self.extension
+
+    def get(self, key):
+        """Return the path of the cached file for <key>, or None if it's not cached"""
+        path = self.path_for(key)
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, data):
+        with self.writer(key) as w:
+            w.write(data)
+        return self.path_for(key)
+
+    @contextmanager
+    def writer(self, key):
+        """
+        Context manager that yields a file object to write the contents for <key>.
+        The file is written to a temporary path and moved in place only if no
+        exception was raised, so readers never see partial files.
+        The entry just written is never evicted, so `path_for(key)` can be opened right
+        after. Entries bigger than the whole cache are kept until the next write.
+        """
+        path = self.path_for(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as w:
+                yield w
+            previous_size = os.path.getsize(path) if os.path.isfile(path) else 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        size = os.path.getsize(path)
+        if self._size is not None:
+            self._size += size - previous_size
+        if size > self.max_size:
+            print('Cache entry {} ({} bytes) is bigger than the cache ({} bytes), it will be removed '
+                  'on the next write'.format(key, size, self.max_size))
+        if self.size() > self.max_size:
+            self.evict(int(self.max_size * self.low_water), keep=path)
+
+    def size(self):
+        if self._size is None:
+            self._size = sum(size for _, _, size in self._entries())
+        return self._size
+
+    def evict(self, max_size=None, keep=None):
+        """
+        Remove the least recently used files until the cache fits in <max_size>, or as
+        close as possible without removing the file at path <keep>
+        """
+        max_size = self.max_size if max_size is None else max_size
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= max_size:
+                break
+            if keep and os.path.abspath(path) == os.path.abspath(keep):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._remove_empty_dirs(os.path.dirname(path))
+        self._size = total
+
+    def _remove_empty_dirs(self, directory):
+        root = os.path.abspath(self.cache_dir)
+        directory = os.path.abspath(directory)
+        while directory != root and directory.startswith(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break  # not empty
+            directory = os.path.dirname(directory)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_atime, st.st_size
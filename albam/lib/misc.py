@@ -1,8 +1,12 @@
+import io
 import ntpath
 import os
 import posixpath
 
 
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
 def chunks(l, n):
     return [l[i:i + n] for i in range(0, len(l), n)]
 
@@ -36,3 +40,69 @@ def find_files(root_dir, extension=None):
     """
     return [os.path.join(root, f) for root, _, files in os.walk(root_dir)
             for f in files if not extension or (extension and f.endswith(extension))]
+
+
+def get_file_size(f):
+    """Return the size of the seekable file object <f>, keeping its position"""
+    position = f.tell()
+    size = f.seek(0, os.SEEK_END)
+    f.seek(position)
+    return size
+
+
+def copy_file_range(src, dst, offset, count, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Copy <count> bytes starting at <offset> of the binary file object <src> to the
+    current position of the binary file object <dst>.
+    When both are real files the kernel does the copy (os.copy_file_range or os.sendfile),
+    otherwise the bytes go through a single reusable buffer.
+    Return the number of bytes copied.
+    """
+    dst.flush()
+    start = dst.tell()
+    copied = 0
+    try:
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        src_fd = dst_fd = None
+
+    if src_fd is not None:
+        copied = _kernel_copy(src_fd, dst_fd, offset, count)
+        dst.seek(start + copied)
+
+    if copied < count:
+        src.seek(offset + copied)
+        buff = memoryview(bytearray(min(chunk_size, count - copied)))
+        while copied < count:
+            n = src.readinto(buff[:min(len(buff), count - copied)])
+            if not n:
+                break
+            dst.write(buff[:n])
+            copied += n
+    return copied
+
+
+def _kernel_copy(src_fd, dst_fd, offset, count):
+    copied = 0
+    for func in (_copy_file_range, _sendfile):
+        try:
+            while copied < count:
+                n = func(src_fd, dst_fd, offset + copied, count - copied)
+                if not n:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            # Not available in this platform/python version, or not supported
+            # for this pair of files. Try the next method from where it stopped.
+            continue
+        break
+    return copied
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset_src=offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
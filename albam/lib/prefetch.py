@@ -0,0 +1,128 @@
+"""
+Run the CPU bound part of imports (parsing, decoding, converting textures) in worker
+processes ahead of time, so several files are processed at once while Blender's main
+thread only creates data blocks.
+
+Engines register a prefetch function per file type, like import functions:
+
+    @albam_registry.register_function('prefetch', identifier=b'MOD\x00')
+    def prefetch_mod(file_path, **kwargs):
+        ...
+
+It's called in a worker process with the same options as the import function, and must
+return something picklable. The import function receives it as the `prefetched` keyword
+argument. Results with a `release` method (e.g. to free shared memory) get it called
+when the pool is closed, whether they were used or not. Results with a `track` method
+get it called as soon as they are received, e.g. to register that shared memory with
+this process, so it's freed even if the pool is never closed.
+
+Workers are always spawned, never forked: forking Blender would copy its GL and bpy
+state and the threads of the embedded interpreter into every worker.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import sys
+
+from albam.lib.profiling import span, count
+
+
+def get_mp_context():
+    """
+    Return the multiprocessing context for worker processes. Inside Blender they run
+    its bundled Python, since `sys.executable` is the Blender binary in older versions.
+    """
+    context = multiprocessing.get_context('spawn')
+    python = _get_blender_python()
+    if python:
+        context.set_executable(python)
+    return context
+
+
+def _get_blender_python():
+    try:
+        import bpy
+    except ImportError:
+        return None
+    # Removed in Blender 2.91, where sys.executable is already the bundled Python
+    return getattr(bpy.app, 'binary_path_python', None) or sys.executable
+
+
+class PrefetchPool:
+
+    def __init__(self, prefetch_registry, max_workers=None, enabled=True):
+        self.prefetch_registry = prefetch_registry
+        self._futures = {}
+        self._executor = None
+        if enabled:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_mp_context())
+            except (OSError, NotImplementedError, ValueError) as err:
+                # e.g. platforms without working semaphores. Imports work the same, serially
+                print('Prefetching disabled: {}'.format(err))
+
+    def submit(self, file_path, identifier, **kwargs):
+        """Start prefetching <file_path> if there's a prefetch function for <identifier>"""
+        func = self.prefetch_registry.get(identifier)
+        if not func or not self._executor or file_path in self._futures:
+            return
+        try:
+            future = self._executor.submit(func, file_path, **kwargs)
+        except BrokenProcessPool as err:
+            # The workers couldn't start, e.g. a broken Python install. Imported serially
+            print('Error prefetching {}: {}'.format(file_path, err))
+            return
+        future.add_done_callback(_track_result)
+        self._futures[file_path] = future
+
+    def is_ready(self, file_path):
+        """Return True if `get` won't block for <file_path>"""
+        future = self._futures.get(file_path)
+        return future is None or future.done()
+
+    def get(self, file_path):
+        """
+        Return the prefetched result of <file_path>, waiting for it if needed, or None if
+        it wasn't submitted or failed, in which case the import does all the work instead
+        """
+        future = self._futures.get(file_path)
+        if future is None:
+            return None
+        with span('wait_prefetch'):
+            try:
+                result = future.result()
+            except Exception as err:
+                # TODO: logging
+                print('Error prefetching {}: {}'.format(file_path, err))
+                return None
+        count('files_prefetched')
+        return result
+
+    def close(self):
+        if not self._executor:
+            return
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        for future in self._futures.values():
+            if future.cancelled() or future.exception() is not None:
+                continue
+            release = getattr(future.result(), 'release', None)
+            if release:
+                release()
+        self._futures = {}
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _track_result(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    track = getattr(future.result(), 'track', None)
+    if track:
+        track()
@@ -0,0 +1,209 @@
+"""
+Lightweight instrumentation for the import/export pipelines: nested timing spans,
+counters and optional memory peaks, written as a json report per import or export.
+
+It's disabled by default, and enabled by setting the environment variable ALBAM_PROFILE
+to 1 (timings and counters) or to "memory" (also memory peaks per span, which is slower).
+When disabled, `span` and `count` do nothing, so they can stay in hot code.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import json
+import os
+import time
+import tracemalloc
+
+
+PROFILE_ENV_VAR = 'ALBAM_PROFILE'
+REPORTS_DIR = os.path.join(os.path.expanduser('~'), '.albam', 'reports')
+# tracemalloc.reset_peak was added in python 3.9. Before that only the
+# overall peak of the whole report is available
+_CAN_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+_active_profiler = None
+
+
+def get_profile_mode():
+    """Return None if profiling is disabled, 'time' or 'memory' otherwise"""
+    value = os.environ.get(PROFILE_ENV_VAR, '').strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'):
+        return None
+    return 'memory' if value == 'memory' else 'time'
+
+
+class Span:
+    __slots__ = ('name', 'duration', 'children', 'peak_memory', '_start', '_child_peak')
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = None
+        self.children = []
+        self.peak_memory = None
+        self._start = time.perf_counter()
+        self._child_peak = 0
+
+    def to_dict(self):
+        d = {'name': self.name, 'duration': self.duration}
+        if self.peak_memory is not None:
+            d['peak_memory'] = self.peak_memory
+        if self.children:
+            d['children'] = [c.to_dict() for c in self.children]
+        return d
+
+
+class Profiler:
+
+    def __init__(self, name, trace_memory=False, **metadata):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.metadata = metadata
+        self.counters = {}
+        self.error = None
+        self._started_tracing = False
+        self.root = Span(name)
+        self._stack = [self.root]
+
+    @contextmanager
+    def span(self, name):
+        parent = self._stack[-1]
+        span = Span(name)
+        parent.children.append(span)
+        self._stack.append(span)
+        if self.trace_memory and _CAN_RESET_PEAK:
+            tracemalloc.reset_peak()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - span._start
+            self._stack.pop()
+            if self.trace_memory:
+                self._end_span_memory(span, parent)
+
+    def _end_span_memory(self, span, parent):
+        peak = tracemalloc.get_traced_memory()[1]
+        if _CAN_RESET_PEAK:
+            # The peak was reset when the span (and each of its children) started,
+            # so the peak of the span is the max of its own and its children's
+            span.peak_memory = max(peak, span._child_peak)
+            parent._child_peak = max(parent._child_peak, span.peak_memory)
+            tracemalloc.reset_peak()
+        else:
+            span.peak_memory = peak
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        self.root.duration = time.perf_counter() - self.root._start
+        if self.trace_memory and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            self.root.peak_memory = max(peak, self.root._child_peak)
+            if self._started_tracing:
+                # Otherwise it was started by the caller, who expects it to keep going
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def to_dict(self):
+        return {'name': self.name,
+                'metadata': self.metadata,
+                'counters': self.counters,
+                'error': self.error,
+                'spans': self.root.to_dict(),
+                }
+
+    def write_report(self, reports_dir=REPORTS_DIR):
+        if not os.path.isdir(reports_dir):
+            os.makedirs(reports_dir)
+        file_name = '{}_{}_{}.json'.format(time.strftime('%Y%m%d-%H%M%S'), self.name, os.getpid())
+        report_path = os.path.join(reports_dir, file_name)
+        with open(report_path, 'w') as w:
+            json.dump(self.to_dict(), w, indent=2)
+        return report_path
+
+
+@contextmanager
+def profile(name, enabled=None, trace_memory=None, reports_dir=REPORTS_DIR, activate=True, **metadata):
+    """
+    Profile the block and write a report to <reports_dir> when it finishes, even if it fails.
+    <enabled> and <trace_memory> default to the environment variable. If a profile is
+    already running (e.g. an arc importing its mods), this is just a span of it.
+    Yields the Profiler, or None if disabled.
+    With <activate> False, `span` and `count` only record into it inside `activated`
+    blocks, e.g. for work that gives control back to Blender in between steps.
+    """
+    global _active_profiler
+    if activate and _active_profiler is not None:
+        with _active_profiler.span(name):
+            yield _active_profiler
+        return
+
+    mode = get_profile_mode()
+    if enabled is None:
+        enabled = bool(mode)
+    if not enabled:
+        yield None
+        return
+    if trace_memory is None:
+        trace_memory = mode == 'memory'
+
+    profiler = Profiler(name, trace_memory, **metadata)
+    if activate:
+        _active_profiler = profiler
+    profiler.start()
+    try:
+        yield profiler
+    except Exception as err:
+        profiler.error = repr(err)
+        raise
+    finally:
+        if activate:
+            _active_profiler = None
+        profiler.stop()
+        report_path = profiler.write_report(reports_dir)
+        print('Albam profiling report written to {}'.format(report_path))
+
+
+@contextmanager
+def activated(profiler):
+    """Record `span` and `count` into <profiler> (can be None) for the block"""
+    global _active_profiler
+    previous = _active_profiler
+    _active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active_profiler = previous
+
+
+@contextmanager
+def span(name):
+    if _active_profiler is None:
+        yield None
+        return
+    with _active_profiler.span(name) as s:
+        yield s
+
+
+def count(name, value=1):
+    if _active_profiler is not None:
+        _active_profiler.count(name, value)
+
+
+def profiled(name=None):
+    """Decorator to run a function inside a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active_profiler is None:
+                return func(*args, **kwargs)
+            with _active_profiler.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,72 @@
+"""
+Imported files are not embedded in the .blend file: only a reference (path, archive and
+content hash) is saved, and the bytes are loaded again when exporting.
+Files inside archives are small and copied to a cache, so exporting doesn't need to read
+the archive again. Files imported from disk (e.g. whole arcs) are only referenced by
+their path and stamp (see `get_file_stamp`), and copied to the cache by the exports that
+overwrite them, so exporting again still works.
+"""
+import os
+
+from albam.lib.cache import FileCache, DEFAULT_CACHE_DIR, get_file_stamp, hash_bytes
+
+
+SOURCES_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'sources')
+_sources_cache = None
+
+
+def get_sources_cache():
+    global _sources_cache
+    if _sources_cache is None:
+        _sources_cache = FileCache(SOURCES_CACHE_DIR)
+    return _sources_cache
+
+
+def read_magic(file_path, size=4):
+    """Return the first <size> bytes of <file_path>, which identify its format"""
+    with open(file_path, 'rb') as f:
+        return f.read(size)
+
+
+def store_source(content_hash, data, cache=None):
+    cache = cache or get_sources_cache()
+    if not cache.get(content_hash):
+        cache.put(content_hash, data)
+
+
+def load_source(source_path, content_hash, archive_path=None, embedded=None, cache=None, exported_hash=None,
+                source_stamp=None):
+    """
+    Return the bytes of an imported file. <embedded> is used if given, then the cache,
+    then <source_path> is read again, from inside <archive_path> if given.
+    Files read again must have the <source_stamp> of the file when it was imported (only
+    for files imported from disk), or the <content_hash>. If <source_path> was overwritten by the last export, with
+    <exported_hash>, those bytes are returned instead of the original ones.
+    Raise RuntimeError if the file can't be found or changed since it was imported.
+    """
+    if embedded:
+        return bytes(embedded)
+    cache = cache or get_sources_cache()
+    cached_path = cache.get(content_hash) if content_hash else None
+    if cached_path:
+        with open(cached_path, 'rb') as f:
+            return f.read()
+
+    try:
+        if archive_path:
+            # Only arc files have entries so far
+            from albam.engines.mtframework.vfs import ArcFileSystem
+            data = ArcFileSystem([archive_path]).read(source_path)
+        else:
+            with open(source_path, 'rb') as f:
+                data = f.read()
+    except (OSError, TypeError) as err:
+        raise RuntimeError("Can't read {}, the file imported: {}. Import it again, or enable "
+                           "'Embed source files' when importing".format(source_path, err))
+    if source_stamp and get_file_stamp(source_path) == source_stamp:
+        return data
+    known_hashes = {h for h in (content_hash, exported_hash) if h}
+    if (content_hash or source_stamp) and hash_bytes(data) not in known_hashes:
+        raise RuntimeError('{} changed since it was imported. Import it again, or enable '
+                           "'Embed source files' when importing".format(source_path))
+    return data
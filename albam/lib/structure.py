@@ -5,6 +5,12 @@ import os
 
 
 class DynamicStructure:
+    """
+    <file_path> can be a path, a file object, or any object supporting the buffer protocol
+    (bytes, bytearray, memoryview, mmap...). Writable buffers are used in place with no copies,
+    so changes to the instance change the buffer and the other way around; read-only
+    ones are copied once.
+    """
 
     _fields_ = None
 
@@ -19,7 +25,13 @@ class DynamicStructure:
         except TypeError:
             raise RuntimeError('Error generating class. Fields: {}'.format(cls_dict['_fields_']))
 
-        if file_path:
+        buffer = get_buffer(file_path)
+        if buffer is not None:
+            if buffer.readonly:
+                instance = generated_cls.from_buffer_copy(buffer)
+            else:
+                instance = generated_cls.from_buffer(buffer)
+        elif file_path:
             instance = generated_cls()
             instance._file_path = file_path  # TODO: move to 'meta' attribute.
             try:
@@ -34,15 +46,45 @@ class DynamicStructure:
         return instance
 
 
-def parse_fields(sequence_of_tuples, file_path_or_buffer=None, **kwargs):
-    ready_fields = []
+def get_buffer(source):
+    """Return a memoryview of bytes of <source> if it supports the buffer protocol, else None"""
+    if source is None or isinstance(source, str):
+        return None
+    try:
+        view = memoryview(source)
+    except TypeError:
+        return None
+    return view.cast('B') if view.format != 'B' or view.ndim != 1 else view
+
+
+def get_source_size(file_path_or_buffer):
+    """Return the size in bytes of what a DynamicStructure is being read from"""
+    buffer = get_buffer(file_path_or_buffer)
+    if buffer is not None:
+        return buffer.nbytes
     try:
-        os.path.isfile(file_path_or_buffer)
-        is_file = True
-        buff = open(file_path_or_buffer, 'rb')
+        return os.path.getsize(file_path_or_buffer)
     except TypeError:
-        buff = file_path_or_buffer
-        is_file = False
+        f = file_path_or_buffer
+        position = f.tell()
+        size = f.seek(0, os.SEEK_END)
+        f.seek(position)
+        return size
+
+
+def parse_fields(sequence_of_tuples, file_path_or_buffer=None, **kwargs):
+    ready_fields = []
+    buffer = get_buffer(file_path_or_buffer)
+    is_file = False
+    if buffer is not None:
+        buff = None
+    else:
+        try:
+            os.path.isfile(file_path_or_buffer)
+            is_file = True
+            buff = open(file_path_or_buffer, 'rb')
+        except TypeError:
+            buff = file_path_or_buffer
 
     for t in sequence_of_tuples:
         attr_name = t[0]
@@ -54,7 +96,9 @@ def parse_fields(sequence_of_tuples, file_path_or_buffer=None, **kwargs):
             class TmpStruct(ctypes.Structure):
                 _fields_ = ready_fields
                 _pack_ = 1
-            if buff:
+            if buffer is not None:
+                tmp_struct = TmpStruct.from_buffer_copy(buffer[:ctypes.sizeof(TmpStruct)])
+            elif buff:
                 tmp_struct = TmpStruct()
                 buff.readinto(tmp_struct)
                 buff.seek(0)
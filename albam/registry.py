@@ -1,31 +1,93 @@
+import importlib
+
 try:
     import bpy
 except ImportError:
     bpy = None
 
+from albam.engines import LAZY_REGISTRATIONS
+
+
+class FunctionRegistry:
+    """
+    Functions by identifier (the id magic of a file type). Identifiers can also be
+    registered with just the name of the module that registers their function, which
+    is imported the first time the function is needed.
+    """
+
+    def __init__(self):
+        self._functions = {}
+        self._modules = {}
+
+    def register(self, identifier, f):
+        self._functions[identifier] = f
+
+    def register_lazy(self, identifier, module_name):
+        self._modules[identifier] = module_name
+
+    def get(self, identifier, default=None):
+        if identifier not in self._functions and identifier in self._modules:
+            module_name = self._modules[identifier]
+            importlib.import_module(module_name)
+            if identifier not in self._functions:
+                raise RuntimeError('{} was expected to register a function for {}'.format(
+                    module_name, identifier))
+        return self._functions.get(identifier, default)
+
+    def __getitem__(self, identifier):
+        f = self.get(identifier)
+        if f is None:
+            raise KeyError(identifier)
+        return f
+
+    def __contains__(self, identifier):
+        """Doesn't import anything, so it's cheap to check if a file type is supported"""
+        return identifier in self._functions or identifier in self._modules
+
+    def identifiers(self):
+        return set(self._functions) | set(self._modules)
+
 
 class AlbamRegistry:
 
     def __init__(self):
-        self.import_registry = {}
-        self.export_registry = {}
+        self.import_registry = FunctionRegistry()
+        self.export_registry = FunctionRegistry()
+        self.prefetch_registry = FunctionRegistry()
+        self.import_steps_registry = FunctionRegistry()
+        self._function_registries = {'import': self.import_registry,
+                                     'export': self.export_registry,
+                                     'prefetch': self.prefetch_registry,
+                                     'import_steps': self.import_steps_registry,
+                                     }
 
         self._blender_panels = set()
         self._blender_operators = set()
         self._blender_props = {}  # (bpy.type, custom_name, bpy_prop): cls
         self._blender_prop_groups = {}  # XXX hackish. class_name: class
 
+    def _get_function_registry(self, func_type):
+        try:
+            return self._function_registries[func_type]
+        except KeyError:
+            raise TypeError('func_type {} not valid.'.format(func_type))
+
     def register_function(self, func_type, identifier):
+        function_registry = self._get_function_registry(func_type)
+
         def decorator(f):
-            if func_type == 'import':
-                self.import_registry[identifier] = f
-            elif func_type == 'export':
-                self.export_registry[identifier] = f
-            else:
-                raise TypeError('func_type {} not valid.'.format(func_type))
+            function_registry.register(identifier, f)
             return f
         return decorator
 
+    def register_lazy_functions(self, registrations):
+        """
+        <registrations> is an iterable of tuples (func_type, identifier, module name),
+        like `albam.engines.LAZY_REGISTRATIONS`
+        """
+        for func_type, identifier, module_name in registrations:
+            self._get_function_registry(func_type).register_lazy(identifier, module_name)
+
     def blender_panel(self):
         def decorator(cls):
             self._blender_panels.add(cls)
@@ -59,8 +121,6 @@ class AlbamRegistry:
             do_register(cls)
 
         for (bpy_type, bpy_type_name, bpy_prop), data_cls in self._blender_props.items():
-            print(bpy_type, bpy_type_name, bpy_prop, data_cls, data_cls.kwargs)
-            print('    ')
             # XXX ultra hack
             if bpy_prop.__name__ in ('PointerProperty', 'CollectionProperty'):
                 cls_name = data_cls.kwargs['type']  # XXX yes, it's a string of the name of the class.
@@ -87,3 +147,4 @@ def unregister():
     albam_registry.blender_init('unregister')
 
 albam_registry = AlbamRegistry()
+albam_registry.register_lazy_functions(LAZY_REGISTRATIONS)
@@ -1,10 +1,46 @@
+from contextlib import ExitStack
+import ntpath
 import os
+import time
 
 import bpy
 
+from albam.lib.cache import get_file_stamp, hash_bytes
+from albam.lib.prefetch import PrefetchPool
+from albam.lib.profiling import activated, profile
+from albam.lib.sources import read_magic, store_source, load_source
 from albam.registry import albam_registry
 
 
+# Seconds of work per timer event in modal imports. Lower is more responsive, but slower
+MODAL_TIME_SLICE = 0.05
+MODAL_TIMER_STEP = 0.01
+# Collections of bpy.data where imports create data blocks, in order of removal
+ROLLBACK_COLLECTIONS = ('objects', 'meshes', 'armatures', 'materials', 'textures', 'images')
+
+
+def get_data_snapshot():
+    return {name: set(getattr(bpy.data, name)) for name in ROLLBACK_COLLECTIONS}
+
+
+def get_new_data(snapshot):
+    """Return a dict of collection name: data blocks created after <snapshot> was taken"""
+    return {name: [d for d in getattr(bpy.data, name) if d not in snapshot[name]]
+            for name in ROLLBACK_COLLECTIONS}
+
+
+def remove_data(datablocks):
+    """Remove the data blocks in <datablocks>, a dict of collection name: data blocks"""
+    for name in ROLLBACK_COLLECTIONS:
+        collection = getattr(bpy.data, name)
+        for datablock in datablocks.get(name, ()):
+            try:
+                collection.remove(datablock)
+            except ReferenceError:
+                # Removed already, e.g. by the user in between steps
+                pass
+
+
 @albam_registry.blender_operator()
 class AlbamImportOperator(bpy.types.Operator):
     bl_idname = "albam_import.item"
@@ -13,6 +49,28 @@ class AlbamImportOperator(bpy.types.Operator):
     directory : bpy.props.StringProperty(subtype='DIR_PATH')
     files : bpy.props.CollectionProperty(name='adf', type=bpy.types.OperatorFileListElement)
     unpack_dir : bpy.props.StringProperty(options={'HIDDEN'})
+    texture_max_size : bpy.props.IntProperty(name='Max texture size', default=0, min=0,
+                                             description='Load smaller mipmaps of textures bigger '
+                                                         'than this size (0: full resolution)')
+    arc_index_path : bpy.props.StringProperty(name='Arc index', subtype='FILE_PATH',
+                                              description='Index created with "albam index", used to find '
+                                                          'textures in other arc files')
+    verify_arc : bpy.props.BoolProperty(name='Verify arc files', default=False,
+                                        description='Decompress all the files in arcs to check them before '
+                                                    'importing. Slower, only the file list is checked otherwise')
+    embed_source : bpy.props.BoolProperty(name='Embed source files', default=False,
+                                          description='Save the imported files inside the .blend file, '
+                                                      'so exporting works even if they are moved. '
+                                                      'Makes .blend files much bigger')
+    prefetch : bpy.props.BoolProperty(name='Decode in background', default=True,
+                                      description='Decode files and convert textures in other processes '
+                                                  'ahead of time, so several files are processed at once')
+    modal_import : bpy.props.BoolProperty(name='Keep Blender responsive', default=True,
+                                          description='Import in small steps showing the progress. '
+                                                      'Press ESC to cancel and remove what was imported')
+    profile : bpy.props.BoolProperty(name='Write profiling report', default=False,
+                                     description='Write a json report with timings to ~/.albam/reports. '
+                                                 'Also enabled by the ALBAM_PROFILE environment variable')
 
     def invoke(self, context, event):  # pragma: no cover
         wm = context.window_manager
@@ -21,37 +79,182 @@ class AlbamImportOperator(bpy.types.Operator):
 
     def execute(self, context):
         to_import = [os.path.join(self.directory, f.name) for f in self.files]
-        for file_path in to_import:
-            self._import_file(file_path=file_path, context=context)
+        if self.modal_import and context.window:
+            return self._start_modal(context, to_import)
+        with PrefetchPool(albam_registry.prefetch_registry, enabled=self.prefetch) as pool:
+            # All the files start decoding at once, while they are imported one by one
+            for file_path in to_import:
+                pool.submit(file_path, read_magic(file_path), **self._get_import_options())
+            for file_path in to_import:
+                with profile('import', enabled=self.profile or None, file_path=file_path):
+                    self._import_file(file_path=file_path, context=context, prefetched=pool.get(file_path))
         return {'FINISHED'}
 
+    def _start_modal(self, context, to_import):
+        self._stack = ExitStack()
+        self._pool = self._stack.enter_context(PrefetchPool(albam_registry.prefetch_registry,
+                                                            enabled=self.prefetch))
+        for file_path in to_import:
+            self._pool.submit(file_path, read_magic(file_path), **self._get_import_options())
+        # Only recording during each step, other operators can run in between
+        self._profiler = self._stack.enter_context(profile('import', enabled=self.profile or None, activate=False,
+                                                           file_path=self.directory, file_count=len(to_import)))
+        self._created = {name: [] for name in ROLLBACK_COLLECTIONS}
+        self._items_count = len(context.scene.albam_items_imported)
+        self._steps = self._iter_import_files(context, to_import)
+        self._progress = {}  # file_path: (meshes_done, meshes_total)
+        self._files_done = 0
+        self._files_count = len(to_import)
+
+        wm = context.window_manager
+        wm.progress_begin(0, 1)
+        self._timer = wm.event_timer_add(MODAL_TIMER_STEP, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self._finish(context, cancelled=True)
+            self.report({'WARNING'}, 'Import cancelled, imported data removed')
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        deadline = time.perf_counter() + MODAL_TIME_SLICE
+        finished, error = False, None
+        snapshot = get_data_snapshot()
+        try:
+            with activated(self._profiler):
+                while time.perf_counter() < deadline:
+                    step = next(self._steps)
+                    if step is None:
+                        # Waiting for the prefetch of the next file, give control back to Blender
+                        break
+                    file_path, meshes_done, meshes_total = step
+                    self._progress[file_path] = (meshes_done, meshes_total)
+        except StopIteration:
+            finished = True
+        except Exception as err:
+            error = err
+        # Only the import runs in between, so what the user creates meanwhile is kept
+        for name, datablocks in get_new_data(snapshot).items():
+            self._created[name].extend(datablocks)
+
+        if finished:
+            self._finish(context)
+            return {'FINISHED'}
+        if error:
+            self._finish(context, cancelled=True)
+            self.report({'ERROR'}, 'Import failed, imported data removed: {}'.format(error))
+            return {'CANCELLED'}
+
+        self._update_progress(context)
+        return {'RUNNING_MODAL'}
+
+    def _update_progress(self, context):
+        meshes_done = sum(done for done, _ in self._progress.values())
+        meshes_total = sum(total for _, total in self._progress.values())
+        if meshes_total:
+            context.window_manager.progress_update(meshes_done / meshes_total)
+        context.workspace.status_text_set(
+            'Albam import: file {}/{}, {}/{} meshes. Press ESC to cancel'.format(
+                min(self._files_done + 1, self._files_count), self._files_count, meshes_done, meshes_total))
+
+    def _finish(self, context, cancelled=False):
+        # Closing the generator first runs the cleanup of the step in progress
+        with activated(self._profiler):
+            self._steps.close()
+        if cancelled:
+            if context.mode != 'OBJECT':
+                bpy.ops.object.mode_set(mode='OBJECT')
+            remove_data(self._created)
+            items = context.scene.albam_items_imported
+            for i in reversed(range(self._items_count, len(items))):
+                items.remove(i)
+        self._stack.close()
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
+    def _iter_import_files(self, context, to_import):
+        for file_path in to_import:
+            while not self._pool.is_ready(file_path):
+                yield None
+            yield from self._iter_import_file(file_path=file_path, context=context,
+                                              prefetched=self._pool.get(file_path))
+            self._files_done += 1
+
+    def _get_import_options(self):
+        return {'unpack_dir': self.unpack_dir,
+                'texture_max_size': self.texture_max_size,
+                'verify_arc': self.verify_arc,
+                'arc_index_path': bpy.path.abspath(self.arc_index_path) if self.arc_index_path else '',
+                }
+
     def _import_file(self, **kwargs):
+        for _ in self._iter_import_file(**kwargs):
+            pass
+
+    def _iter_import_file(self, **kwargs):
+        """
+        Import a file (and the files it contains), yielding tuples (file_path, meshes_done,
+        meshes_total) in between steps, when registered for its type with 'import_steps'
+        """
         parent = kwargs.get('parent')
         file_path = kwargs.get('file_path')
         context = kwargs['context']
-        kwargs['unpack_dir'] = self.unpack_dir
+        kwargs.update(self._get_import_options())
 
-        with open(file_path, 'rb') as f:
-            data = f.read()
-        id_magic = data[:4]
+        vfs = kwargs.get('vfs')
+        if vfs:
+            # A file inside an arc, see albam.engines.mtframework.vfs. It's small, and
+            # kept in memory by the vfs for the importer anyway
+            data = vfs.read(file_path)
+            id_magic = data[:4]
+            content_hash = hash_bytes(data)
+            archive_path = vfs.get_entry(file_path).arc_path
+            source_stamp = ''
+            name = ntpath.basename(file_path)
+        else:
+            # e.g. a whole arc, maybe hundreds of MB: only referenced, see albam.lib.sources
+            data = None
+            id_magic = read_magic(file_path)
+            content_hash = ''
+            archive_path = ''
+            source_stamp = get_file_stamp(file_path)
+            name = os.path.basename(file_path)
 
         func = albam_registry.import_registry.get(id_magic)
         if not func:
             raise TypeError('File not supported for import. Id magic: {}'.format(id_magic))
 
-        name = os.path.basename(file_path)
         obj_data = bpy.data.meshes.new(name)
         obj = bpy.data.objects.new(name, obj_data)
         obj.parent = parent
-        obj.albam_imported_item['data'] = data
-        obj.albam_imported_item.source_path = file_path
+        imported_item = obj.albam_imported_item
+        imported_item.source_path = file_path
+        imported_item.archive_path = archive_path
+        imported_item.content_hash = content_hash
+        imported_item.source_stamp = source_stamp
+        imported_item.file_type = id_magic.hex()
+        if self.embed_source:
+            imported_item['data'] = data or load_source(file_path, content_hash, source_stamp=source_stamp)
+        elif data:
+            store_source(content_hash, data)
 
         # TODO: proper logging/raising and rollback if failure
-        results_dict = func(blender_object=obj, **kwargs)
+        steps_func = albam_registry.import_steps_registry.get(id_magic)
+        if steps_func:
+            results_dict = None
+            for meshes_done, meshes_total in steps_func(blender_object=obj, **kwargs):
+                yield file_path, meshes_done, meshes_total
+        else:
+            results_dict = func(blender_object=obj, **kwargs)
         obj.display_type = 'WIRE'
         bpy.context.scene.collection.objects.link(obj)
 
-        is_exportable = bool(albam_registry.export_registry.get(id_magic))
+        is_exportable = id_magic in albam_registry.export_registry
         if is_exportable:
             new_albam_imported_item = context.scene.albam_items_imported.add()
             new_albam_imported_item.name = name
@@ -59,8 +262,15 @@ class AlbamImportOperator(bpy.types.Operator):
         if results_dict:
             files = results_dict.get('files', [])
             kwargs = results_dict.get('kwargs', {})
-            for f in files:
-                self._import_file(file_path=f, context=context, **kwargs)
+            prefetched_files = kwargs.pop('prefetched_files', None) or {}
+            try:
+                for f in files:
+                    yield from self._iter_import_file(file_path=f, context=context,
+                                                      prefetched=prefetched_files.get(f), **kwargs)
+            finally:
+                # e.g. an index shared by the files, see albam.engines.mtframework.import_arc
+                for resource in results_dict.get('resources', ()):
+                    resource.close()
 
 
 @albam_registry.blender_operator()
@@ -69,6 +279,9 @@ class AlbamExportOperator(bpy.types.Operator):
     bl_idname = "albam_export.item"
 
     filepath : bpy.props.StringProperty()
+    profile : bpy.props.BoolProperty(name='Write profiling report', default=False,
+                                     description='Write a json report with timings to ~/.albam/reports. '
+                                                 'Also enabled by the ALBAM_PROFILE environment variable')
 
     @classmethod
     def poll(self, context):  # pragma: no cover
@@ -84,10 +297,13 @@ class AlbamExportOperator(bpy.types.Operator):
     def execute(self, context):
         object_name = context.scene.albam_item_to_export
         obj = bpy.data.objects[object_name]
-        id_magic = obj.albam_imported_item['data'][:4]
-        func = blender_registry.export_registry.get(id_magic)
+        imported_item = obj.albam_imported_item
+        # Files imported with older versions only have the embedded data
+        id_magic = bytes.fromhex(imported_item.file_type) if imported_item.file_type else imported_item.data[:4]
+        func = albam_registry.export_registry.get(id_magic)
         if not func:
             raise TypeError('File not supported for export. Id magic: {}'.format(id_magic))
         bpy.ops.object.mode_set(mode='OBJECT')
-        func(obj, self.filepath)
+        with profile('export', enabled=self.profile or None, file_path=self.filepath):
+            func(obj, self.filepath)
         return {'FINISHED'}
@@ -6,10 +6,17 @@ from albam.registry import albam_registry
 @albam_registry.blender_prop_group()
 class AlbamImportedItem(bpy.types.PropertyGroup):
     name : bpy.props.StringProperty(options={'HIDDEN'})
-    source_path : bpy.props.StringProperty(options={'HIDDEN'})
+    source_path : bpy.props.StringProperty(options={'HIDDEN'})  # Inside archive_path if set
+    archive_path : bpy.props.StringProperty(options={'HIDDEN'})
+    content_hash : bpy.props.StringProperty(options={'HIDDEN'})  # Empty for files on disk until exported over
+    source_stamp : bpy.props.StringProperty(options={'HIDDEN'})  # Size and mtime, for files on disk
     folder : bpy.props.StringProperty(options={'HIDDEN'}) # Always in posix format
-    data : bpy.props.StringProperty(options={'HIDDEN'}, subtype='BYTE_STRING')
-    file_type : bpy.props.StringProperty(options={'HIDDEN'})
+    data : bpy.props.StringProperty(options={'HIDDEN'}, subtype='BYTE_STRING')  # Only if embedded
+    file_type : bpy.props.StringProperty(options={'HIDDEN'})  # Id magic in hex
+    # Fingerprint of the meshes at import or last export, and the hash of the bytes exported
+    # then (in the sources cache; empty if the original ones), to skip exporting it unchanged
+    export_fingerprint : bpy.props.StringProperty(options={'HIDDEN'})
+    exported_hash : bpy.props.StringProperty(options={'HIDDEN'})
 
 
 @albam_registry.blender_prop(bpy.types.Object, 'albam_imported_item', bpy.props.PointerProperty)
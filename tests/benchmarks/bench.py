@@ -0,0 +1,301 @@
+"""
+Benchmarks of the hot paths of albam, on generated files of several sizes.
+Results are written as json, and can be compared against a previous run:
+
+    python -m tests.benchmarks --output results.json
+    python -m tests.benchmarks --baseline results.json
+"""
+import argparse
+from collections import namedtuple
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from albam.engines.mtframework import Arc, Mod156, Tex112
+from albam.engines.mtframework.arc import get_entry_path
+from albam.engines.mtframework.decoding import decode_vertices
+from albam.engines.mtframework.mod_156 import Mod156Header, MOD156_SECTIONS, write_mod156
+from albam.engines.mtframework.utils import get_indices_array
+from albam.lib.blender import strip_triangles_to_triangles_list, triangles_list_to_triangles_strip
+from albam.lib.half_float import unpack_half_float
+from tests.mtframework.generators import MAX_MESH_VERTICES, generate_arc, generate_mod156, generate_tex
+
+
+SIZES = {'small': 1, 'medium': 10, 'large': 100}
+DEFAULT_SIZES = ('small', 'medium')
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.2  # 20% slower than the baseline is a regression
+
+Benchmark = namedtuple('Benchmark', ('name', 'setup', 'func'))
+BENCHMARKS = []
+
+
+def benchmark(name, setup):
+    """
+    Register <func> as a benchmark. <setup> receives (scale, tmpdir) and returns
+    the arguments for <func>, so only <func> is measured
+    """
+    def decorator(func):
+        BENCHMARKS.append(Benchmark(name, setup, func))
+        return func
+    return decorator
+
+
+# Setups
+
+def _write(tmpdir, name, structure):
+    path = os.path.join(tmpdir, name)
+    with open(path, 'wb') as w:
+        w.write(structure)
+    return path
+
+
+def _setup_arc_file(scale, tmpdir):
+    return (_write(tmpdir, 'bench.arc', generate_arc(file_count=20 * scale, file_size=16 * 1024)),)
+
+
+def _setup_arc(scale, tmpdir):
+    return Arc(file_path=_setup_arc_file(scale, tmpdir)[0]), tmpdir
+
+
+def _setup_arc_repack(scale, tmpdir):
+    arc = _setup_arc(scale, tmpdir)[0]
+    # Exporting an arc where one file changed
+    return arc, {get_entry_path(arc.file_entries[0]): bytes(16 * 1024)}
+
+
+def _setup_arc_dir(scale, tmpdir):
+    out = os.path.join(tmpdir, 'extracted')
+    Arc(file_path=_setup_arc_file(scale, tmpdir)[0]).unpack(out)
+    return (out,)
+
+
+def _mod_kwargs(scale, mesh_count=4):
+    # All the meshes fit in one segment of unsigned short indices, like most real mods
+    return {'mesh_count': mesh_count, 'vertex_count': min(MAX_MESH_VERTICES // mesh_count, 1000 * scale),
+            'bone_count': 32}
+
+
+def _setup_mod_file(scale, tmpdir):
+    return (_write(tmpdir, 'bench.mod', generate_mod156(**_mod_kwargs(scale))),)
+
+
+def _setup_mod(scale, tmpdir):
+    return (Mod156(file_path=_setup_mod_file(scale, tmpdir)[0]),)
+
+
+def _setup_mod_sections(scale, tmpdir):
+    mod = _setup_mod(scale, tmpdir)[0]
+    header = Mod156Header.from_buffer_copy(bytes(mod))
+    return header, {name: getattr(mod, name) for name in MOD156_SECTIONS}, os.path.join(tmpdir, 'written.mod')
+
+
+def _setup_strip(scale, tmpdir):
+    mod = _setup_mod(scale, tmpdir)[0]
+    return ([get_indices_array(mod, mesh)[:] for mesh in mod.meshes_array],)
+
+
+def _setup_triangles_mesh(scale, tmpdir):
+    return (GridMesh(int(20 * scale ** 0.5)),)
+
+
+def _setup_half_floats(scale, tmpdir):
+    return (list(range(0, 0x7bff, max(1, 0x7bff // (10000 * scale)))) * 4,)
+
+
+def _setup_tex(scale, tmpdir):
+    size = min(4096, 256 * int(scale ** 0.5))
+    return (_write(tmpdir, 'bench.tex', generate_tex(size, size, fmt=b'DXT5')),)
+
+
+class GridMesh:
+    """Minimal stand-in of a triangulated blender mesh: a grid of <size>x<size> quads"""
+    Polygon = namedtuple('Polygon', ('index', 'vertices', 'edge_keys'))
+
+    def __init__(self, size):
+        self.polygons = []
+        row = size + 1
+        for y in range(size):
+            for x in range(size):
+                a, b, c, d = y * row + x, y * row + x + 1, (y + 1) * row + x, (y + 1) * row + x + 1
+                for vertices in ((a, b, c), (b, d, c)):
+                    edge_keys = tuple(tuple(sorted(e)) for e in
+                                      ((vertices[0], vertices[1]), (vertices[1], vertices[2]),
+                                       (vertices[2], vertices[0])))
+                    self.polygons.append(self.Polygon(len(self.polygons), vertices, edge_keys))
+
+
+# Benchmarks
+
+@benchmark('arc_parse', _setup_arc_file)
+def bench_arc_parse(arc_file):
+    Arc(file_path=arc_file)
+
+
+@benchmark('arc_unpack', _setup_arc)
+def bench_arc_unpack(arc, tmpdir):
+    out = tempfile.mkdtemp(dir=tmpdir)
+    arc.unpack(out)
+    shutil.rmtree(out)
+
+
+@benchmark('arc_from_dir', _setup_arc_dir)
+def bench_arc_from_dir(source_dir):
+    Arc.from_dir(source_dir)
+
+
+@benchmark('arc_repack', _setup_arc_repack)
+def bench_arc_repack(arc, replacements):
+    arc.repack(replacements)
+
+
+@benchmark('mod156_parse', _setup_mod_file)
+def bench_mod156_parse(mod_file):
+    Mod156(file_path=mod_file)
+
+
+@benchmark('mod156_write', _setup_mod_sections)
+def bench_mod156_write(header, sections, output_path):
+    with open(output_path, 'wb') as w:
+        write_mod156(w, header, sections)
+
+
+@benchmark('import_vertices_mod156', _setup_mod)
+def bench_import_vertices_mod156(mod):
+    for mesh in mod.meshes_array:
+        decode_vertices(mod, mesh)
+
+
+@benchmark('strip_triangles_to_triangles_list', _setup_strip)
+def bench_strip_triangles_to_triangles_list(strips):
+    for strip in strips:
+        strip_triangles_to_triangles_list(strip)
+
+
+@benchmark('triangles_list_to_triangles_strip', _setup_triangles_mesh)
+def bench_triangles_list_to_triangles_strip(mesh):
+    triangles_list_to_triangles_strip(mesh)
+
+
+@benchmark('unpack_half_float', _setup_half_floats)
+def bench_unpack_half_float(values):
+    for v in values:
+        unpack_half_float(v)
+
+
+@benchmark('tex_to_dds', _setup_tex)
+def bench_tex_to_dds(tex_file):
+    Tex112(tex_file).to_dds()
+
+
+# Runner
+
+def measure(func, args, repeat):
+    """Return a dict with timings of <repeat> runs and the peak memory of an extra one"""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'min': min(timings),
+            'median': statistics.median(timings),
+            'max': max(timings),
+            'repeat': repeat,
+            'peak_memory': peak,
+            }
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT, names=None, verbose=False):
+    results = []
+    for size in sizes:
+        scale = SIZES[size]
+        for bench in BENCHMARKS:
+            if names and bench.name not in names:
+                continue
+            with tempfile.TemporaryDirectory(prefix='albam_bench_') as tmpdir:
+                args = bench.setup(scale, tmpdir)
+                result = {'name': bench.name, 'size': size}
+                result.update(measure(bench.func, args, repeat))
+            results.append(result)
+            if verbose:
+                print('{name:<36} {size:<8} median: {median:>10.4f}s  min: {min:>10.4f}s  '
+                      'peak memory: {peak_memory:>12,} bytes'.format(**result))
+    return {'meta': {'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'machine': platform.machine(),
+                     'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     },
+            'results': results,
+            }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Return a list of dicts, one per benchmark present in both <results> and <baseline>,
+    with the ratio of the median times and if it's considered a regression
+    """
+    baseline_by_key = {(r['name'], r['size']): r for r in baseline['results']}
+    comparison = []
+    for result in results['results']:
+        base = baseline_by_key.get((result['name'], result['size']))
+        if not base:
+            continue
+        ratio = result['median'] / base['median'] if base['median'] else 1.0
+        comparison.append({'name': result['name'],
+                           'size': result['size'],
+                           'ratio': ratio,
+                           'memory_ratio': (result['peak_memory'] / base['peak_memory']
+                                            if base['peak_memory'] else 1.0),
+                           'regression': ratio > 1 + threshold,
+                           })
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tests.benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--only', nargs='+', choices=[b.name for b in BENCHMARKS],
+                        help='Run only these benchmarks')
+    parser.add_argument('--output', help='Write the results to this json file')
+    parser.add_argument('--baseline', help='Compare against the results in this json file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Ratio over the baseline considered a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.repeat, args.only, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as w:
+            json.dump(results, w, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    comparison = compare(results, baseline, args.threshold)
+    for c in comparison:
+        print('{name:<36} {size:<8} time: {ratio:>6.2f}x  memory: {memory_ratio:>6.2f}x  {flag}'
+              .format(flag='REGRESSION' if c['regression'] else '', **c))
+    return 1 if any(c['regression'] for c in comparison) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
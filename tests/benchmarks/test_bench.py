@@ -0,0 +1,32 @@
+import json
+
+from tests.benchmarks.bench import BENCHMARKS, run_benchmarks, compare, main
+
+
+def test_run_benchmarks_smoke():
+    results = run_benchmarks(sizes=['small'], repeat=1)
+
+    assert {r['name'] for r in results['results']} == {b.name for b in BENCHMARKS}
+    assert all(r['median'] >= 0 and r['peak_memory'] >= 0 for r in results['results'])
+    json.dumps(results)
+
+
+def test_compare_flags_regressions():
+    baseline = {'results': [{'name': 'a', 'size': 'small', 'median': 1.0, 'peak_memory': 100},
+                            {'name': 'b', 'size': 'small', 'median': 1.0, 'peak_memory': 100}]}
+    results = {'results': [{'name': 'a', 'size': 'small', 'median': 1.1, 'peak_memory': 100},
+                           {'name': 'b', 'size': 'small', 'median': 1.5, 'peak_memory': 200},
+                           {'name': 'c', 'size': 'small', 'median': 1.0, 'peak_memory': 100}]}
+
+    comparison = compare(results, baseline, threshold=0.2)
+
+    assert [(c['name'], c['regression']) for c in comparison] == [('a', False), ('b', True)]
+    assert comparison[1]['memory_ratio'] == 2.0
+
+
+def test_main_baseline(tmpdir):
+    output = str(tmpdir.join('results.json'))
+
+    assert main(['--sizes', 'small', '--repeat', '1', '--only', 'arc_parse', '--output', output]) == 0
+    assert main(['--sizes', 'small', '--repeat', '1', '--only', 'arc_parse',
+                 '--baseline', output, '--threshold', '1000']) == 0
@@ -0,0 +1,254 @@
+"""
+Generate valid Arc, Mod156 and Tex112 files of any size, without the original game files.
+The output only depends on the arguments (including the seed), so it can be used
+for regression tests and benchmarks on any machine.
+"""
+import ctypes
+from ctypes import c_char, c_float, c_ubyte, c_ushort, c_uint
+import ntpath
+import random
+import zlib
+
+from albam.engines.mtframework import Arc, Mod156, Tex112, EXTENSION_TO_FILE_ID
+from albam.engines.mtframework.arc import FileEntry, get_data_offset
+from albam.engines.mtframework.mod_156 import (
+    Bone,
+    BonePalette,
+    GroupData,
+    MaterialData,
+    Mesh156,
+    MeshBox,
+    VertexFormat,
+    VertexFormat0,
+    CLASSES_TO_VERTEX_FORMATS,
+    )
+from albam.image_formats.dds import DDS
+from albam.lib.structure import get_offset
+
+MODEL_DIR = 'pawn\\pl\\pl0000\\model'
+MAX_BONE_PALETTE_SIZE = 32
+MAX_MESH_VERTICES = 65535  # indices are unsigned shorts
+
+
+def random_bytes(rng, size, compressibility=0.5):
+    """
+    Return <size> bytes where roughly a <compressibility> fraction are zeros,
+    to get compression ratios closer to real files than pure noise
+    """
+    random_size = int(size * (1 - compressibility))
+    data = bytearray(size)
+    data[:random_size] = rng.getrandbits(8 * random_size).to_bytes(random_size, 'little') if random_size else b''
+    return bytes(data)
+
+
+def generate_tex(width=256, height=256, fmt=b'DXT1', mipmap_count=None, seed=0):
+    rng = random.Random(seed)
+    if mipmap_count is None:
+        mipmap_count = DDS.calculate_mipmap_count(width, height)
+    start_offset = 40 + mipmap_count * 4
+    mipmap_offsets = Tex112.calculate_mipmap_offsets(mipmap_count, width, height, fmt, start_offset)
+    data_size = sum(DDS.calculate_mipmap_size(width, height, i, fmt) for i in range(mipmap_count))
+    data = random_bytes(rng, data_size)
+    return Tex112(id_magic=Tex112.ID_MAGIC, version=112, revision=34,
+                  mipmap_count=mipmap_count, unk_byte_1=1, width=width, height=height,
+                  compression_format=fmt, unk_float_1=0.76, unk_float_2=0.76, unk_float_3=0.76,
+                  mipmap_offsets=(c_uint * mipmap_count)(*mipmap_offsets),
+                  dds_data=(ctypes.c_byte * data_size).from_buffer_copy(data))
+
+
+def generate_mod156(mesh_count=4, vertex_count=1000, bone_count=16, texture_count=2, seed=0):
+    """
+    Return a Mod156 with <mesh_count> meshes of <vertex_count> vertices each.
+    Each mesh is a single triangle strip (a band of quads), with indices relative to
+    the segment of the vertex buffer at its `vertex_offset`, like the ones exported by
+    albam: a new segment starts when the indices wouldn't fit in an unsigned short.
+    Meshes with bones use vertex format 1.
+    """
+    if vertex_count > MAX_MESH_VERTICES:
+        raise ValueError('Mod156 meshes are limited to 65535 vertices')
+    rng = random.Random(seed)
+    VF = VertexFormat if bone_count else VertexFormat0
+    palette_size = min(bone_count, MAX_BONE_PALETTE_SIZE)
+    bone_palette_count = 1 if bone_count else 0
+    box = (-100.0, 0.0, -50.0, 100.0, 200.0, 50.0)  # min x y z, max x y z
+
+    bones_array = (Bone * bone_count)()
+    for i, bone in enumerate(bones_array):
+        bone.anim_map_index = i
+        bone.parent_index = i - 1 if i else 255
+        bone.mirror_index = i
+        bone.palette_index = i
+        bone.location_x = rng.uniform(-5, 5)
+        bone.location_y = rng.uniform(0, 10)
+        bone.location_z = rng.uniform(-5, 5)
+        bone.parent_distance = 5.0
+    identity = (c_float * 16)(1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1)
+    bones_matrices = ((c_float * 16) * bone_count)(*[identity] * bone_count)
+    bones_animation_mapping = (c_ubyte * (256 if bone_palette_count else 0))(*range(bone_count))
+    bone_palette_array = (BonePalette * bone_palette_count)()
+    if bone_palette_count:
+        bone_palette_array[0].unk_01 = palette_size
+        bone_palette_array[0].values = (c_ubyte * 32)(*range(palette_size))
+
+    textures_array = ((c_char * 64) * texture_count)()
+    for i in range(texture_count):
+        textures_array[i] = (c_char * 64)(*ntpath.join(MODEL_DIR, 'pl0000_{:02d}_BM'.format(i)).encode('ascii'))
+    material_count = max(1, texture_count)
+    materials_data_array = (MaterialData * material_count)()
+    for i, material in enumerate(materials_data_array):
+        material.texture_indices[0] = i + 1 if texture_count else 0
+
+    meshes_array = (Mesh156 * mesh_count)()
+    vertex_buffer = (VF * (vertex_count * mesh_count))()
+    index_buffer = []
+    meshes_array_2 = []
+    vertex_position = 0  # of the mesh in the current segment
+    segment_offset = 0
+    for mesh_index, mesh in enumerate(meshes_array):
+        vertex_start = mesh_index * vertex_count
+        for i in range(vertex_count):
+            _set_random_vertex(rng, vertex_buffer[vertex_start + i], i, palette_size)
+        if vertex_position + vertex_count > MAX_MESH_VERTICES:
+            segment_offset = vertex_start * ctypes.sizeof(VF)
+            vertex_position = 0
+        strip = list(range(vertex_position, vertex_position + vertex_count))
+        mesh.material_index = mesh_index % material_count
+        mesh.constant = 1
+        mesh.level_of_detail = 255
+        mesh.vertex_format = CLASSES_TO_VERTEX_FORMATS[VF]
+        mesh.vertex_stride = ctypes.sizeof(VF)
+        mesh.vertex_count = vertex_count
+        mesh.vertex_index_end = vertex_position + vertex_count - 1
+        mesh.vertex_index_start_1 = vertex_position
+        mesh.vertex_offset = segment_offset
+        mesh.vertex_index_start_2 = vertex_position
+        mesh.face_position = len(index_buffer)
+        mesh.face_count = len(strip)
+        mesh.vertex_group_count = palette_size
+        mesh.bone_palette_index = 0
+        index_buffer.extend(strip)
+        vertex_position += vertex_count
+        meshes_array_2.extend(MeshBox() for _ in range(palette_size))
+
+    vertex_buffer = (c_ubyte * ctypes.sizeof(vertex_buffer)).from_buffer(vertex_buffer)
+    index_buffer = (c_ushort * len(index_buffer))(*index_buffer)
+    meshes_array_2 = (MeshBox * len(meshes_array_2))(*meshes_array_2)
+    group_data_array = (GroupData * 1)(GroupData(group_index=0))
+
+    mod = Mod156(id_magic=b'MOD',
+                 version=156,
+                 version_rev=1,
+                 bone_count=bone_count,
+                 mesh_count=mesh_count,
+                 material_count=material_count,
+                 vertex_count=vertex_count * mesh_count,
+                 face_count=len(index_buffer) + 1,
+                 edge_count=0,
+                 vertex_buffer_size=len(vertex_buffer),
+                 vertex_buffer_2_size=0,
+                 texture_count=texture_count,
+                 group_count=1,
+                 bone_palette_count=bone_palette_count,
+                 bones_array_offset=176 if bone_count else 0,
+                 sphere_x=0.0, sphere_y=100.0, sphere_z=0.0, sphere_w=150.0,
+                 box_min_x=box[0], box_min_y=box[1], box_min_z=box[2], box_min_w=0.0,
+                 box_max_x=box[3], box_max_y=box[4], box_max_z=box[5], box_max_w=0.0,
+                 bones_array=bones_array,
+                 bones_unk_matrix_array=bones_matrices,
+                 bones_world_transform_matrix_array=bones_matrices,
+                 bones_animation_mapping=bones_animation_mapping,
+                 bone_palette_array=bone_palette_array,
+                 group_data_array=group_data_array,
+                 textures_array=textures_array,
+                 materials_data_array=materials_data_array,
+                 meshes_array=meshes_array,
+                 meshes_array_2_size=len(meshes_array_2),
+                 meshes_array_2=meshes_array_2,
+                 vertex_buffer=vertex_buffer,
+                 vertex_buffer_2=(c_ubyte * 0)(),
+                 index_buffer=index_buffer,
+                 )
+    mod.group_offset = get_offset(mod, 'group_data_array')
+    mod.textures_array_offset = get_offset(mod, 'textures_array')
+    mod.meshes_array_offset = get_offset(mod, 'meshes_array')
+    mod.vertex_buffer_offset = get_offset(mod, 'vertex_buffer')
+    mod.vertex_buffer_2_offset = get_offset(mod, 'vertex_buffer_2')
+    mod.index_buffer_offset = get_offset(mod, 'index_buffer')
+    return mod
+
+
+def _set_random_vertex(rng, vertex, index, palette_size):
+    # A band of quads: even vertices at the bottom, odd at the top
+    if palette_size:
+        vertex.position_x = (index // 2 * 97) % 32767
+        vertex.position_y = 32767 * (index % 2)
+        vertex.position_z = rng.randrange(32767)
+        vertex.position_w = 32767
+        bone_index = rng.randrange(palette_size)
+        vertex.bone_indices[0] = bone_index
+        vertex.bone_indices[1] = (bone_index + 1) % palette_size
+        weight = rng.randrange(1, 255)
+        vertex.weight_values[0] = weight
+        vertex.weight_values[1] = 255 - weight
+        vertex.tangent_x = vertex.tangent_y = vertex.tangent_z = vertex.tangent_w = 255
+    else:
+        vertex.position_x = float(index // 2)
+        vertex.position_y = float(index % 2)
+        vertex.position_z = rng.uniform(-1, 1)
+    vertex.normal_x = rng.randrange(256)
+    vertex.normal_y = rng.randrange(256)
+    vertex.normal_z = rng.randrange(256)
+    vertex.normal_w = 255
+    vertex.uv_x = rng.randrange(0x3c00)  # half floats in [0, 1)
+    vertex.uv_y = rng.randrange(0x3c00)
+
+
+def generate_arc_entries(file_count=16, file_size=16 * 1024, mod_count=0, tex_count=0,
+                         tex_size=256, seed=0, **mod_kwargs):
+    """
+    Return a dict {<file path with extension, ntpath>: bytes} with <file_count> generic
+    files, plus <mod_count> mods and <tex_count> textures
+    """
+    rng = random.Random(seed)
+    entries = {}
+    extensions = ('sbc', 'efs', 'rtex', 'lmt')
+    for i in range(file_count):
+        path = ntpath.join('data', 'dir_{:02d}'.format(i % 8), 'file_{:04d}.{}'.format(i, extensions[i % 4]))
+        entries[path] = random_bytes(rng, file_size)
+    for i in range(mod_count):
+        path = ntpath.join(MODEL_DIR, 'pl{:04d}.mod'.format(i))
+        entries[path] = bytes(generate_mod156(seed=seed + i, **mod_kwargs))
+    for i in range(tex_count):
+        path = ntpath.join(MODEL_DIR, 'pl0000_{:02d}_BM.tex'.format(i))
+        entries[path] = bytes(generate_tex(tex_size, tex_size, seed=seed + i))
+    return entries
+
+
+def generate_arc(file_count=16, file_size=16 * 1024, mod_count=0, tex_count=0,
+                 tex_size=256, seed=0, **mod_kwargs):
+    """Return an Arc with the files from `generate_arc_entries`, compressed like the game does"""
+    entries = generate_arc_entries(file_count, file_size, mod_count, tex_count, tex_size,
+                                   seed, **mod_kwargs)
+    return arc_from_entries(entries)
+
+
+def arc_from_entries(entries):
+    files_count = len(entries)
+    file_entries = (FileEntry * files_count)()
+    current_offset = get_data_offset(files_count)
+    data = bytearray()
+    for i, (path, content) in enumerate(sorted(entries.items())):
+        chunk = zlib.compress(content)
+        path_no_ext, ext = ntpath.splitext(path)
+        file_entries[i] = FileEntry(file_path=path_no_ext.encode('ascii'),
+                                    file_id=EXTENSION_TO_FILE_ID.get(ext[1:]) or 0,
+                                    flags=64,
+                                    size=len(content),
+                                    zsize=len(chunk),
+                                    offset=current_offset)
+        data.extend(chunk)
+        current_offset += len(chunk)
+
+    data = (c_ubyte * len(data)).from_buffer(data)
+    return Arc(id_magic=Arc.ID_MAGIC, version=7, files_count=files_count,
+               file_entries=file_entries, data=data)
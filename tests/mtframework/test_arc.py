@@ -1,9 +1,24 @@
+from io import BytesIO
 import os
+import random
+import tracemalloc
+import zlib
 
 import pytest
 
 from albam.engines.mtframework import Arc
+from albam.engines.mtframework.arc import (
+    get_data_offset,
+    get_entry_path,
+    copy_entry,
+    iter_buffer_chunks,
+    iter_decompressed,
+    read_entry,
+    unpack_file,
+    verify_file,
+    )
 from tests.mtframework.conftest import ARC_FILES
+from tests.mtframework.generators import generate_arc, generate_arc_entries, arc_from_entries, random_bytes
 
 
 @pytest.mark.parametrize("arc_file", ARC_FILES)
@@ -49,3 +64,177 @@ def test_arc_from_dir_re5(tmpdir, arc_file):
     assert arc_original.files_count == arc_from_arc_from_dir.files_count
     assert sorted(files_extracted_1) == sorted(files_extracted_2)
     assert arc_from_arc_from_dir.file_entries[0].offset == 32768
+
+
+@pytest.mark.parametrize('file_count', (1, 100, 1000))
+def test_arc_unpack_synthetic(tmpdir, file_count):
+    entries = generate_arc_entries(file_count=file_count, file_size=1024, mod_count=1, tex_count=1)
+    arc_file = os.path.join(str(tmpdir), 'synthetic.arc')
+    with open(arc_file, 'wb') as w:
+        w.write(arc_from_entries(entries))
+    out = os.path.join(str(tmpdir), 'extracted_arc')
+
+    arc = Arc(file_path=arc_file)
+    arc.unpack(out)
+
+    assert arc.files_count == len(entries)
+    assert arc.file_entries[0].offset == get_data_offset(len(entries))
+    for path, content in entries.items():
+        with open(os.path.join(out, *path.split('\\')), 'rb') as f:
+            assert f.read() == content
+
+
+def test_arc_from_dir_synthetic(tmpdir):
+    arc_original = generate_arc(file_count=500, file_size=512)
+    out = os.path.join(str(tmpdir), 'extracted_arc')
+    arc_original.unpack(out)
+
+    arc_from_dir = Arc.from_dir(out)
+
+    assert bytes(arc_from_dir) == bytes(arc_original)
+
+
+def test_arc_repack(tmpdir):
+    entries = generate_arc_entries(file_count=20, file_size=512, mod_count=2, tex_count=1)
+    arc_original = arc_from_entries(entries)
+    mod_path = 'pawn\\pl\\pl0000\\model\\pl0001.mod'
+    new_tex_path = 'pawn\\pl\\pl0000\\model\\new_BM.tex'
+    assert mod_path in entries
+    replacements = {mod_path: b'replaced', new_tex_path: b'new texture'}
+
+    arc = arc_original.repack(replacements)
+
+    out = os.path.join(str(tmpdir), 'extracted_arc')
+    arc.unpack(out)
+    expected = dict(entries, **replacements)
+    assert arc.files_count == len(expected)
+    assert [get_entry_path(fe) for fe in arc.file_entries][-1] == new_tex_path
+    for path, content in expected.items():
+        with open(os.path.join(out, *path.split('\\')), 'rb') as f:
+            assert f.read() == content
+    assert Arc(file_path=bytes(arc)).verify().ok
+    # Entries not replaced keep their compressed data
+    assert bytes(arc_original.repack({})) == bytes(arc_original)
+
+
+def test_unpack_file_same_as_unpack(tmpdir):
+    entries = generate_arc_entries(file_count=50, file_size=3000, mod_count=1, tex_count=1)
+    arc_file = os.path.join(str(tmpdir), 'synthetic.arc')
+    with open(arc_file, 'wb') as w:
+        w.write(arc_from_entries(entries))
+    out = os.path.join(str(tmpdir), 'extracted_arc')
+
+    file_entries = unpack_file(arc_file, out, chunk_size=1000)
+
+    assert len(file_entries) == len(entries)
+    for path, content in entries.items():
+        with open(os.path.join(out, *path.split('\\')), 'rb') as f:
+            assert f.read() == content
+
+
+def test_copy_entry_bounded_memory():
+    content = bytes(range(256)) * (32 * 1024)  # 8 MiB, very compressible
+    compressed = zlib.compress(content)
+    arc = arc_from_entries({'big.sbc': content})
+    f = BytesIO(bytes(arc))
+    fe = arc.file_entries[0]
+
+    class Sink:
+        size = 0
+
+        def write(self, data):
+            self.size += len(data)
+
+    sink = Sink()
+    tracemalloc.start()
+    try:
+        written = copy_entry(f, fe, sink, chunk_size=64 * 1024)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert written == sink.size == len(content)
+    assert fe.zsize == len(compressed)
+    assert peak < 1024 * 1024
+
+
+def test_iter_decompressed_truncated():
+    compressed = zlib.compress(random_bytes(random.Random(0), 10000))
+
+    with pytest.raises(zlib.error):
+        list(iter_decompressed([compressed[:len(compressed) // 2]]))
+    with pytest.raises(EOFError):
+        list(iter_buffer_chunks(compressed, 0, len(compressed) + 1))
+
+
+def test_verify_ok(tmpdir):
+    entries = generate_arc_entries(file_count=20, file_size=2000)
+    arc = arc_from_entries(entries)
+    arc_file = os.path.join(str(tmpdir), 'synthetic.arc')
+    with open(arc_file, 'wb') as w:
+        w.write(arc)
+
+    report = arc.verify(crc=True)
+    file_report = verify_file(arc_file, crc=True, jobs=4)
+
+    assert report.ok and file_report.ok
+    assert report.to_dict() == file_report.to_dict()
+    crcs = {e.path: e.crc32 for e in report.entries}
+    assert crcs == {path: zlib.crc32(content) for path, content in entries.items()}
+
+
+def test_verify_finds_errors(tmpdir):
+    arc = arc_from_entries(generate_arc_entries(file_count=4, file_size=2000))
+    fe = arc.file_entries
+    fe[1].size += 1
+    fe[2].offset = fe[1].offset + 10  # inside entry 1, and not a zlib stream start
+    fe[3].zsize = 10 ** 6
+    arc_file = os.path.join(str(tmpdir), 'corrupted.arc')
+    with open(arc_file, 'wb') as w:
+        w.write(arc)
+
+    report = verify_file(arc_file)
+    errors = [e.errors for e in report.entries]
+
+    assert not report.ok
+    assert errors[0] == []
+    assert errors[1] == ['decompressed size is 2000, expected 2001']
+    assert errors[2][0] == 'data overlaps with entry 1'
+    assert errors[2][1].startswith('decompression failed')
+    assert errors[3][0].startswith('data out of range')
+    assert report.to_dict() == arc.verify().to_dict()
+
+
+def test_verify_file_only_entries(tmpdir):
+    arc = arc_from_entries(generate_arc_entries(file_count=4, file_size=2000))
+    fe = arc.file_entries
+    fe[1].size += 1
+    fe[2].offset = fe[1].offset + 10
+    fe[3].zsize = 10 ** 6
+    arc_file = os.path.join(str(tmpdir), 'corrupted.arc')
+    with open(arc_file, 'wb') as w:
+        w.write(arc)
+
+    report = verify_file(arc_file, crc=True, decompress=False)
+    errors = [e.errors for e in report.entries]
+
+    assert errors[:3] == [[], [], ['data overlaps with entry 1']]
+    assert errors[3][0].startswith('data out of range')
+    assert {e.crc32 for e in report.entries} == {None}
+    # The size is checked when reading the entry instead
+    with open(arc_file, 'rb') as f:
+        with pytest.raises(ValueError, match='decompressed size is 2000, expected 2001'):
+            read_entry(f, fe[1])
+        with pytest.raises(ValueError, match='decompressed size is 2000, expected 2001'):
+            copy_entry(f, fe[1], BytesIO())
+
+
+def test_verify_not_an_arc(tmpdir):
+    path = os.path.join(str(tmpdir), 'fake.arc')
+    with open(path, 'wb') as w:
+        w.write(b'MOD\x00' + bytes(100))
+
+    report = verify_file(path)
+
+    assert not report.ok
+    assert report.get_errors() == ["Not an arc file. Id magic: b'MOD'"]
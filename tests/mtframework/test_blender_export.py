@@ -0,0 +1,392 @@
+from array import array
+from io import BytesIO
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from albam.engines.mtframework import Arc, Mod156, blender_export
+from albam.engines.mtframework.arc import get_entry_path
+from albam.engines.mtframework.mod_156 import Mod156Header, MOD156_SECTIONS, VertexFormat0
+from albam.lib.blender import get_mesh_objects_fingerprint
+from albam.lib.cache import FileCache, get_file_stamp, hash_bytes
+from tests.mtframework.generators import MODEL_DIR, arc_from_entries, generate_arc_entries, generate_mod156
+
+MOD_PATH = MODEL_DIR + '\\pl0000.mod'
+TEX_PATH = MODEL_DIR + '\\pl0000_00_BM.tex'
+
+
+def _imported_object(data, content_hash='', name='', children=()):
+    item = SimpleNamespace(source_path='', archive_path='', content_hash=content_hash, source_stamp='', data=data,
+                           export_fingerprint='', exported_hash='')
+    bound_box = [(x, y, z) for x in (-1.0, 1.0) for y in (-1.0, 1.0) for z in (0.0, 2.0)]
+    return SimpleNamespace(albam_imported_item=item, name=name, children=list(children), bound_box=bound_box)
+
+
+class FakeCollection(list):
+    """Stand-in of a bpy collection, with `foreach_get`"""
+
+    def foreach_get(self, attribute, values):
+        flat = []
+        for element in self:
+            value = getattr(element, attribute)
+            flat.extend(value if isinstance(value, tuple) else (value,))
+        values[:] = array(values.typecode, flat)
+
+
+class FakeData(SimpleNamespace):
+    """Blender data blocks can be put in sets"""
+    __hash__ = object.__hash__
+
+
+class FakeImage:
+    """Custom properties of images are accessed like a dict"""
+
+    def __init__(self, filepath, **props):
+        self.filepath = filepath
+        self.is_dirty = False
+        self.props = props
+
+    def get(self, key, default=None):
+        return self.props.get(key, default)
+
+
+def _mesh_object(name, image, weight=1.0):
+    """A triangle weighted to one bone, with a material using <image>"""
+    vertices = FakeCollection(SimpleNamespace(index=i, co=co, groups=[SimpleNamespace(group=0, weight=weight)])
+                              for i, co in enumerate(((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0))))
+    texture = FakeData(name='pl0000_00_BM', image=image)
+    slot = SimpleNamespace(texture=texture, use_map_color_diffuse=True, use_map_normal=False,
+                           use_map_specular=False, texture_coords='UV', mapping='FLAT')
+    material = SimpleNamespace(name='material', use_cast_shadows=True, texture_slots=[slot, None])
+    mesh = FakeData(vertices=vertices,
+                    loops=FakeCollection(SimpleNamespace(vertex_index=i) for i in range(3)),
+                    polygons=FakeCollection([SimpleNamespace(loop_start=0, loop_total=3)]),
+                    uv_layers=[SimpleNamespace(data=FakeCollection(SimpleNamespace(uv=(0.0, 0.5))
+                                                                   for _ in range(3)))],
+                    has_custom_normals=False, materials=[material])
+    return SimpleNamespace(name=name, type='MESH', data=mesh, modifiers=[],
+                           vertex_groups=[SimpleNamespace(name='0')])
+
+
+def test_parsed_source_mod_cached_by_content_hash(monkeypatch, tmpdir):
+    monkeypatch.setattr(blender_export, '_parsed_mods', blender_export.OrderedDict())
+    monkeypatch.setattr(blender_export, 'get_sources_cache', lambda: FileCache(str(tmpdir.join('sources'))))
+    monkeypatch.setattr(blender_export, 'PARSED_MODS_CACHE_SIZE', 2)
+    mods = [bytes(generate_mod156(mesh_count=2, vertex_count=20, seed=i)) for i in range(3)]
+    objects = [_imported_object(data, hash_bytes(data)) for data in mods]
+
+    parsed = blender_export.get_parsed_source_mod(objects[0])
+    assert bytes(parsed.mod) == mods[0]
+    assert parsed.default_texture_dir == 'pawn\\pl\\pl0000\\model'
+    assert set(parsed.per_bone_meshes_boxes) <= set(range(16))
+    # Another object imported from the same file, e.g. after duplicating it
+    assert blender_export.get_parsed_source_mod(_imported_object(mods[0], hash_bytes(mods[0]))) is parsed
+
+    blender_export.get_parsed_source_mod(objects[1])
+    blender_export.get_parsed_source_mod(objects[2])
+    assert list(blender_export._parsed_mods) == [hash_bytes(mods[1]), hash_bytes(mods[2])]
+    assert blender_export.get_parsed_source_mod(objects[0]) is not parsed
+
+
+def test_parsed_source_mod_without_content_hash(monkeypatch, tmpdir):
+    monkeypatch.setattr(blender_export, '_parsed_mods', blender_export.OrderedDict())
+    monkeypatch.setattr(blender_export, 'get_sources_cache', lambda: FileCache(str(tmpdir.join('sources'))))
+    data = bytes(generate_mod156(mesh_count=1, vertex_count=20))
+
+    parsed = blender_export.get_parsed_source_mod(_imported_object(data))
+
+    assert blender_export.get_parsed_source_mod(_imported_object(data)) is parsed
+    assert list(blender_export._parsed_mods) == [hash_bytes(data)]
+
+
+def test_mesh_objects_fingerprint():
+    image = FakeImage('/textures/pl0000_00_BM.dds')
+    fingerprint = get_mesh_objects_fingerprint([_mesh_object('a', image), _mesh_object('b', image)])
+
+    assert get_mesh_objects_fingerprint([_mesh_object('b', image), _mesh_object('a', image)]) == fingerprint
+    moved = _mesh_object('a', image)
+    moved.data.vertices[1].co = (2.0, 0.0, 0.0)
+    assert get_mesh_objects_fingerprint([moved, _mesh_object('b', image)]) != fingerprint
+    assert get_mesh_objects_fingerprint([_mesh_object('a', image, weight=0.5),
+                                         _mesh_object('b', image)]) != fingerprint
+    other_image = FakeImage('/textures/other.dds')
+    assert get_mesh_objects_fingerprint([_mesh_object('a', other_image),
+                                         _mesh_object('b', image)]) != fingerprint
+
+    parent = _imported_object(b'')
+    fingerprint = get_mesh_objects_fingerprint([_mesh_object('a', image)], parent)
+    assert fingerprint != get_mesh_objects_fingerprint([_mesh_object('a', image)])
+    parent.bound_box[0] = (-2.0, -1.0, 0.0)
+    assert get_mesh_objects_fingerprint([_mesh_object('a', image)], parent) != fingerprint
+
+
+def _export_setup(monkeypatch, tmpdir):
+    """Return (arc object, mod object, arc entries) of an imported arc with one mod and one texture"""
+    monkeypatch.setattr(blender_export, '_parsed_mods', blender_export.OrderedDict())
+    monkeypatch.setattr(blender_export, 'bpy', SimpleNamespace(path=SimpleNamespace(abspath=lambda p: p)),
+                        raising=False)
+    monkeypatch.setattr(blender_export, 'get_sources_cache', lambda: FileCache(str(tmpdir.join('sources'))))
+    monkeypatch.setattr(blender_export, 'get_exported_textures_cache',
+                        lambda: FileCache(str(tmpdir.join('exported_tex')), extension='.tex'))
+    entries = generate_arc_entries(file_count=8, file_size=512, mod_count=1, tex_count=1,
+                                   mesh_count=1, vertex_count=20)
+    dds_path = os.path.normpath(str(tmpdir.join('pl0000_00_BM.dds')))
+    tmpdir.join('pl0000_00_BM.dds').write_binary(b'DDS ')
+    image = FakeImage(dds_path, albam_source_dds=dds_path, albam_source_dds_stamp=get_file_stamp(dds_path))
+    mod_object = _imported_object(entries[MOD_PATH], hash_bytes(entries[MOD_PATH]), name='pl0000.mod',
+                                  children=[_mesh_object('mesh_0', image)])
+    mod_object.albam_imported_item.export_fingerprint = get_mesh_objects_fingerprint(mod_object.children, mod_object)
+    arc_data = bytes(arc_from_entries(entries))
+    arc_object = _imported_object(arc_data, hash_bytes(arc_data), children=[mod_object])
+    return arc_object, mod_object, entries
+
+
+def _exported_mod(data):
+    mod = Mod156(file_path=BytesIO(data))
+    return blender_export.ExportedMod(Mod156Header.from_buffer_copy(data),
+                                      {name: getattr(mod, name) for name in MOD156_SECTIONS}, None)
+
+
+def _read_entries(arc_path):
+    arc = Arc(file_path=arc_path)
+    out = {}
+    for i, fe in enumerate(arc.file_entries):
+        out[get_entry_path(fe)] = fe
+    return arc, out
+
+
+def test_export_arc_unchanged(monkeypatch, tmpdir):
+    arc_object, _, _ = _export_setup(monkeypatch, tmpdir)
+    monkeypatch.setattr(blender_export, 'export_mod156', None)  # must not be called
+    monkeypatch.setattr(blender_export, 'dds_file_to_tex', None)
+    output = str(tmpdir.join('exported.arc'))
+
+    blender_export.export_arc(arc_object, output)
+
+    assert tmpdir.join('exported.arc').read_binary() == arc_object.albam_imported_item.data
+
+
+def test_export_arc_only_changed(monkeypatch, tmpdir):
+    arc_object, mod_object, entries = _export_setup(monkeypatch, tmpdir)
+    new_mod = bytes(generate_mod156(mesh_count=1, vertex_count=20, seed=1))
+    exports = []
+
+    def export_mod156(blender_object):
+        exports.append(blender_object)
+        return _exported_mod(new_mod)
+
+    def dds_file_to_tex(f, w):
+        w.write(b'TEX\x00' + f.read())
+
+    monkeypatch.setattr(blender_export, 'export_mod156', export_mod156)
+    monkeypatch.setattr(blender_export, 'dds_file_to_tex', dds_file_to_tex)
+    mod_object.children[0].data.vertices[0].co = (0.0, 0.0, 1.0)
+    image = mod_object.children[0].data.materials[0].texture_slots[0].texture.image
+    del image.props['albam_source_dds']  # e.g. another dds was loaded
+    output = str(tmpdir.join('exported.arc'))
+
+    blender_export.export_arc(arc_object, output)
+
+    exported_arc = Arc(file_path=output)
+    exported_arc.unpack(str(tmpdir.join('out')))
+    assert tmpdir.join('out', *MOD_PATH.split('\\')).read_binary() == new_mod
+    assert tmpdir.join('out', *TEX_PATH.split('\\')).read_binary() == b'TEX\x00DDS '
+    other_path = next(p for p in entries if p.endswith('.sbc'))
+    assert tmpdir.join('out', *other_path.split('\\')).read_binary() == entries[other_path]
+    item = mod_object.albam_imported_item
+    assert item.export_fingerprint == get_mesh_objects_fingerprint(mod_object.children, mod_object)
+    assert item.exported_hash == hash_bytes(new_mod)
+    assert len(exports) == 1
+
+    # Exporting again reuses the mod and the texture exported before
+    monkeypatch.setattr(blender_export, 'export_mod156', None)
+    monkeypatch.setattr(blender_export, 'dds_file_to_tex', None)
+    blender_export.export_arc(arc_object, str(tmpdir.join('exported_2.arc')))
+    assert tmpdir.join('exported_2.arc').read_binary() == tmpdir.join('exported.arc').read_binary()
+
+
+def test_export_arc_twice_over_the_imported_file(monkeypatch, tmpdir):
+    arc_object, mod_object, _ = _export_setup(monkeypatch, tmpdir)
+    monkeypatch.setattr(blender_export, 'dds_file_to_tex', lambda f, w: w.write(b'TEX\x00' + f.read()))
+    item = arc_object.albam_imported_item
+    item.source_path = str(tmpdir.join('imported.arc'))
+    tmpdir.join('imported.arc').write_binary(item.data)
+    original = item.data
+    # Imported from disk: only referenced, not embedded nor in the sources cache
+    item.data = None
+    item.content_hash = ''
+    item.source_stamp = get_file_stamp(item.source_path)
+    mod_object.children[0].data.materials[0].texture_slots[0].texture.image.is_dirty = True
+
+    blender_export.export_arc(arc_object, str(tmpdir.join('elsewhere.arc')))
+    assert not item.content_hash
+    blender_export.export_arc(arc_object, item.source_path)
+    exported = tmpdir.join('imported.arc').read_binary()
+    blender_export.export_arc(arc_object, item.source_path)
+
+    assert tmpdir.join('imported.arc').read_binary() == exported
+    assert item.exported_hash == hash_bytes(exported)
+    # The original was copied before being overwritten
+    assert item.content_hash == hash_bytes(original)
+    assert blender_export.get_source_bytes(arc_object) == original
+
+
+def test_export_arc_dds_modified_in_place(monkeypatch, tmpdir):
+    arc_object, mod_object, _ = _export_setup(monkeypatch, tmpdir)
+    monkeypatch.setattr(blender_export, 'export_mod156', None)
+    monkeypatch.setattr(blender_export, 'dds_file_to_tex', lambda f, w: w.write(b'TEX\x00' + f.read()))
+    dds = tmpdir.join('pl0000_00_BM.dds')
+    dds.write_binary(b'DDS edited')
+
+    blender_export.export_arc(arc_object, str(tmpdir.join('exported.arc')))
+
+    exported_arc = Arc(file_path=str(tmpdir.join('exported.arc')))
+    exported_arc.unpack(str(tmpdir.join('out')))
+    assert tmpdir.join('out', *TEX_PATH.split('\\')).read_binary() == b'TEX\x00DDS edited'
+
+
+def test_export_arc_skips_textures_from_other_arcs(monkeypatch, tmpdir, capsys):
+    arc_object, mod_object, entries = _export_setup(monkeypatch, tmpdir)
+    dds_path = os.path.normpath(str(tmpdir.join('shared_BM.dds')))
+    tmpdir.join('shared_BM.dds').write_binary(b'DDS ')
+    image = FakeImage(dds_path, albam_source_dds=dds_path, albam_source_dds_stamp=get_file_stamp(dds_path),
+                      albam_source_archive='/arc/shared.arc')
+    mod_object.children[0].data.materials[0].texture_slots[0].texture.image = image
+    mod_object.albam_imported_item.export_fingerprint = get_mesh_objects_fingerprint(mod_object.children, mod_object)
+    monkeypatch.setattr(blender_export, 'export_mod156', None)
+    monkeypatch.setattr(blender_export, 'dds_file_to_tex', lambda f, w: w.write(b'TEX\x00' + f.read()))
+
+    blender_export.export_arc(arc_object, str(tmpdir.join('exported.arc')))
+    assert tmpdir.join('exported.arc').read_binary() == arc_object.albam_imported_item.data
+
+    image.is_dirty = True
+    blender_export.export_arc(arc_object, str(tmpdir.join('exported_2.arc')))
+    _, exported_entries = _read_entries(str(tmpdir.join('exported_2.arc')))
+    assert set(exported_entries) == set(entries) | {MODEL_DIR + '\\shared_BM.tex'}
+    assert '/arc/shared.arc' in capsys.readouterr().out
+
+
+def test_export_arc_reduced_texture_only_if_modified(monkeypatch, tmpdir, capsys):
+    arc_object, mod_object, _ = _export_setup(monkeypatch, tmpdir)
+    image = mod_object.children[0].data.materials[0].texture_slots[0].texture.image
+    image.props['albam_mipmap_bias'] = 2
+    monkeypatch.setattr(blender_export, 'export_mod156', None)
+    monkeypatch.setattr(blender_export, 'dds_file_to_tex', lambda f, w: w.write(b'TEX\x00' + f.read()))
+
+    blender_export.export_arc(arc_object, str(tmpdir.join('exported.arc')))
+    assert tmpdir.join('exported.arc').read_binary() == arc_object.albam_imported_item.data
+
+    image.is_dirty = True
+    blender_export.export_arc(arc_object, str(tmpdir.join('exported_2.arc')))
+    exported_arc = Arc(file_path=str(tmpdir.join('exported_2.arc')))
+    exported_arc.unpack(str(tmpdir.join('out')))
+    assert tmpdir.join('out', *TEX_PATH.split('\\')).read_binary() == b'TEX\x00DDS '
+    assert '1/4 of its resolution' in capsys.readouterr().out
+
+
+def _grid_object(name, size):
+    """A mesh object with a grid of <size>x<size> quads, triangulated"""
+    row = size + 1
+    polygons = []
+    for y in range(size):
+        for x in range(size):
+            a, b, c, d = y * row + x, y * row + x + 1, (y + 1) * row + x, (y + 1) * row + x + 1
+            for vertices in ((a, b, c), (b, d, c)):
+                edge_keys = tuple(tuple(sorted(e)) for e in zip(vertices, vertices[1:] + vertices[:1]))
+                polygons.append(blender_export.Polygon(len(polygons), vertices, edge_keys))
+    material = SimpleNamespace(name='material', use_cast_shadows=True)
+    mesh = FakeData(name=name, vertices=[SimpleNamespace(index=i) for i in range(row * row)],
+                    polygons=polygons, materials=[material])
+    return SimpleNamespace(name=name, type='MESH', data=mesh, vertex_groups=[], modifiers=[])
+
+
+def test_split_mesh():
+    ob = _grid_object('grid', 10)
+    assert blender_export._split_mesh(ob, 0, {}, 121)[0].vertex_indices is None
+
+    parts = blender_export._split_mesh(ob, 3, {}, 40)
+
+    assert len(parts) > 1
+    triangles = []
+    for part in parts:
+        assert part.mesh_index == 3
+        assert len(part.vertex_indices) <= 40
+        assert sorted({v for p in part.polygons for v in p.vertices}) == list(range(len(part.vertex_indices)))
+        triangles.extend(tuple(part.vertex_indices[v] for v in p.vertices) for p in part.polygons)
+    assert triangles == [p.vertices for p in ob.data.polygons]
+
+
+def test_export_meshes_segments(monkeypatch):
+    monkeypatch.setattr(blender_export, 'MAX_MESH_VERTICES', 100)
+    attributes_calls = []
+    exported_attributes = []
+
+    def get_vertex_attributes(ob):
+        attributes_calls.append(ob.name)
+        return blender_export.VertexAttributes({}, {}, {})
+
+    def export_vertices(ob, bbox, mesh_index, bone_palette, vertex_indices=None, weights_per_vertex=None,
+                        vertex_attributes=None):
+        exported_attributes.append((ob.name, vertex_attributes))
+        return (VertexFormat0 * (len(ob.data.vertices) if vertex_indices is None
+                                 else len(vertex_indices)))(), set()
+
+    monkeypatch.setattr(blender_export, '_get_vertex_attributes', get_vertex_attributes)
+    monkeypatch.setattr(blender_export, '_export_vertices', export_vertices)
+    blender_meshes = [_grid_object('a', 6), _grid_object('b', 6), _grid_object('c', 12)]  # 49, 49, 169 vertices
+    exported_materials = SimpleNamespace(materials_mapping={'material': 0})
+
+    exported = blender_export._export_meshes(blender_export._get_mesh_parts(blender_meshes), None, {},
+                                             exported_materials)
+
+    # Once per object, shared by the parts it's split in
+    assert attributes_calls == ['a', 'b', 'c']
+    assert len(exported_attributes) > 3
+    assert len({id(attributes) for name, attributes in exported_attributes if name == 'c'}) == 1
+
+    meshes = exported.meshes_array
+    assert len(meshes) > 3
+    assert meshes[0].vertex_offset == meshes[1].vertex_offset == 0
+    assert meshes[2].vertex_offset == 98 * 32
+    total_vertices = len(exported.vertex_buffer) // 32
+    assert sum(m.vertex_count for m in meshes) == total_vertices
+    for mesh in meshes:
+        assert mesh.vertex_index_end < 100
+        indices = exported.index_buffer[mesh.face_position: mesh.face_position + mesh.face_count]
+        assert min(indices) == mesh.vertex_index_start_1
+        assert max(indices) == mesh.vertex_index_end
+        assert mesh.vertex_offset // 32 + mesh.vertex_index_end < total_vertices
+
+
+def test_split_mesh_by_bones():
+    ob = _grid_object('grid', 10)
+    # Each column of vertices influenced by its own 4 bones: 44 bones in total
+    weights_per_vertex = {v.index: [((v.index % 11) * 4 + b, 64) for b in range(4)]
+                          for v in ob.data.vertices}
+
+    parts = blender_export._split_mesh(ob, 0, weights_per_vertex)
+
+    assert len(parts) == 2
+    for part in parts:
+        used_bones = {bi for vi in part.vertex_indices for bi, _ in weights_per_vertex[vi]}
+        assert part.bone_indices == used_bones
+        assert len(part.bone_indices) <= 32
+    triangles = sorted(tuple(part.vertex_indices[v] for v in p.vertices) for part in parts for p in part.polygons)
+    assert triangles == sorted(p.vertices for p in ob.data.polygons)
+
+
+def _part(bone_indices):
+    return blender_export.MeshPart(SimpleNamespace(name='mesh'), 0, None, [], set(bone_indices), {})
+
+
+def test_create_bone_palettes():
+    # In object order, greedily, these would need 3 palettes
+    parts = [_part(range(0, 20)), _part(range(20, 40)), _part(range(0, 16)), _part(range(20, 32)), _part(())]
+
+    palettes = blender_export._create_bone_palettes(parts)
+
+    assert list(palettes.items()) == [(frozenset({0, 2, 4}), list(range(0, 20))),
+                                      (frozenset({1, 3}), list(range(20, 40)))]
+    with pytest.raises(RuntimeError):
+        blender_export._create_bone_palettes([_part(range(33))])
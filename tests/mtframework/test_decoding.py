@@ -0,0 +1,131 @@
+import os
+import pickle
+from types import SimpleNamespace
+
+import pytest
+
+from albam.engines.mtframework import Mod156
+from albam.engines.mtframework import blender_import, decoding
+from albam.engines.mtframework.decoding import (
+    decode_mesh_arrays,
+    decode_bone_arrays,
+    decode_mod,
+    DecodedMod,
+    ModDecoder,
+    )
+from albam.lib.cache import FileCache
+from tests.mtframework.generators import generate_mod156, generate_arc_entries, arc_from_entries
+
+
+@pytest.fixture
+def mod_files(tmpdir):
+    paths = []
+    for i, bone_count in enumerate((16, 0, 4)):
+        path = str(tmpdir.join('mod_{}.mod'.format(i)))
+        with open(path, 'wb') as w:
+            w.write(bytes(generate_mod156(mesh_count=3, vertex_count=50 + i, bone_count=bone_count, seed=i)))
+        paths.append(path)
+    return paths
+
+
+def _assert_same_arrays(decoded, mod):
+    expected_mod_arrays = decode_bone_arrays(mod)
+    assert {k: v.tolist() for k, v in decoded.arrays.items()} == \
+        {k: v.tolist() for k, v in expected_mod_arrays.items()}
+    assert len(decoded.meshes) == mod.mesh_count
+    for decoded_mesh, mesh in zip(decoded.meshes, mod.meshes_array):
+        assert decoded_mesh.error is None
+        assert decoded_mesh.vertex_count == mesh.vertex_count
+        expected = decode_mesh_arrays(mod, mesh)
+        assert {k: v.tolist() for k, v in decoded_mesh.arrays.items()} == \
+            {k: v.tolist() for k, v in expected.items()}
+
+
+def test_decoder_pool_same_as_in_process(mod_files):
+    with ModDecoder(max_workers=2) as decoder:
+        for mod_path, decoded in zip(mod_files, decoder.map(mod_files)):
+            with decoded:
+                assert decoded.file_path == mod_path
+                _assert_same_arrays(decoded, Mod156(file_path=mod_path))
+
+
+def test_decoded_mod_pickled_fallback(mod_files, monkeypatch):
+    monkeypatch.setattr(decoding, 'USE_SHARED_MEMORY', False)
+    descriptor = decode_mod(mod_files[0])
+    assert descriptor.shm_name is None
+    with DecodedMod(descriptor) as decoded:
+        _assert_same_arrays(decoded, Mod156(file_path=mod_files[0]))
+
+
+@pytest.mark.skipif(not decoding.USE_SHARED_MEMORY, reason='Shared memory not available')
+def test_decoded_mod_close_frees_shared_memory(mod_files):
+    with ModDecoder(max_workers=1) as decoder:
+        descriptor = decoder.submit(mod_files[0]).result()
+    decoded = DecodedMod(descriptor)
+    assert decoded.meshes[0].arrays['locations'][0] == pytest.approx(
+        decode_mesh_arrays(*_first_mesh(mod_files[0]))['locations'][0])
+    decoded.close()
+
+    with pytest.raises(FileNotFoundError):
+        decoding.shared_memory.SharedMemory(name=descriptor.shm_name)
+
+
+@pytest.mark.skipif(not decoding.USE_SHARED_MEMORY, reason='Shared memory not available')
+def test_mod_descriptor_tracked_when_received(mod_files, monkeypatch):
+    calls = []
+    monkeypatch.setattr(decoding, 'resource_tracker', SimpleNamespace(
+        register=lambda name, rtype: calls.append(('register', name, rtype)),
+        unregister=lambda name, rtype: calls.append(('unregister', name, rtype))))
+    with ModDecoder(max_workers=1) as decoder:
+        descriptor = decoder.submit(mod_files[0]).result()
+    descriptor.release()
+
+    assert calls == [('register', '/' + descriptor.shm_name, 'shared_memory')]
+
+
+def test_mod_info_same_as_mod(mod_files):
+    mod = Mod156(file_path=mod_files[0])
+
+    descriptor = decode_mod(mod_files[0], mod)
+    descriptor.release()
+    mod_info = pickle.loads(pickle.dumps(descriptor.mod_info))
+
+    assert (mod_info.box_min_x, mod_info.box_max_z) == (mod.box_min_x, mod.box_max_z)
+    assert mod_info.bone_count == mod.bone_count
+    for name in ('bones_array', 'textures_array', 'materials_data_array'):
+        assert bytes(getattr(mod_info, name)) == bytes(getattr(mod, name))
+        # Built once, not on every access
+        assert getattr(mod_info, name) is getattr(mod_info, name)
+    assert bytes(pickle.loads(pickle.dumps(mod_info)).bones_array) == bytes(mod.bones_array)
+
+
+def _first_mesh(mod_path):
+    mod = Mod156(file_path=mod_path)
+    return mod, mod.meshes_array[0]
+
+
+def test_prefetch_arc(tmpdir, monkeypatch):
+    dds_cache = FileCache(str(tmpdir.join('dds')), extension='.dds')
+    monkeypatch.setattr(blender_import, '_dds_cache', dds_cache)
+    entries = generate_arc_entries(file_count=2, file_size=100, mod_count=2, tex_count=2,
+                                   tex_size=16, vertex_count=10)
+    arc_path = str(tmpdir.join('a.arc'))
+    with open(arc_path, 'wb') as w:
+        w.write(arc_from_entries(entries))
+
+    prefetched = blender_import.prefetch_arc(arc_path, texture_max_size=0)
+    try:
+        assert prefetched.report.ok
+        mod_paths = sorted(p for p in entries if p.endswith('.mod'))
+        assert sorted(prefetched.files) == mod_paths
+        for mod_path in mod_paths:
+            with DecodedMod(prefetched.files[mod_path]) as decoded:
+                _assert_same_arrays(decoded, Mod156(file_path=entries[mod_path]))
+        # Textures are converted ahead of the import
+        cached = sorted(p.basename for p in tmpdir.join('dds').visit('*.dds'))
+        assert cached == ['pl0000_00_BM.dds', 'pl0000_01_BM.dds']
+        converted = prefetched.files[mod_paths[0]].textures
+        assert sorted(t.name for t in converted.values()) == ['pl0000_00_BM', 'pl0000_01_BM']
+        assert sorted(os.path.basename(t.dds_path) for t in converted.values()) == cached
+    finally:
+        prefetched.release()
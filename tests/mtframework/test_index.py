@@ -0,0 +1,134 @@
+import os
+
+from albam.engines.mtframework import Mod156
+from albam.engines.mtframework.arc import read_file_entries, read_entry
+from albam.engines.mtframework.blender_import import _find_texture_file
+from albam.engines.mtframework.index import ArcIndex, EntryResolver
+from albam.lib.cache import FileCache
+from tests.mtframework.generators import generate_arc, generate_arc_entries, arc_from_entries
+
+
+def _write_arc(path, arc):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as w:
+        w.write(arc)
+
+
+def test_read_file_entries_only_reads_header(tmpdir):
+    entries = generate_arc_entries(file_count=3, file_size=100, tex_count=1)
+    arc_path = str(tmpdir.join('a.arc'))
+    _write_arc(arc_path, arc_from_entries(entries))
+
+    with open(arc_path, 'rb') as f:
+        header, file_entries = read_file_entries(f)
+        assert f.tell() == 8 + 80 * 4
+        contents = {fe.file_path.decode('ascii'): read_entry(f, fe) for fe in file_entries}
+
+    assert header.files_count == 4
+    assert contents == {os.path.splitext(k)[0]: v for k, v in entries.items()}
+
+
+def test_index_update_and_queries(tmpdir):
+    root = str(tmpdir.join('game'))
+    arc_1 = os.path.join(root, 'arc', 'a.arc')
+    arc_2 = os.path.join(root, 'arc', 'sub', 'b.arc')
+    _write_arc(arc_1, generate_arc(file_count=4, mod_count=1, tex_count=2, tex_size=16, vertex_count=10))
+    _write_arc(arc_2, generate_arc(file_count=2, tex_count=1, tex_size=16, seed=1))
+
+    with ArcIndex(str(tmpdir.join('index.sqlite'))) as index:
+        update = index.update(root)
+
+        assert sorted(update.added) == sorted([arc_1, arc_2])
+        assert index.archives_containing('pl0000.mod') == [arc_1]
+        assert index.archives_containing('PL0000_00_BM.tex') == [arc_1, arc_2]
+        entry = index.find('pawn\\pl\\pl0000\\model\\pl0000_01_BM.tex')[0]
+        assert (entry.archive_path, entry.extension, entry.content_hash) == (arc_1, 'tex', None)
+        assert len(index.list_archive(arc_2)) == 3
+
+        mod = Mod156(file_path=_extract(entry.archive_path, index.find('pl0000.mod')[0], tmpdir))
+        textures = index.find_textures(mod)
+        assert [len(found) for found in textures.values()] == [2, 1]
+
+
+def _extract(arc_path, index_entry, tmpdir):
+    with open(arc_path, 'rb') as f:
+        _, file_entries = read_file_entries(f)
+        fe = next(fe for fe in file_entries if fe.offset == index_entry.offset)
+        data = read_entry(f, fe)
+    path = str(tmpdir.join('extracted.mod'))
+    with open(path, 'wb') as w:
+        w.write(data)
+    return path
+
+
+def test_index_update_is_incremental(tmpdir):
+    root = str(tmpdir.join('game'))
+    arc_1 = os.path.join(root, 'a.arc')
+    arc_2 = os.path.join(root, 'b.arc')
+    _write_arc(arc_1, generate_arc(file_count=2))
+    _write_arc(arc_2, generate_arc(file_count=3))
+
+    with ArcIndex(str(tmpdir.join('index.sqlite'))) as index:
+        index.update(root)
+        _write_arc(arc_1, generate_arc(file_count=5))
+        os.utime(arc_1, (1, 1))
+        os.remove(arc_2)
+        update = index.update(root)
+
+        assert (update.added, update.updated, update.removed, update.unchanged) == ([], [arc_1], [arc_2], [])
+        assert len(index.list_archive(arc_1)) == 5
+        assert index.list_archive(arc_2) == []
+        assert index.update(root).unchanged == [arc_1]
+
+        hashed = index.update(root, hash_contents=True)
+        assert hashed.updated == [arc_1]
+        entry = index.list_archive(arc_1)[0]
+        assert index.find_by_hash(entry.content_hash)[0] == entry
+
+
+def test_entry_resolver_extracts_from_other_archives(tmpdir):
+    root = str(tmpdir.join('game'))
+    shared_entries = generate_arc_entries(file_count=2, tex_count=2, tex_size=16)
+    model_arc = os.path.join(root, 'model.arc')
+    shared_arc = os.path.join(root, 'shared.arc')
+    _write_arc(model_arc, generate_arc(file_count=1, mod_count=1, vertex_count=10))
+    _write_arc(shared_arc, arc_from_entries(shared_entries))
+    base_dir = str(tmpdir.join('model_arc_extracted'))
+    texture_path = 'pawn\\pl\\pl0000\\model\\pl0000_01_BM'
+
+    with ArcIndex(str(tmpdir.join('index.sqlite'))) as index:
+        index.update(root)
+        resolver = EntryResolver(index, cache=FileCache(str(tmpdir.join('cache'))))
+
+        path, source_vfs = _find_texture_file(texture_path, base_dir, resolver)
+        assert source_vfs is None
+        assert resolver.archive_paths[path] == os.path.abspath(shared_arc)
+        os.remove(shared_arc)
+        # cached, the arc is not read again
+        assert resolver.resolve(texture_path + '.tex') == path
+        assert EntryResolver(index, cache=resolver.cache).resolve(texture_path + '.tex') == path
+        assert _find_texture_file('pawn\\missing', base_dir, resolver) == (None, None)
+
+    assert os.path.basename(path) == 'pl0000_01_BM.tex'
+    with open(path, 'rb') as f:
+        assert f.read() == shared_entries[texture_path + '.tex']
+
+
+def test_entry_resolver_extracts_again_from_archive_rewritten_in_place(tmpdir):
+    root = str(tmpdir.join('game'))
+    shared_arc = os.path.join(root, 'shared.arc')
+    _write_arc(shared_arc, generate_arc(file_count=1, tex_count=1, tex_size=16))
+    texture_path = 'pawn\\pl\\pl0000\\model\\pl0000_00_BM.tex'
+    cache = FileCache(str(tmpdir.join('cache')))
+
+    with ArcIndex(str(tmpdir.join('index.sqlite'))) as index:
+        index.update(root)
+        path = EntryResolver(index, cache=cache).resolve(texture_path)
+        # Same layout, e.g. a re-exported texture of the same size
+        stat = os.stat(shared_arc)
+        os.utime(shared_arc, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        index.update(root)
+        path_after = EntryResolver(index, cache=cache).resolve(texture_path)
+
+    assert path_after != path
+    assert os.path.isfile(path_after)
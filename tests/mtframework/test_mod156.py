@@ -0,0 +1,83 @@
+import ctypes
+from io import BytesIO
+
+import pytest
+
+from albam.engines.mtframework import Mod156
+from albam.engines.mtframework.mod_156 import (
+    Mod156Header,
+    MOD156_SECTIONS,
+    MOD156_OFFSETS,
+    plan_mod156_layout,
+    write_mod156,
+    )
+from albam.engines.mtframework.utils import get_vertices_array, get_indices_array
+from albam.lib.blender import strip_triangles_to_triangles_list
+from tests.mtframework.generators import generate_mod156
+
+
+@pytest.mark.parametrize('bone_count', (0, 40))
+def test_mod156_synthetic_parse(bone_count):
+    mod_bytes = bytes(generate_mod156(mesh_count=3, vertex_count=300, bone_count=bone_count))
+
+    mod = Mod156(file_path=BytesIO(mod_bytes))
+
+    assert bytes(mod) == mod_bytes
+    assert mod.mesh_count == 3
+    assert mod.bone_count == bone_count
+    for mesh in mod.meshes_array:
+        vertices = get_vertices_array(mod, mesh)
+        triangles = strip_triangles_to_triangles_list(get_indices_array(mod, mesh))
+        assert len(vertices) == 300
+        assert len(triangles) == 298 * 3
+        assert max(triangles) == 299
+
+
+def test_mod156_synthetic_indices_past_ushort():
+    vertex_count = 40000
+    mod = Mod156(file_path=BytesIO(bytes(generate_mod156(mesh_count=2, vertex_count=vertex_count))))
+
+    base = ctypes.addressof(mod.vertex_buffer)
+    for mesh_index, mesh in enumerate(mod.meshes_array):
+        vertices = get_vertices_array(mod, mesh)
+        indices = get_indices_array(mod, mesh)
+        mesh_start = base + mesh_index * vertex_count * mesh.vertex_stride
+        assert ctypes.addressof(vertices) == mesh_start
+        assert len(vertices) == vertex_count
+        assert min(indices) == mesh.vertex_index_start_1
+        assert max(indices) == mesh.vertex_index_end
+        for i in (min(indices), max(indices)):
+            address = base + mesh.vertex_offset + i * mesh.vertex_stride
+            assert mesh_start <= address < mesh_start + vertex_count * mesh.vertex_stride
+    assert mod.meshes_array[1].vertex_offset == vertex_count * mod.meshes_array[1].vertex_stride
+
+
+def _split_mod156(mod):
+    header = Mod156Header.from_buffer_copy(bytes(mod))
+    for field_name, _ in MOD156_OFFSETS:
+        setattr(header, field_name, 0)
+    return header, {name: getattr(mod, name) for name in MOD156_SECTIONS}
+
+
+@pytest.mark.parametrize('bone_count', (0, 40))
+def test_write_mod156_same_as_mod156(bone_count):
+    mod = generate_mod156(mesh_count=3, vertex_count=300, bone_count=bone_count)
+    header, sections = _split_mod156(mod)
+    # Any buffer works, not only ctypes arrays
+    sections['vertex_buffer'] = bytearray(sections['vertex_buffer'])
+
+    offsets, size = plan_mod156_layout(sections)
+    w = BytesIO()
+    written = write_mod156(w, header, sections)
+
+    assert w.getvalue() == bytes(mod)
+    assert written == size == len(bytes(mod))
+    assert offsets['index_buffer'] == mod.index_buffer_offset
+
+
+def test_write_mod156_checks_sizes():
+    header, sections = _split_mod156(generate_mod156(mesh_count=1, vertex_count=30))
+    header.vertex_buffer_size += 1
+
+    with pytest.raises(ValueError):
+        write_mod156(BytesIO(), header, sections)
@@ -0,0 +1,67 @@
+from io import BytesIO
+import os
+
+from albam.engines.mtframework import Tex112
+from albam.engines.mtframework.tex import tex_file_to_dds, dds_file_to_tex, get_mipmap_bias
+from albam.image_formats.dds import DDS
+from tests.mtframework.generators import generate_tex
+
+
+def test_tex_file_to_dds_same_as_to_dds(tmpdir):
+    tex = generate_tex(width=64, height=32, fmt=b'DXT5')
+    tex_path = os.path.join(str(tmpdir), 'texture.tex')
+    dds_path = os.path.join(str(tmpdir), 'texture.dds')
+    with open(tex_path, 'wb') as w:
+        w.write(tex)
+
+    with open(tex_path, 'rb') as f, open(dds_path, 'wb') as w:
+        tex_file_to_dds(f, w)
+    written = BytesIO()
+    tex.write_dds(written)
+
+    with open(dds_path, 'rb') as f:
+        dds_bytes = f.read()
+    assert dds_bytes == bytes(tex.to_dds())
+    assert written.getvalue() == dds_bytes
+
+
+def test_dds_file_to_tex_same_as_from_dds(tmpdir):
+    dds = generate_tex(width=64, height=32, fmt=b'DXT5').to_dds()
+    dds_path = os.path.join(str(tmpdir), 'texture.dds')
+    with open(dds_path, 'wb') as w:
+        w.write(dds)
+
+    with open(dds_path, 'rb') as f:
+        out = BytesIO()
+        dds_file_to_tex(f, out)
+
+    assert out.getvalue() == bytes(Tex112.from_dds(dds_path))
+
+
+def test_tex_file_to_dds_mipmap_bias(tmpdir):
+    tex = generate_tex(width=64, height=32, fmt=b'DXT5')
+    tex_path = os.path.join(str(tmpdir), 'texture.tex')
+    with open(tex_path, 'wb') as w:
+        w.write(tex)
+    level_2_offset = tex.mipmap_offsets[2] - tex.mipmap_offsets[0]
+
+    out = BytesIO()
+    with open(tex_path, 'rb') as f:
+        tex_file_to_dds(f, out, mipmap_bias=2)
+    written = BytesIO()
+    tex.write_dds(written, mipmap_bias=2)
+
+    dds_path = os.path.join(str(tmpdir), 'texture.dds')
+    with open(dds_path, 'wb') as w:
+        w.write(out.getvalue())
+    dds = DDS(file_path=dds_path)
+    assert (dds.header.dwWidth, dds.header.dwHeight, dds.header.dwMipMapCount) == (16, 8, 5)
+    assert bytes(dds.data) == bytes(tex.dds_data)[level_2_offset:]
+    assert written.getvalue() == out.getvalue()
+
+
+def test_get_mipmap_bias():
+    assert get_mipmap_bias(2048, 1024, 0) == 0
+    assert get_mipmap_bias(2048, 1024, 2048) == 0
+    assert get_mipmap_bias(2048, 1024, 512) == 2
+    assert get_mipmap_bias(1024, 2048, 500) == 3
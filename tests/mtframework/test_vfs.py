@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from albam.engines.mtframework import Mod156
+from albam.engines.mtframework.blender_import import _find_texture_file
+from albam.engines.mtframework.vfs import ArcFileSystem
+from tests.mtframework.generators import generate_arc_entries, arc_from_entries
+
+
+MODEL_DIR = 'pawn\\pl\\pl0000\\model'
+
+
+@pytest.fixture
+def arc_files(tmpdir):
+    entries_1 = generate_arc_entries(file_count=3, file_size=100, mod_count=1, tex_count=2,
+                                     tex_size=16, vertex_count=10)
+    entries_2 = generate_arc_entries(file_count=1, file_size=200, tex_count=1, tex_size=32, seed=1)
+    paths = []
+    for name, entries in (('a.arc', entries_1), ('b.arc', entries_2)):
+        path = str(tmpdir.join(name))
+        with open(path, 'wb') as w:
+            w.write(arc_from_entries(entries))
+        paths.append(path)
+    return paths, entries_1, entries_2
+
+
+def test_vfs_listing(arc_files):
+    paths, entries_1, _ = arc_files
+    vfs = ArcFileSystem(paths[:1])
+
+    assert vfs.listdir() == ['data', 'pawn']
+    assert vfs.listdir('PAWN/pl/pl0000/model') == ['pl0000.mod', 'pl0000_00_BM.tex', 'pl0000_01_BM.tex']
+    assert vfs.isdir('data\\dir_00') and not vfs.isfile('data\\dir_00')
+    assert vfs.exists(MODEL_DIR + '\\pl0000.mod')
+    assert not vfs.exists(MODEL_DIR + '\\missing.tex')
+    assert vfs.find('.tex') == [MODEL_DIR + '\\pl0000_00_BM.tex', MODEL_DIR + '\\pl0000_01_BM.tex']
+    with pytest.raises(FileNotFoundError):
+        vfs.listdir('missing')
+    with pytest.raises(FileNotFoundError):
+        vfs.read('missing.tex')
+
+
+def test_vfs_read_and_later_mounts_win(arc_files):
+    paths, entries_1, entries_2 = arc_files
+    vfs = ArcFileSystem(paths)
+    texture = MODEL_DIR + '\\pl0000_00_BM.tex'
+
+    assert vfs.read(texture) == entries_2[texture]
+    assert vfs.read(MODEL_DIR + '\\pl0000_01_BM.tex') == entries_1[MODEL_DIR + '\\pl0000_01_BM.tex']
+    mod = Mod156(file_path=vfs.open(MODEL_DIR + '\\pl0000.mod'))
+    assert mod.vertex_count == 40
+
+
+def test_vfs_cache_is_bounded(arc_files):
+    paths, entries_1, _ = arc_files
+    vfs = ArcFileSystem(paths[:1], cache_size=250)
+    files = ['data\\dir_00\\file_0000.sbc', 'data\\dir_01\\file_0001.efs', 'data\\dir_02\\file_0002.rtex']
+
+    for f in files:
+        assert vfs.read(f) == entries_1[f]
+
+    assert list(vfs._cache) == [f.lower() for f in files[1:]]
+    assert vfs._cached_bytes == 200
+    vfs.read(MODEL_DIR + '\\pl0000.mod')  # bigger than the cache, not kept
+    assert vfs._cached_bytes == 200
+
+
+def test_find_texture_file_in_vfs(arc_files):
+    paths, _, _ = arc_files
+    vfs = ArcFileSystem(paths[:1])
+
+    assert _find_texture_file(MODEL_DIR + '\\pl0000_01_BM', None, vfs=vfs) == \
+        (MODEL_DIR + '\\pl0000_01_BM.tex', vfs)
+    assert _find_texture_file(MODEL_DIR + '\\missing', None, vfs=vfs) == (None, None)
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from albam.cli import main
+from albam.engines.mtframework import Arc
+from tests.mtframework.generators import generate_arc, generate_tex
+
+
+def _create_files(root, files):
+    for relative_path, content in files.items():
+        path = os.path.join(root, *relative_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as w:
+            w.write(content)
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_unpack_pack(tmpdir, jobs):
+    files = {'pawn/model/pl0000.mod': b'MOD\x00' * 100,
+             'pawn/model/pl0000_BM.tex': b'TEX\x00' * 50}
+    source_dir = os.path.join(str(tmpdir), 'source')
+    arcs_dir = os.path.join(str(tmpdir), 'arcs')
+    _create_files(source_dir, files)
+    os.makedirs(os.path.join(arcs_dir, 'sub'))
+    for name in ('uPl00.arc', 'sub/uPl01.arc'):
+        with open(os.path.join(arcs_dir, name), 'wb') as w:
+            w.write(Arc.from_dir(source_dir))
+    unpacked = os.path.join(str(tmpdir), 'unpacked')
+    packed = os.path.join(str(tmpdir), 'packed')
+
+    assert main(['unpack', arcs_dir, '-o', unpacked, '-j', str(jobs)]) == 0
+    assert main(['pack', os.path.join(unpacked, 'uPl00'), os.path.join(unpacked, 'sub', 'uPl01'),
+                 '-o', packed, '-j', str(jobs)]) == 0
+
+    for name in ('uPl00', os.path.join('sub', 'uPl01')):
+        with open(os.path.join(unpacked, name, 'pawn', 'model', 'pl0000.mod'), 'rb') as f:
+            assert f.read() == files['pawn/model/pl0000.mod']
+    with open(os.path.join(packed, 'uPl00.arc'), 'rb') as f:
+        assert f.read() == bytes(Arc.from_dir(source_dir))
+
+
+def test_errors_are_isolated(tmpdir, capsys):
+    tex_dir = os.path.join(str(tmpdir), 'textures')
+    _create_files(tex_dir, {'bad.tex': b'not a tex'})
+    with open(os.path.join(tex_dir, 'good.tex'), 'wb') as w:
+        w.write(generate_tex())
+
+    assert main(['tex2dds', tex_dir, '-j', '2']) == 1
+
+    assert os.path.isfile(os.path.join(tex_dir, 'good.dds'))
+    assert 'bad.tex' in capsys.readouterr().err
+
+
+def test_pack_continues_after_not_a_directory(tmpdir, capsys):
+    source_dir = os.path.join(str(tmpdir), 'uPl00')
+    _create_files(source_dir, {'pawn/model/pl0000.mod': b'MOD\x00' * 100})
+    missing = os.path.join(str(tmpdir), 'missing')
+    packed = os.path.join(str(tmpdir), 'packed')
+
+    assert main(['pack', missing, source_dir, '-o', packed]) == 1
+
+    assert os.path.isfile(os.path.join(packed, 'uPl00.arc'))
+    assert 'missing' in capsys.readouterr().err
+
+
+def test_tex2dds_dds2tex(tmpdir):
+    tex = generate_tex()
+    tex_path = os.path.join(str(tmpdir), 'texture.tex')
+    with open(tex_path, 'wb') as w:
+        w.write(tex)
+    out = os.path.join(str(tmpdir), 'out')
+
+    assert main(['tex2dds', tex_path, '-o', out]) == 0
+    assert main(['dds2tex', os.path.join(out, 'texture.dds'), '-o', out]) == 0
+
+    with open(os.path.join(out, 'texture.dds'), 'rb') as f:
+        assert f.read() == bytes(tex.to_dds())
+    assert main(['info', os.path.join(out, 'texture.tex')]) == 0
+
+
+def test_index_and_find(tmpdir, capsys):
+    arcs_dir = os.path.join(str(tmpdir), 'arcs')
+    _create_files(arcs_dir, {'uPl00.arc': bytes(generate_arc(file_count=2, mod_count=1, vertex_count=10))})
+    db = os.path.join(str(tmpdir), 'index.sqlite')
+
+    assert main(['index', arcs_dir, '--db', db]) == 0
+    assert main(['find', 'pl0000.mod', '--db', db]) == 0
+    assert main(['find', 'missing.mod', '--db', db]) == 1
+
+    out = capsys.readouterr().out
+    assert '1 added' in out
+    assert 'uPl00.arc: pawn\\pl\\pl0000\\model\\pl0000.mod' in out
+
+
+def test_verify(tmpdir, capsys):
+    arcs_dir = os.path.join(str(tmpdir), 'arcs')
+    _create_files(arcs_dir, {'good.arc': bytes(generate_arc(file_count=2)),
+                             'bad.arc': b'ARC\x00' + bytes(10)})
+
+    assert main(['verify', arcs_dir, '--crc', '-j', '1']) == 1
+
+    captured = capsys.readouterr()
+    assert 'good.arc: OK, 2 files' in captured.out
+    assert 'crc32' in captured.out
+    assert 'Error processing {}'.format(os.path.join(arcs_dir, 'bad.arc')) in captured.err
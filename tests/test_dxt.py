@@ -0,0 +1,109 @@
+import struct
+
+import pytest
+
+from albam.engines.mtframework import Tex112
+from albam.image_formats.dxt import decode_dxt, decode_mipmap, encode_dxt, generate_mipmaps
+from albam.image_formats.dds import DDS
+
+np = pytest.importorskip('numpy')
+
+RED_565 = 0xf800
+BLUE_565 = 0x001f
+
+
+def test_decode_dxt1_four_colors():
+    # index 0 for the first row, 1 for the second, 2 for the third, 3 for the last
+    indices = 0b11111111101010100101010100000000
+    block = struct.pack('<HHI', RED_565, BLUE_565, indices)
+
+    pixels = decode_dxt(block, 4, 4, b'DXT1')
+
+    assert pixels.shape == (4, 4, 4)
+    assert pixels[0].tolist() == [[255, 0, 0, 255]] * 4
+    assert pixels[1].tolist() == [[0, 0, 255, 255]] * 4
+    assert pixels[2].tolist() == [[170, 0, 85, 255]] * 4
+    assert pixels[3].tolist() == [[85, 0, 170, 255]] * 4
+
+
+def test_decode_dxt1_three_colors_transparent():
+    block = struct.pack('<HHI', BLUE_565, RED_565, 0xffffffff)
+
+    pixels = decode_dxt(block, 4, 4, b'DXT1')
+
+    assert (pixels == 0).all()
+
+
+def test_decode_dxt5_alpha():
+    alpha_indices = sum(i % 8 << (3 * i) for i in range(16))
+    alpha_block = struct.pack('<BB', 255, 0) + alpha_indices.to_bytes(6, 'little')
+    color_block = struct.pack('<HHI', RED_565, BLUE_565, 0)
+
+    pixels = decode_dxt(alpha_block + color_block, 4, 4, b'DXT5')
+
+    expected = [255, 0] + [((7 - i) * 255) // 7 for i in range(1, 7)]
+    assert pixels[:, :, 3].flatten().tolist() == expected * 2
+    assert (pixels[:, :, :3] == [255, 0, 0]).all()
+
+
+def test_decode_mipmap_level_and_crop():
+    width, height = 8, 6
+    sizes = [DDS.calculate_mipmap_size(width, height, i, b'DXT1') for i in range(4)]
+    level_0 = struct.pack('<HHI', RED_565, RED_565, 0) * (sizes[0] // 8)
+    level_1 = struct.pack('<HHI', BLUE_565, BLUE_565, 0) * (sizes[1] // 8)
+    data = level_0 + level_1 + bytes(sizes[2] + sizes[3])
+
+    pixels_0 = decode_mipmap(data, width, height, b'DXT1', 0)
+    pixels_1 = decode_mipmap(data, width, height, b'DXT1', 1)
+
+    assert pixels_0.shape == (6, 8, 4)
+    assert (pixels_0 == [255, 0, 0, 255]).all()
+    assert pixels_1.shape == (3, 4, 4)
+    assert (pixels_1 == [0, 0, 255, 255]).all()
+
+
+@pytest.mark.parametrize('fmt', (b'DXT1', b'DXT3', b'DXT5'))
+def test_encode_decode_gradient(fmt):
+    y, x = np.mgrid[0:32, 0:16]
+    t = x + y * 4
+    rgba = np.stack((t, t // 2 + 40, 255 - t, 255 - t // 2), axis=-1).astype(np.uint8)
+    if fmt == b'DXT1':
+        rgba[:, :, 3] = 255
+
+    encoded = encode_dxt(rgba, fmt)
+    decoded = decode_dxt(encoded, 16, 32, fmt)
+
+    assert len(encoded) == DDS.calculate_mipmap_size(16, 32, 0, fmt)
+    error = np.abs(decoded.astype(int) - rgba.astype(int))
+    assert error[:, :, :3].max() <= 8
+    assert error[:, :, 3].max() <= 8
+
+
+def test_encode_solid_color_exact():
+    rgba = np.full((8, 8, 4), (255, 0, 255, 128), dtype=np.uint8)
+
+    decoded = decode_dxt(encode_dxt(rgba, b'DXT5'), 8, 8, b'DXT5')
+
+    assert (decoded == rgba).all()
+
+
+def test_generate_mipmaps():
+    rgba = np.zeros((8, 2, 4), dtype=np.uint8)
+    rgba[:, 1] = 255
+
+    mipmaps = generate_mipmaps(rgba)
+
+    assert [m.shape for m in mipmaps] == [(8, 2, 4), (4, 1, 4), (2, 1, 4), (1, 1, 4)]
+    assert (mipmaps[-1] == 128).all()
+
+
+def test_tex_from_rgba():
+    rgba = np.full((64, 32, 4), 200, dtype=np.uint8)
+
+    tex = Tex112.from_rgba(rgba, b'DXT1')
+
+    assert (tex.width, tex.height, tex.mipmap_count) == (32, 64, 7)
+    assert len(tex.dds_data) == sum(DDS.calculate_mipmap_size(32, 64, i, b'DXT1') for i in range(7))
+    assert tex.mipmap_offsets[1] - tex.mipmap_offsets[0] == DDS.calculate_mipmap_size(32, 64, 0, b'DXT1')
+    assert tex.to_rgba(3).shape == (8, 4, 4)
+    assert (tex.to_rgba(6) == tex.to_rgba(0)[0, 0]).all()
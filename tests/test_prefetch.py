@@ -0,0 +1,77 @@
+import multiprocessing.spawn
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from albam.lib.prefetch import PrefetchPool, get_mp_context
+
+
+class Result:
+
+    def __init__(self, value, released_path):
+        self.value = value
+        self.released_path = released_path
+        self.tracked = False
+
+    def track(self):
+        self.tracked = True
+
+    def release(self):
+        with open(self.released_path, 'a') as w:
+            w.write('{}\n'.format(self.value))
+
+
+def prefetch_double(file_path, **kwargs):
+    return Result(int(file_path) * 2, kwargs['released_path'])
+
+
+def prefetch_fail(file_path, **kwargs):
+    raise ValueError('broken file')
+
+
+@pytest.fixture
+def registry():
+    return {b'DBL\x00': prefetch_double, b'BAD\x00': prefetch_fail}
+
+
+def test_prefetch_pool(registry, tmpdir):
+    released_path = str(tmpdir.join('released.txt'))
+
+    with PrefetchPool(registry, max_workers=2) as pool:
+        for value in ('1', '2', '3'):
+            pool.submit(value, b'DBL\x00', released_path=released_path)
+        pool.submit('4', b'BAD\x00')
+        pool.submit('5', b'UNK\x00')
+
+        assert pool.get('2').value == 4
+        result = pool.get('1')
+        assert result.value == 2
+        assert pool.get('4') is None
+        assert pool.get('5') is None
+        assert pool.get('missing') is None
+
+    # Results are tracked when received, and all are released, including the ones never used
+    assert result.tracked
+    with open(released_path) as f:
+        assert sorted(f.read().split()) == ['2', '4', '6']
+
+
+def test_prefetch_pool_disabled(registry):
+    with PrefetchPool(registry, enabled=False) as pool:
+        pool.submit('1', b'DBL\x00', released_path='')
+        assert pool.get('1') is None
+
+
+def test_mp_context_spawns_blender_python(monkeypatch):
+    executables = []
+    monkeypatch.setattr(multiprocessing.spawn, 'set_executable', executables.append)
+    monkeypatch.delitem(sys.modules, 'bpy', raising=False)
+
+    assert get_mp_context().get_start_method() == 'spawn'
+    assert executables == []
+
+    blender = SimpleNamespace(app=SimpleNamespace(binary_path_python='/blender/2.80/python/bin/python3.7m'))
+    monkeypatch.setitem(sys.modules, 'bpy', blender)
+    assert get_mp_context().get_start_method() == 'spawn'
+    assert executables == ['/blender/2.80/python/bin/python3.7m']
@@ -0,0 +1,123 @@
+import json
+import os
+import tracemalloc
+
+from albam.engines.mtframework import Arc
+from albam.lib import profiling
+from albam.lib.profiling import activated, profile, span, count, profiled, PROFILE_ENV_VAR
+from tests.mtframework.generators import generate_arc
+
+
+def _read_report(reports_dir):
+    reports = os.listdir(reports_dir)
+    assert len(reports) == 1
+    with open(os.path.join(reports_dir, reports[0])) as f:
+        return json.load(f)
+
+
+def test_profile_disabled_by_default(tmpdir, monkeypatch):
+    monkeypatch.delenv(PROFILE_ENV_VAR, raising=False)
+    reports_dir = str(tmpdir.join('reports'))
+
+    with profile('import', reports_dir=reports_dir) as profiler:
+        with span('stage'):
+            count('vertices', 10)
+
+    assert profiler is None
+    assert not os.path.exists(reports_dir)
+
+
+def test_profile_nested_spans_and_counters(tmpdir, monkeypatch):
+    monkeypatch.setenv(PROFILE_ENV_VAR, 'memory')
+    reports_dir = str(tmpdir.join('reports'))
+
+    @profiled('inner')
+    def allocate():
+        count('vertices', 10)
+        return bytearray(1024 * 1024)
+
+    with profile('import', reports_dir=reports_dir, file_path='model.arc'):
+        with span('outer'):
+            allocate()
+            allocate()
+        count('faces', 3)
+
+    report = _read_report(reports_dir)
+    assert report['metadata'] == {'file_path': 'model.arc'}
+    assert report['counters'] == {'vertices': 20, 'faces': 3}
+    assert report['error'] is None
+    outer = report['spans']['children'][0]
+    assert outer['name'] == 'outer'
+    assert [c['name'] for c in outer['children']] == ['inner', 'inner']
+    assert outer['duration'] >= sum(c['duration'] for c in outer['children'])
+    assert outer['peak_memory'] >= 1024 * 1024
+    assert profiling._active_profiler is None
+
+
+def test_profile_records_only_when_activated(tmpdir):
+    reports_dir = str(tmpdir.join('reports'))
+
+    def step(name):
+        with span(name):
+            count('steps')
+            yield
+            count('steps')
+
+    with profile('import', enabled=True, reports_dir=reports_dir, activate=False) as profiler:
+        steps = step('first')
+        with activated(profiler):
+            next(steps)
+        # Another operator running in between steps
+        with span('unrelated'):
+            count('unrelated')
+        with profile('export', enabled=True, reports_dir=str(tmpdir.join('export_reports'))) as other:
+            assert other is not profiler
+        with activated(profiler):
+            next(steps, None)
+        assert profiling._active_profiler is None
+
+    report = _read_report(reports_dir)
+    assert report['counters'] == {'steps': 2}
+    assert [c['name'] for c in report['spans']['children']] == ['first']
+    assert _read_report(str(tmpdir.join('export_reports')))['name'] == 'export'
+
+
+def test_profile_keeps_tracing_started_by_caller(tmpdir, monkeypatch):
+    monkeypatch.setenv(PROFILE_ENV_VAR, 'memory')
+    tracemalloc.start()
+    try:
+        with profile('import', reports_dir=str(tmpdir.join('reports'))):
+            bytearray(1024)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    with profile('import', reports_dir=str(tmpdir.join('reports_2'))):
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_writes_report_on_error(tmpdir):
+    reports_dir = str(tmpdir.join('reports'))
+
+    try:
+        with profile('export', enabled=True, reports_dir=reports_dir):
+            raise ValueError('bad mesh')
+    except ValueError:
+        pass
+
+    report = _read_report(reports_dir)
+    assert 'bad mesh' in report['error']
+    assert 'peak_memory' not in report['spans']
+
+
+def test_profile_counts_arc_bytes(tmpdir):
+    reports_dir = str(tmpdir.join('reports'))
+    arc_path = str(tmpdir.join('test.arc'))
+    with open(arc_path, 'wb') as w:
+        w.write(generate_arc(file_count=4, file_size=1000))
+
+    with profile('unpack', enabled=True, reports_dir=reports_dir):
+        Arc(file_path=arc_path).unpack(str(tmpdir.join('out')))
+
+    assert _read_report(reports_dir)['counters'] == {'bytes_decompressed': 4000}
@@ -0,0 +1,46 @@
+import subprocess
+import sys
+
+import pytest
+
+from albam.engines import LAZY_REGISTRATIONS
+from albam.registry import AlbamRegistry, FunctionRegistry, albam_registry
+
+
+def test_registry_doesnt_import_engines():
+    code = ('import sys\n'
+            'from albam.registry import albam_registry\n'
+            'assert b"MOD\\x00" in albam_registry.import_registry\n'
+            'assert not [m for m in sys.modules if m.startswith("albam.engines.mtframework")]\n'
+            'assert albam_registry.import_registry.get(b"MOD\\x00").__name__ == "import_mod"\n'
+            'assert "albam.engines.mtframework.blender_import" in sys.modules\n')
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_lazy_registrations_match_engine_modules():
+    # Importing the modules registers the real functions, which must all be in the metadata
+    for func_type, identifier, module_name in LAZY_REGISTRATIONS:
+        function_registry = albam_registry._get_function_registry(func_type)
+        assert function_registry.get(identifier) is not None
+        assert function_registry.get(identifier).__module__ == module_name
+
+    for func_type, function_registry in albam_registry._function_registries.items():
+        lazy = {identifier for t, identifier, _ in LAZY_REGISTRATIONS if t == func_type}
+        assert function_registry.identifiers() == lazy
+
+
+def test_function_registry_lazy_module_must_register(tmpdir, monkeypatch):
+    tmpdir.join('fake_engine.py').write('')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    function_registry = FunctionRegistry()
+    function_registry.register_lazy(b'FAKE', 'fake_engine')
+
+    assert b'FAKE' in function_registry
+    assert function_registry.get(b'MISS') is None
+    with pytest.raises(RuntimeError):
+        function_registry.get(b'FAKE')
+
+
+def test_register_function_invalid_type():
+    with pytest.raises(TypeError):
+        AlbamRegistry().register_function('unknown', b'MOD\x00')
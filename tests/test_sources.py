@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from albam.lib.cache import FileCache, get_file_stamp, hash_bytes
+from albam.lib.sources import read_magic, store_source, load_source
+from tests.mtframework.generators import generate_arc_entries, arc_from_entries
+
+
+def test_load_source_from_disk(tmpdir):
+    cache = FileCache(str(tmpdir.join('cache')))
+    path = str(tmpdir.join('model.mod'))
+    data = b'MOD\x00' + bytes(range(100))
+    with open(path, 'wb') as w:
+        w.write(data)
+
+    assert read_magic(path) == b'MOD\x00'
+    assert load_source(path, hash_bytes(data), cache=cache) == data
+    assert load_source(path, hash_bytes(data), embedded=b'embedded', cache=cache) == b'embedded'
+
+    with open(path, 'ab') as w:
+        w.write(b'modified')
+    with pytest.raises(RuntimeError):
+        load_source(path, hash_bytes(data), cache=cache)
+    os.remove(path)
+    with pytest.raises(RuntimeError):
+        load_source(path, hash_bytes(data), cache=cache)
+
+
+def test_load_source_from_archive_and_cache(tmpdir):
+    cache = FileCache(str(tmpdir.join('cache')))
+    entries = generate_arc_entries(file_count=2, mod_count=1, vertex_count=10)
+    arc_path = str(tmpdir.join('model.arc'))
+    with open(arc_path, 'wb') as w:
+        w.write(arc_from_entries(entries))
+    mod_path = 'pawn\\pl\\pl0000\\model\\pl0000.mod'
+    data = entries[mod_path]
+    content_hash = hash_bytes(data)
+
+    assert load_source(mod_path, content_hash, archive_path=arc_path, cache=cache) == data
+
+    store_source(content_hash, data, cache=cache)
+    os.remove(arc_path)
+    assert load_source(mod_path, content_hash, archive_path=arc_path, cache=cache) == data
+
+
+def test_load_source_by_stamp_or_exported_over(tmpdir):
+    cache = FileCache(str(tmpdir.join('cache')))
+    path = str(tmpdir.join('model.arc'))
+    data = b'ARC\x00' + bytes(range(100))
+    with open(path, 'wb') as w:
+        w.write(data)
+    stamp = get_file_stamp(path)
+
+    # Only referenced, not copied to the cache
+    assert load_source(path, '', cache=cache, source_stamp=stamp) == data
+    assert cache.size() == 0
+
+    with open(path, 'wb') as w:
+        w.write(b'exported')
+    assert load_source(path, '', cache=cache, source_stamp=stamp,
+                       exported_hash=hash_bytes(b'exported')) == b'exported'
+    with pytest.raises(RuntimeError):
+        load_source(path, '', cache=cache, source_stamp=stamp)
+
+    # Copied before the export overwrote it
+    store_source(hash_bytes(data), data, cache=cache)
+    assert load_source(path, hash_bytes(data), cache=cache, source_stamp=stamp) == data
@@ -0,0 +1,60 @@
+import ctypes
+from io import BytesIO
+import mmap
+import os
+
+import pytest
+
+from albam.engines.mtframework import Arc, Mod156, Tex112
+from albam.image_formats.dds import DDS
+from albam.lib.structure import get_source_size
+from tests.mtframework.generators import generate_arc, generate_mod156, generate_tex
+
+
+@pytest.mark.parametrize('source_type', ('bytes', 'bytearray', 'memoryview', 'bytesio', 'path', 'mmap'))
+@pytest.mark.parametrize('cls, generate', ((Arc, lambda: generate_arc(file_count=3)),
+                                           (Mod156, lambda: generate_mod156(vertex_count=20)),
+                                           (Tex112, lambda: generate_tex(32, 16)),
+                                           (DDS, lambda: generate_tex(32, 16).to_dds())))
+def test_parse_from_any_source(tmpdir, cls, generate, source_type):
+    data = bytes(generate())
+    path = os.path.join(str(tmpdir), 'file')
+    with open(path, 'wb') as w:
+        w.write(data)
+
+    if source_type == 'mmap':
+        with open(path, 'rb') as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        source = {'bytes': lambda: data,
+                  'bytearray': lambda: bytearray(data),
+                  'memoryview': lambda: memoryview(data),
+                  'bytesio': lambda: BytesIO(data),
+                  'path': lambda: path}[source_type]()
+
+    instance = cls(file_path=source)
+
+    assert get_source_size(path) == len(data)
+    assert bytes(instance) == data
+    if source_type == 'mmap':
+        del instance
+        source.close()
+
+
+def test_writable_buffers_are_not_copied():
+    data = bytearray(generate_mod156(vertex_count=20))
+
+    mod = Mod156(file_path=data)
+    mod.bone_count = 3
+
+    assert ctypes.addressof(mod) == ctypes.addressof(ctypes.c_char.from_buffer(data))
+    assert Mod156(file_path=bytes(data)).bone_count == 3
+
+
+def test_read_only_buffers_are_copied():
+    data = bytes(generate_tex(32, 16))
+
+    tex = Tex112(file_path=memoryview(data))
+    tex.width = 64
+
+    assert Tex112(file_path=data).width == 32
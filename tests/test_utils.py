@@ -2,6 +2,7 @@ import ctypes
 import struct
 import os
 
+from albam.lib.cache import FileCache
 from albam.lib.structure import DynamicStructure
 from albam.lib.half_float import unpack_half_float, pack_half_float
 from albam.lib.misc import ensure_posixpath, ensure_ntpath
@@ -73,3 +74,66 @@ def test_ensure_ntpath_from_ntpath():
     path = 'foo\\bar\\spam\\eggs'
 
     assert ensure_ntpath(path) == 'foo\\bar\\spam\\eggs'
+
+
+def test_file_cache_put_get(tmpdir):
+    cache = FileCache(str(tmpdir), extension='.dds')
+
+    assert cache.get('abcdef/texture') is None
+
+    path = cache.put('abcdef/texture', b'data')
+
+    assert cache.get('abcdef/texture') == path
+    assert os.path.basename(path) == 'texture.dds'
+    with open(path, 'rb') as f:
+        assert f.read() == b'data'
+
+
+def test_file_cache_evicts_least_recently_used(tmpdir):
+    cache = FileCache(str(tmpdir), max_size=10)
+    cache.put('aa', b'1234')
+    cache.put('bb', b'1234')
+    os.utime(cache.path_for('aa'), (0, 0))
+    os.utime(cache.path_for('bb'), (1, 1))
+    cache.get('aa')  # refreshes usage
+    assert os.stat(cache.path_for('aa')).st_mtime == 0  # still when it was written
+
+    cache.put('cc', b'1234')
+
+    assert cache.get('aa')
+    assert cache.get('bb') is None
+    assert cache.get('cc')
+    assert cache.size() == 8
+
+
+def test_file_cache_evicts_down_to_low_water(tmpdir, monkeypatch):
+    cache = FileCache(str(tmpdir), max_size=100, low_water=0.5)
+    for i in range(10):
+        os.utime(cache.put('{:02}'.format(i), b'0123456789'), (i, i))
+
+    cache.put('10', b'0123456789')
+
+    assert cache.size() == 50
+    assert sorted(os.listdir(str(tmpdir))) == ['06', '07', '08', '09', '10']
+
+    def walk_again():
+        raise AssertionError('the cache was walked again')
+    monkeypatch.setattr(cache, '_entries', walk_again)
+    cache.put('11', b'0123456789')
+    cache.put('11', b'01234')
+
+    assert cache.size() == 55
+
+
+def test_file_cache_keeps_entry_bigger_than_max_size(tmpdir):
+    cache = FileCache(str(tmpdir), max_size=10)
+    cache.put('aa', b'12345')
+
+    path = cache.put('bb', b'0123456789abcdef')
+
+    with open(path, 'rb') as f:
+        assert f.read() == b'0123456789abcdef'
+    assert cache.get('aa') is None
+    cache.put('cc', b'12345')
+    assert cache.get('bb') is None
+    assert cache.get('cc')